@@ -3,20 +3,146 @@ import os
 from re import A
 from tokenize import String
 from typing import Union, Dict, Literal
-import win32com.client as win32
 import numpy as np
+import tempfile
 import time
+from streams import StreamState, COMPONENTS
 
 
-class Simulation():
-    AspenSimulation = win32.gencache.EnsureDispatch("Apwn.Document")
+# ------------------------------------------------- BACKENDS -------------------------------------------------
+# The engine document is only started when the first Simulation is constructed, so
+# importing this module (and env/agent) does not pay the COM start-up. The backend
+# is taken from the `backend` argument, or from the AUTOPROCRL_BACKEND variable.
+
+def aspen_document():
+    import win32com.client as win32
+    return win32.gencache.EnsureDispatch("Apwn.Document")
+
+def standin_document():
+    from standin import StandInDocument
+    return StandInDocument()
+
+def remote_document():
+    # Warm document served by a running simserver.py
+    from simserver import RemoteDocument, DEFAULT_ADDRESS
+    return RemoteDocument(os.environ.get("AUTOPROCRL_SIMSERVER", DEFAULT_ADDRESS),
+                          int(os.environ.get("AUTOPROCRL_SIMSERVER_DOC", 0)))
+
+def record_document():
+    # Document of another backend whose traffic is recorded to a file (see record.py)
+    from record import RecordingDocument, recorder
+    target = os.environ.get("AUTOPROCRL_RECORD_BACKEND", "aspen")
+    return RecordingDocument(BACKENDS[target](), recorder(os.environ.get("AUTOPROCRL_RECORD_FILE", "engine.rec")))
+
+def replay_document():
+    # Offline document answering with the responses of a recording
+    from record import ReplayDocument, replayer
+    return ReplayDocument(replayer(os.environ.get("AUTOPROCRL_REPLAY_FILE", "engine.rec"),
+                                   strict=os.environ.get("AUTOPROCRL_REPLAY_STRICT", "1") != "0",
+                                   delay=os.environ.get("AUTOPROCRL_REPLAY_DELAY", "0") != "0"))
+
+BACKENDS = {
+    "aspen": aspen_document,
+    "standin": standin_document,
+    "remote": remote_document,
+    "record": record_document,
+    "replay": replay_document,
+}
+
+def register_backend(name, factory):
+    BACKENDS[name] = factory
+
+def default_backend():
+    return os.environ.get("AUTOPROCRL_BACKEND", "aspen")
+
+
+
+class EngineState():
+    '''Saved engine document: an in-memory copy when the backend supports it,
+    otherwise a temporary archive written with SaveAs'''
+    def __init__(self, kind, data):
+        self.kind = kind
+        self.data = data
 
-    def __init__(self, AspenFileName, WorkingDirectoryPath, VISIBILITY=False):
+    def discard(self):
+        if self.kind == "archive" and os.path.exists(self.data):
+            os.remove(self.data)
+        elif self.kind == "memory" and hasattr(self.data, "discard"):
+            self.data.discard()
+        self.data = None
+
+def save_document_state(doc):
+    if hasattr(doc, "snapshot_state"):
+        return EngineState("memory", doc.snapshot_state())
+    fd, path = tempfile.mkstemp(suffix=".bkp")
+    os.close(fd)
+    doc.SaveAs(path)
+    return EngineState("archive", path)
+
+def restore_document_state(doc, state):
+    if state.kind == "memory":
+        doc.restore_state(state.data)
+    else:
+        doc.InitFromArchive2(state.data)
+        doc.SuppressDialogs = True
+
+
+
+class SimulationError(Exception):
+    pass
+
+class EngineTimeout(SimulationError):
+    pass
+
+
+
+class Simulation():
+    AspenSimulation = None
+    backend = None
+    archive = None
+    visible = False
+    run_timeout = None  # Seconds a Run2 may take before the engine counts as hung
+    states = {}         # Stream name -> StreamState read since the last engine run
+
+    @staticmethod
+    def invalidate():
+        Simulation.states.clear()
+
+    def __init__(self, AspenFileName, WorkingDirectoryPath, VISIBILITY=False, backend=None):
         os.chdir(WorkingDirectoryPath)
-        self.AspenSimulation.InitFromArchive2(os.path.abspath(AspenFileName))
+        backend = backend or default_backend()
+        if Simulation.AspenSimulation is None or Simulation.backend != backend:
+            if backend not in BACKENDS:
+                raise ValueError(f"Unknown simulation backend '{backend}', choose from {sorted(BACKENDS)}")
+            Simulation.AspenSimulation = BACKENDS[backend]()
+            Simulation.backend = backend
+
+        Simulation.archive = os.path.abspath(AspenFileName)
+        Simulation.visible = VISIBILITY
+        self.invalidate()
+        self.AspenSimulation.InitFromArchive2(Simulation.archive)
         self.AspenSimulation.Visible = VISIBILITY
         self.AspenSimulation.SuppressDialogs = True
 
+    def Restart(self):
+        '''Replace a dead or hung engine with a new document opened from the archive'''
+        if Simulation.backend == "remote":
+            # The server replaces its document. Only the connection is ours: a new
+            # one, in case the old one waits on a hung request.
+            self.AspenSimulation.client.close()
+            Simulation.AspenSimulation = BACKENDS["remote"]()
+            Simulation.AspenSimulation.restart()
+        else:
+            try:
+                self.AspenSimulation.Close()
+            except Exception:
+                pass
+            Simulation.AspenSimulation = BACKENDS[Simulation.backend]()
+        self.invalidate()
+        self.AspenSimulation.InitFromArchive2(Simulation.archive)
+        self.AspenSimulation.Visible = Simulation.visible
+        self.AspenSimulation.SuppressDialogs = True
+
 
     def CloseAspen(self):
         AspenFileName = self.Give_AspenDocumentName()
@@ -35,12 +161,25 @@ class Simulation():
         return self.AspenSimulation.Tree.Elements("Data").Elements("Streams")
 
     def EngineRun(self):
-        self.AspenSimulation.Run2()
+        self.invalidate()
+        if self.run_timeout is None:
+            self.AspenSimulation.Run2()
+            return
+
+        # Run asynchronously and stop the engine when it hangs
+        self.AspenSimulation.Run2(True)
+        deadline = time.time() + self.run_timeout
+        while self.AspenSimulation.Engine.IsRunning:
+            if time.time() > deadline:
+                self.AspenSimulation.Stop()
+                raise EngineTimeout(f"Run2 did not finish within {self.run_timeout} s")
+            time.sleep(0.05)
 
     def EngineStop(self):
         self.AspenSimulation.Stop()
 
     def EngineReinit(self):
+        self.invalidate()
         self.AspenSimulation.Reinit()
 
     def Convergence(self):
@@ -55,10 +194,18 @@ class Simulation():
         self.BLK.Elements(Blockname).Elements("Ports").Elements(Portname).Elements.Remove(Streamname)
     
     def Reinitialize(self):
+        self.invalidate()
         self.STRM.RemoveAll()
         self.BLK.RemoveAll()
         self.AspenSimulation.Reinit()
 
+    def SaveState(self):
+        return save_document_state(self.AspenSimulation)
+
+    def RestoreState(self, state):
+        self.invalidate()
+        restore_document_state(self.AspenSimulation, state)
+
 
 
 class Stream(Simulation):
@@ -71,12 +218,21 @@ class Stream(Simulation):
         if self.inlet:
             self.inlet_stream()
     
+    @classmethod
+    def ref(cls, name):
+        # Wrapper of a stream that already exists in the simulation
+        s = cls.__new__(cls)
+        s.name = name.upper()
+        s.inlet = False
+        return s
+
 
     def StreamPlace(self):
         compositstring = self.name + "!" + "MATERIAL"
         self.STRM.Elements.Add(compositstring)
 
     def StreamDelete(self): 
+        Simulation.states.pop(self.name, None)
         self.STRM.Elements.Remove(self.name)
     
     def inlet_stream(self):
@@ -91,6 +247,24 @@ class Stream(Simulation):
             self.STRM.Elements(self.name).Elements("Input").Elements("FLOW").Elements("MIXED").Elements(
                 chemical).Value = comp[chemical]
     
+    def state(self):
+        '''Solved state of the stream, read from the engine once per run'''
+        state = Simulation.states.get(self.name)
+        if state is None:
+            doc = self.AspenSimulation
+            if hasattr(doc, "snapshot"):
+                # One round trip to a simulator server
+                state = StreamState.from_snapshot(doc.snapshot([self.name])[0])
+            else:
+                out = self.STRM.Elements(self.name).Elements("Output")
+                flows = out.Elements("MOLEFLOW").Elements("MIXED")
+                state = StreamState(out.Elements("TEMP_OUT").Elements("MIXED").Value,
+                                    out.Elements("PRES_OUT").Elements("MIXED").Value,
+                                    [flows.Elements(c).Value for c in COMPONENTS],
+                                    out.Elements("MOLEFLMX").Elements("MIXED").Value)
+            Simulation.states[self.name] = state
+        return state
+
     def get_temp(self):
         return self.STRM.Elements(self.name).Elements("Output").Elements("TEMP_OUT").Elements("MIXED").Value
     
@@ -638,6 +812,57 @@ class TriColumn(Block):
         return D, H
 
 
+class ShortcutColumn(Block):
+    '''Sep block reproducing the product split of a shortcut column estimate
+    (see shortcut.column), solved in place of a Radfrac for exploration'''
+    def __init__(self, name, estimate, inlet_stream, partial=False):
+        super().__init__(name, "Sep")
+        self.name = name
+        self.estimate = estimate
+        self.inlet_stream = inlet_stream
+        self.partial = partial
+        self.nstages = estimate["nstages"]
+
+        self.BlockCreate()
+
+    def distill(self):
+        self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
+        est = self.estimate
+        products = [("VOUT", "vap"), ("DOUT", "dist"), ("BOUT", "bott")] if self.partial else \
+            [("DOUT", "dist"), ("BOUT", "bott")]
+
+        streams = {}
+        for suffix, key in products:
+            s = Stream(f"{self.name}{suffix}")
+            self.StreamConnect(self.name, s.name, "P(OUT)")
+            streams[key] = s
+
+            # Outlet conditions
+            self.BLK.Elements(self.name).Elements("Input").Elements("TEMP").Elements(s.name).Value = est[f"T_{key}"]
+            self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Elements(s.name).Value = est["press"]
+
+        # Split fractions (the bottoms take the rest)
+        feed = est["feed"]
+        for suffix, key in products[:-1]:
+            for c, f in est[key].items():
+                frac = f/feed[c] if feed[c] > 0 else 0.
+                self.BLK.Elements(self.name).Elements("Input").Elements("FRACS").Elements(
+                    streams[key].name).Elements("MIXED").Elements(c).Value = frac
+
+        if self.partial:
+            return streams["dist"], streams["bott"], streams["vap"]
+        return streams["dist"], streams["bott"]
+
+    def enery_consumption(self):
+        return abs(self.estimate["cond_duty"]) + abs(self.estimate["reb_duty"])
+
+    def sizing(self):
+        D = self.estimate["diameter"]
+        H = 1.2*0.61*(self.nstages - 2)
+
+        return D, H
+
+
 
 class Flash(Block):
     def __init__(self, name, Temp, Press, inlet_stream):
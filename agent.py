@@ -6,6 +6,8 @@ import numpy as np
 from torch.distributions import Categorical, Beta, Normal
 import copy
 import math
+import os
+from collections import deque
 
 
 class HybridActorNetwork(nn.Module):
@@ -84,7 +86,8 @@ class PPO(object):
     def __init__(self, env_with_Dead, state_dim, actions, gamma=0.99, gae_lambda=0.95,
             net_width=200, lr=1e-4, policy_clip=0.2, n_epochs=10, batch_size=64,
             l2_reg=1e-3, entropy_coef=1e-3, adv_normalization=True,
-            entropy_coef_decay = 0.99):
+            entropy_coef_decay = 0.99, replay_window=1, rho_bar=1.0,
+            model_dir="./model", best_dir="./best_model"):
 
         self.env_with_Dead = env_with_Dead
         self.s_dim = state_dim
@@ -109,6 +112,14 @@ class PPO(object):
         
         # Replay buffer
         self.data = []
+
+        # Batches of the last `replay_window` updates, reused under truncated importance weights
+        self.replay = deque(maxlen=replay_window)
+        self.rho_bar = rho_bar
+
+        # Weight files of save() and best_save()
+        self.model_dir = model_dir
+        self.best_dir = best_dir
         
 
 
@@ -148,10 +159,7 @@ class PPO(object):
         return a_d, a_c
 
 
-    def train(self):
-        s, acts_d, acts_c, r, s_prime, logprob_d, logprob_c, dones, dws, masks = self.make_batch()
-        self.entropy_coef *= self.entropy_coef_decay #exploring decay
-
+    def advantages(self, r, s, s_prime, dones, dws):
         ''' Use TD+GAE+LongTrajectory to compute Advantage and TD target'''
         with torch.no_grad():
             vs = self.critic(s)
@@ -170,8 +178,39 @@ class PPO(object):
             adv = copy.deepcopy(adv[:-1])
             adv = torch.tensor(adv).unsqueeze(1).float()
             td_target = adv + vs
-            if self.adv_normalization:
-                adv = (adv - adv.mean()) / ((adv.std() + 1e-8))  
+        return adv, td_target
+
+
+    def replay_batch(self):
+        '''Transitions of the replay window with GAE from the current critic. The PPO
+        ratios are taken against the policy at the start of this update (anchor), and
+        samples of older policies are weighted by min(anchor/behaviour, rho_bar).'''
+        batches = [(b, *self.advantages(b[3], b[0], b[4], b[7], b[8])) for b in self.replay]
+        cat = lambda i: torch.cat([b[i] for b, _, _ in batches])
+        s, acts_d, acts_c, logprob_d, logprob_c, masks = cat(0), cat(1), cat(2), cat(5), cat(6), cat(9)
+        adv = torch.cat([adv for _, adv, _ in batches])
+        td_target = torch.cat([td_target for _, _, td_target in batches])
+
+        with torch.no_grad():
+            prob_d, alpha, beta = self.actor.forward(s, masks, dim=1)
+            anchor_d = prob_d.gather(1, acts_d)
+            anchor_c = Beta(alpha, beta).log_prob(acts_c)
+            log_w = torch.log(anchor_d) - torch.log(logprob_d) + \
+                anchor_c.sum(1, keepdim=True) - logprob_c.sum(1, keepdim=True)
+            weights = torch.exp(log_w).clamp(max=self.rho_bar)
+
+        return s, acts_d, acts_c, td_target, adv, anchor_d, anchor_c, masks, weights
+
+
+    def train(self, batch=None):
+        '''PPO update on the buffer, or on `batch` tensors in make_batch order (e.g.
+        views of a shared TrajectoryRing, see ringbuffer.py)'''
+        self.replay.append(self.make_batch() if batch is None else batch)
+        self.entropy_coef *= self.entropy_coef_decay #exploring decay
+
+        s, acts_d, acts_c, td_target, adv, logprob_d, logprob_c, masks, weights = self.replay_batch()
+        if self.adv_normalization:
+            adv = (adv - adv.mean()) / ((adv.std() + 1e-8))  
 
         """PPO update"""
         #Slice long trajectopy into short trajectory and perform mini-batch PPO update
@@ -183,9 +222,10 @@ class PPO(object):
             np.random.shuffle(perm)
             perm = torch.LongTensor(perm)
 
-            s, acts_d, acts_c, td_target, adv, logprob_d, logprob_c, masks = \
+            s, acts_d, acts_c, td_target, adv, logprob_d, logprob_c, masks, weights = \
                 s[perm].clone(), acts_d[perm].clone(), acts_c[perm].clone(), td_target[perm].clone(), \
-                    adv[perm].clone(), logprob_d[perm].clone(), logprob_c[perm].clone(), masks[perm].clone()  
+                    adv[perm].clone(), logprob_d[perm].clone(), logprob_c[perm].clone(), masks[perm].clone(), \
+                        weights[perm].clone()
             
             '''mini-batch PPO update'''
             for i in range(optim_iter_num):
@@ -202,7 +242,7 @@ class PPO(object):
 
                 surr1 = -ratio * adv[index]
                 surr2 = -torch.clamp(ratio, 1 - self.policy_clip, 1 + self.policy_clip) * adv[index]
-                a_loss_d = torch.max(surr1, surr2) - self.entropy_coef * entropy_d              
+                a_loss_d = weights[index] * torch.max(surr1, surr2) - self.entropy_coef * entropy_d              
                 
                 '''continuous update'''
                 dist_c = Beta(alpha_b, beta_b)
@@ -212,7 +252,7 @@ class PPO(object):
 
                 surr1 = -ratio * adv[index]
                 surr2 = -torch.clamp(ratio, 1 - self.policy_clip, 1 + self.policy_clip) * adv[index]
-                a_loss_c = torch.max(surr1, surr2) - self.entropy_coef * entropy_c
+                a_loss_c = weights[index] * torch.max(surr1, surr2) - self.entropy_coef * entropy_c
 
                 a_loss = a_loss_c + a_loss_d
 
@@ -235,7 +275,83 @@ class PPO(object):
             
         return [a_loss_d, a_loss_c], c_loss, [entropy_d, entropy_c]
 
-        
+
+    def sil_update(self, s, masks, acts_d, acts_c, c_masks, returns, n_epochs=1, value_coef=0.01):
+        '''Self-imitation update (Oh et al., 2018) on archived transitions, see
+        DesignArchive.transitions: imitate the actions whose return beat the critic
+        (only the continuous entries in `c_masks`, read by the chosen unit)'''
+        s, masks, acts_d, returns = torch.tensor(s, dtype=torch.float), torch.tensor(masks, dtype=torch.bool), \
+            torch.tensor(acts_d, dtype=torch.int64), torch.tensor(returns, dtype=torch.float)
+        acts_c = torch.clamp(torch.tensor(acts_c, dtype=torch.float), 1e-6, 1 - 1e-6)
+        c_masks = torch.tensor(c_masks, dtype=torch.float)
+        optim_iter_num = int(math.ceil(s.shape[0] / self.optim_batch_size))
+
+        for _ in range(n_epochs):
+            perm = torch.randperm(s.shape[0])
+            for i in range(optim_iter_num):
+                index = perm[i * self.optim_batch_size:(i + 1) * self.optim_batch_size]
+                with torch.no_grad():
+                    adv = (returns[index] - self.critic(s[index])).clamp(min=0)
+
+                #------------------------------------ Actor update ------------------------------------
+                prob_d, alpha_b, beta_b = self.actor.forward(s[index], masks[index], dim=1)
+                logp = torch.log(prob_d.gather(1, acts_d[index]) + 1e-8) + \
+                    (Beta(alpha_b, beta_b).log_prob(acts_c[index]) * c_masks[index]).sum(1, keepdim=True)
+                a_loss = -(logp * adv).mean()
+
+                self.actor.optimizer.zero_grad()
+                a_loss.backward()
+                torch.nn.utils.clip_grad_norm_(self.actor.parameters(), 0.5)
+                self.actor.optimizer.step()
+
+                c_loss = value_coef * 0.5 * (returns[index] - self.critic(s[index])).clamp(min=0).pow(2).mean()
+                self.critic.optimizer.zero_grad()
+                c_loss.backward()
+                self.critic.optimizer.step()
+
+        return a_loss, c_loss
+
+
+    def bc_update(self, s, masks, acts_d, acts_c, c_masks, returns, imitate, n_epochs=1):
+        '''Offline pretraining step: masked behaviour cloning of the `imitate` transitions
+        (only the continuous entries in `c_masks` are cloned) and critic regression on
+        the returns of all transitions. Returns the actor loss averaged over the
+        minibatches that updated the actor and the critic loss averaged over all.'''
+        s, masks, acts_d, returns = torch.tensor(s, dtype=torch.float), torch.tensor(masks, dtype=torch.bool), \
+            torch.tensor(acts_d, dtype=torch.int64), torch.tensor(returns, dtype=torch.float)
+        acts_c = torch.clamp(torch.tensor(acts_c, dtype=torch.float), 1e-6, 1 - 1e-6)
+        c_masks = torch.tensor(c_masks, dtype=torch.float)
+        imitate = torch.tensor(imitate, dtype=torch.float).reshape(-1, 1)
+        optim_iter_num = int(math.ceil(s.shape[0] / self.optim_batch_size))
+        a_losses, c_losses = [], []
+
+        for _ in range(n_epochs):
+            perm = torch.randperm(s.shape[0])
+            for i in range(optim_iter_num):
+                index = perm[i * self.optim_batch_size:(i + 1) * self.optim_batch_size]
+
+                #------------------------------------ Actor update ------------------------------------
+                if imitate[index].sum() > 0:
+                    prob_d, alpha_b, beta_b = self.actor.forward(s[index], masks[index], dim=1)
+                    logp = torch.log(prob_d.gather(1, acts_d[index]) + 1e-8) + \
+                        (Beta(alpha_b, beta_b).log_prob(acts_c[index]) * c_masks[index]).sum(1, keepdim=True)
+                    a_loss = -(logp * imitate[index]).sum() / imitate[index].sum()
+
+                    self.actor.optimizer.zero_grad()
+                    a_loss.backward()
+                    torch.nn.utils.clip_grad_norm_(self.actor.parameters(), 0.5)
+                    self.actor.optimizer.step()
+                    a_losses.append(a_loss.item())
+
+                c_loss = (self.critic(s[index]) - returns[index]).pow(2).mean()
+                self.critic.optimizer.zero_grad()
+                c_loss.backward()
+                self.critic.optimizer.step()
+                c_losses.append(c_loss.item())
+
+        return torch.tensor(float(np.mean(a_losses)) if a_losses else 0.), torch.tensor(float(np.mean(c_losses)))
+
+
     def make_batch(self):
         l = len(self.data)
         s_lst, acts_d_lst, acts_c_lst, r_lst, s_prime_lst, logprob_d_lst, logprob_c_lst,\
@@ -273,17 +389,40 @@ class PPO(object):
         self.data.append(transition)
 
     def save(self, episode):
-        torch.save(self.critic.state_dict(), f"./model/ppo_critic{episode}.pth")
-        torch.save(self.actor.state_dict(), f"./model/ppo_actor{episode}.pth")
+        torch.save(self.critic.state_dict(), os.path.join(self.model_dir, f"ppo_critic{episode}.pth"))
+        torch.save(self.actor.state_dict(), os.path.join(self.model_dir, f"ppo_actor{episode}.pth"))
     
     def best_save(self):
-        torch.save(self.critic.state_dict(), f"./best_model/ppo_critic.pth")
-        torch.save(self.actor.state_dict(), f"./best_model/ppo_actor.pth")
+        torch.save(self.critic.state_dict(), os.path.join(self.best_dir, "ppo_critic.pth"))
+        torch.save(self.actor.state_dict(), os.path.join(self.best_dir, "ppo_actor.pth"))
     
     def load(self,episode):
-        self.critic.load_state_dict(torch.load(f"./model/ppo_critic{episode}.pth"))
-        self.actor.load_state_dict(torch.load(f"./model/ppo_actor{episode}.pth"))
+        self.critic.load_state_dict(torch.load(os.path.join(self.model_dir, f"ppo_critic{episode}.pth")))
+        self.actor.load_state_dict(torch.load(os.path.join(self.model_dir, f"ppo_actor{episode}.pth")))
     
     def load_best(self):
-        self.critic.load_state_dict(torch.load(f"./best_model/ppo_critic.pth"))
-        self.actor.load_state_dict(torch.load(f"./best_model/ppo_actor.pth"))
\ No newline at end of file
+        self.critic.load_state_dict(torch.load(os.path.join(self.best_dir, "ppo_critic.pth")))
+        self.actor.load_state_dict(torch.load(os.path.join(self.best_dir, "ppo_actor.pth")))
+
+
+    def training_state(self):
+        '''Copy of everything the updates depend on, for an exact resume (see checkpoint.py)'''
+        return copy.deepcopy({
+            "actor": self.actor.state_dict(),
+            "critic": self.critic.state_dict(),
+            "actor_optimizer": self.actor.optimizer.state_dict(),
+            "critic_optimizer": self.critic.optimizer.state_dict(),
+            "entropy_coef": self.entropy_coef,
+            "data": self.data,
+            "replay": list(self.replay),
+        })
+
+    def load_training_state(self, state):
+        self.actor.load_state_dict(state["actor"])
+        self.critic.load_state_dict(state["critic"])
+        self.actor.optimizer.load_state_dict(state["actor_optimizer"])
+        self.critic.optimizer.load_state_dict(state["critic_optimizer"])
+        self.entropy_coef = state["entropy_coef"]
+        self.data = list(state["data"])
+        self.replay.clear()
+        self.replay.extend(state["replay"])
\ No newline at end of file
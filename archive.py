@@ -0,0 +1,114 @@
+import bisect
+import numpy as np
+from reward import write_trajectory, read_trajectories
+
+
+def topology(record):
+    '''Discrete action sequence of a recorded episode'''
+    return tuple(step["d_action"] for step in record["steps"])
+
+
+def episode_return(record):
+    return float(sum(step.get("reward", 0.) for step in record["steps"]))
+
+
+def transitions(records, gamma=0.99):
+    '''(states, masks, d_actions, c_actions, returns) of the steps of episode records,
+    with discounted returns-to-go, for PPO.sil_update and offline pretraining. The
+    scenario features of a record (see scenarios.py) are appended to its states.'''
+    s, masks, acts_d, acts_c, returns = [], [], [], [], []
+    for record in records:
+        features = record.get("features", [])
+        G, rtg = 0., []
+        for step in reversed(record["steps"]):
+            G = step.get("reward", 0.) + gamma*G
+            rtg.append(G)
+        for step, G in zip(record["steps"], reversed(rtg)):
+            s.append(step["state"] + features)
+            masks.append(step["mask"])
+            acts_d.append([step["d_action"]])
+            acts_c.append(step["c_action"])
+            returns.append([G])
+    return (np.array(s, dtype=float), np.array(masks, dtype=bool), np.array(acts_d, dtype=np.int64),
+            np.array(acts_c, dtype=float), np.array(returns, dtype=float))
+
+
+
+class DesignArchive():
+    '''Top-K flowsheet designs, one per topology.
+
+    Entries are episode records (Flowsheet.episode_record) with their topology and
+    return: the actions, continuous parameters, reward terms and stream snapshots
+    of every step. A topology keeps only its best-scoring design.
+    '''
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.entries = {}   # topology -> entry
+        self.order = []     # (-return, seq, topology), best first
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, topo):
+        return tuple(topo) in self.entries
+
+    def add(self, record):
+        '''Archive an episode. Returns True when it entered the archive.'''
+        topo = topology(record)
+        ret = record["return"] if "return" in record else episode_return(record)
+        old = self.entries.get(topo)
+        if old is not None:
+            if ret <= old["return"]:
+                return False
+            self.order.remove(old["key"])
+        elif len(self.entries) >= self.capacity and ret <= -self.order[-1][0]:
+            return False
+
+        self.seq += 1
+        entry = dict(record, topology=list(topo), key=(-ret, self.seq, topo))
+        entry["return"] = ret
+        self.entries[topo] = entry
+        bisect.insort(self.order, entry["key"])
+
+        if len(self.entries) > self.capacity:
+            _, _, worst = self.order.pop()
+            del self.entries[worst]
+        return True
+
+    def top(self, k=None):
+        return [self.entries[topo] for _, _, topo in self.order[:k]]
+
+    def best(self):
+        return self.entries[self.order[0][2]] if self.order else None
+
+    def get(self, topo):
+        return self.entries.get(tuple(topo))
+
+
+    # ------------------------------------ Replay ------------------------------------
+    def sample(self, n, alpha=0.7, rng=None):
+        '''Rank-prioritized sample of entries, P(i) ~ (1/rank)^alpha'''
+        if not self.order:
+            return []
+        rng = rng if rng is not None else np.random.default_rng()
+        p = (1/np.arange(1, len(self.order) + 1))**alpha
+        idx = rng.choice(len(self.order), size=n, p=p/p.sum())
+        return [self.entries[self.order[i][2]] for i in idx]
+
+    def transitions(self, entries, gamma=0.99):
+        return transitions(entries, gamma)
+
+
+    # ------------------------------------ Storage ------------------------------------
+    def save(self, path):
+        open(path, "w").close()
+        for entry in self.top():
+            write_trajectory(path, {k: v for k, v in entry.items() if k != "key"})
+
+    @classmethod
+    def load(cls, path, capacity=100):
+        archive = cls(capacity)
+        for record in read_trajectories(path):
+            archive.add(record)
+        return archive
@@ -0,0 +1,2 @@
+# Throughput benchmarks of the environment (stand-in backend) and the PPO agent.
+# Run from the repository root: python -m benchmarks.run --help
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import numpy as np
+from gym.spaces import Discrete, Box, Dict
+from agent import PPO
+from policy import export, PolicyRuntime
+from benchmarks.harness import measure, rate, latency
+
+
+STATE_DIM = 7
+
+# Action space of Flowsheet
+ACTIONS = Dict({
+    "discrete": Discrete(11),
+    "continuous": Box(low=np.zeros(21,), high=np.ones(21,), dtype=np.float32)})
+
+
+def random_mask(rng):
+    mask = rng.random(11) < 0.4
+    mask[rng.integers(11)] = True
+    return mask
+
+
+def fill(ppo, n, rng):
+    '''Put n synthetic transitions with episodes of 8 steps into the buffer'''
+    for i in range(n):
+        s, mask = rng.random(STATE_DIM), random_mask(rng)
+        a, p_d, c, p_c = ppo.select_action(s, mask)
+        done = i % 8 == 7
+        ppo.put_data((s, a, c, rng.normal(), rng.random(STATE_DIM), p_d, p_c, done, done, mask))
+
+
+def bench_select_action(warmup=50, trials=500, seed=0):
+    rng = np.random.default_rng(seed)
+    ppo = PPO(True, STATE_DIM, ACTIONS)
+    inputs = [(rng.random(STATE_DIM), random_mask(rng)) for _ in range(warmup + trials)]
+
+    results = {}
+    for name, method in (("select_action", ppo.select_action), ("evaluate", ppo.evaluate)):
+        it = iter(inputs)
+        results[name] = latency(measure(lambda: method(*next(it)), None, warmup, trials))
+
+    # Exported NumPy policy (policy.PolicyRuntime)
+    with tempfile.TemporaryDirectory() as tmp:
+        runtime = PolicyRuntime(export(ppo.actor, os.path.join(tmp, "policy.npz")))
+    it = iter(inputs)
+    results["runtime.evaluate"] = latency(measure(lambda: runtime.evaluate(*next(it)), None, warmup, trials))
+    return results
+
+
+def bench_train(buffer_sizes=(256, 1024), batch_sizes=(32, 64, 128), n_epochs=10, warmup=1, trials=3, seed=0):
+    '''PPO.make_batch + PPO.train updates per second for every buffer and batch size'''
+    results = {}
+    for buffer_size in buffer_sizes:
+        for batch_size in batch_sizes:
+            rng = np.random.default_rng(seed)
+            ppo = PPO(True, STATE_DIM, ACTIONS, batch_size=batch_size, n_epochs=n_epochs)
+            samples = measure(ppo.train, lambda: fill(ppo, buffer_size, rng), warmup, trials)
+            results[f"train/buffer={buffer_size},batch={batch_size}"] = rate(samples)
+    return results
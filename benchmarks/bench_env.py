@@ -0,0 +1,80 @@
+import numpy as np
+from Simulation import Simulation
+from env import Flowsheet
+from benchmarks.harness import measure, rate
+
+
+INLET_SPECS = (25.0, 38.0, {"TOL": 110.0, "HYDROGEN": 400.0, "METHANE": 0.0, "BZN": 0.0})
+
+# Continuous parameters of every step (mid-range, for which the prefixes below are valid)
+C_ACTION = np.full(21, 0.5)
+
+# Unit operation -> (actions leading to a state where it is allowed, its action)
+UNITS = {
+    "M": ([], 0),
+    "HX": ([0], 1),
+    "R": ([0, 1], 4),
+    "AR": ([0, 1], 5),
+    "C": ([0, 1, 4, 4], 3),
+    "F": ([1, 4, 4, 3], 6),
+    "FR": ([0, 1, 4, 4, 3], 7),
+    "PDC": ([0, 1, 4, 4, 3, 7], 8),
+    "DCR": ([0, 1, 4, 4, 3, 7, 8], 9),
+    "DC": ([1, 4, 4, 3, 6, 8], 2),
+    "TC": ([1, 4, 4, 3, 6, 8], 10),
+}
+
+
+def make_env(archive, directory, fidelity="rigorous"):
+    sim = Simulation(archive, directory, backend="standin")
+    return Flowsheet(sim, 0.9, 12, INLET_SPECS, fidelity=fidelity)
+
+
+def prepare(env, prefix, c_action):
+    _, sin = env.reset()
+    mask = env.action_masks(sin, inlet=True)
+    for a in prefix:
+        if not mask[a]:
+            raise RuntimeError(f"Action {a} is masked in the benchmark prefix {prefix}")
+        _, _, done, _, sin = env.step({"discrete": a, "continuous": c_action}, sin)
+        if done:
+            raise RuntimeError(f"Benchmark prefix {prefix} ended the episode")
+        mask = env.action_masks(sin)
+    return sin, mask
+
+
+def bench_steps(archive, directory, units=None, fidelity="rigorous", warmup=3, trials=10, c_action=C_ACTION):
+    '''Flowsheet.step throughput of each unit operation on the stand-in backend. The
+    episode prefix is solved once and restored (untimed) before every timed step.'''
+    env = make_env(archive, directory, fidelity)
+
+    results = {}
+    for name in units or UNITS:
+        prefix, a = UNITS[name]
+        sin, mask = prepare(env, prefix, c_action)
+        if not mask[a]:
+            raise RuntimeError(f"Unit {name} is masked after {prefix}")
+        handle = env.snapshot(sin)
+        state = {}
+
+        def setup():
+            state["sin"] = env.restore(handle)[1]
+
+        def step():
+            env.step({"discrete": a, "continuous": c_action}, state["sin"])
+
+        results[f"step/{name}"] = rate(measure(step, setup, warmup, trials))
+        env.release(handle)
+    return results
+
+
+def bench_episode(archive, directory, design=(0, 1, 4, 4, 3, 7, 8, 9), fidelity="rigorous", warmup=1,
+        trials=5, c_action=C_ACTION):
+    '''Whole-episode throughput (steps per second) of a fixed design from reset()'''
+    env = make_env(archive, directory, fidelity)
+
+    def run():
+        sin, _ = prepare(env, design[:-1], c_action)
+        env.step({"discrete": design[-1], "continuous": c_action}, sin)
+
+    return {"episode": rate(measure(run, None, warmup, trials), per_call=len(design))}
@@ -0,0 +1,83 @@
+import json
+import platform
+import random
+import time
+import numpy as np
+
+
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        import torch
+        torch.manual_seed(seed)
+    except ImportError:
+        pass
+
+
+def measure(fn, setup=None, warmup=3, trials=10):
+    '''Seconds taken by fn() over `trials` runs after `warmup` runs. `setup` runs
+    untimed before every call.'''
+    samples = []
+    for i in range(warmup + trials):
+        if setup is not None:
+            setup()
+        t = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t
+        if i >= warmup:
+            samples.append(dt)
+    return samples
+
+
+def rate(samples, per_call=1):
+    '''Result of throughput samples: operations per second (median) and spread'''
+    per_sec = [per_call/s for s in samples]
+    return {"value": float(np.median(per_sec)), "unit": "ops/s", "higher_is_better": True,
+            "mean": float(np.mean(per_sec)), "std": float(np.std(per_sec)),
+            "min": float(np.min(per_sec)), "max": float(np.max(per_sec)), "trials": len(samples)}
+
+
+def latency(samples):
+    '''Result of latency samples, in milliseconds (median) and spread'''
+    ms = [1e3*s for s in samples]
+    return {"value": float(np.median(ms)), "unit": "ms", "higher_is_better": False,
+            "mean": float(np.mean(ms)), "std": float(np.std(ms)),
+            "p90": float(np.percentile(ms, 90)), "min": float(np.min(ms)), "trials": len(samples)}
+
+
+def machine():
+    info = {"python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor(), "numpy": np.__version__}
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def report(results, config):
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine(), "config": config,
+            "results": results}
+
+
+def write(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def compare(current, baseline, tolerance=0.1):
+    '''Benchmarks slower than the baseline by more than `tolerance` (relative).
+    Returns a list of (name, baseline value, current value, relative change).'''
+    regressions = []
+    for name, base in baseline["results"].items():
+        cur = current["results"].get(name)
+        if cur is None or base["value"] == 0:
+            continue
+        change = (cur["value"] - base["value"])/base["value"]
+        worse = -change if base["higher_is_better"] else change
+        if worse > tolerance:
+            regressions.append((name, base["value"], cur["value"], change))
+    return regressions
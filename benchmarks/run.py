@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import argparse
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.harness import seed_everything, report, write, compare
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Flowsheet.step, PPO.select_action and PPO.train")
+    parser.add_argument("--suite", nargs="+", default=["step", "episode", "select_action", "train"],
+                        choices=["step", "episode", "select_action", "train"])
+    parser.add_argument("--units", nargs="+", help="unit operations of the step suite (default: all)")
+    parser.add_argument("--fidelity", default="rigorous", help="column fidelity of the environment")
+    parser.add_argument("--buffer-sizes", nargs="+", type=int, default=[256, 1024])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[32, 64, 128])
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="few trials, smallest sizes (smoke run)")
+    parser.add_argument("--out", help="write the JSON report to this file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.trials, args.warmup = 2, 1
+        args.buffer_sizes, args.batch_sizes = args.buffer_sizes[:1], args.batch_sizes[:1]
+
+    warnings.filterwarnings("ignore")
+    archive = os.path.join(ROOT, "Aspen Plus", "BZN_prod.bkp")
+    results = {}
+
+    if "step" in args.suite or "episode" in args.suite:
+        from benchmarks.bench_env import bench_steps, bench_episode
+        if "step" in args.suite:
+            seed_everything(args.seed)
+            results.update(bench_steps(archive, ROOT, args.units, args.fidelity, args.warmup, args.trials))
+        if "episode" in args.suite:
+            seed_everything(args.seed)
+            results.update(bench_episode(archive, ROOT, fidelity=args.fidelity, warmup=1,
+                                         trials=max(args.trials//2, 1)))
+
+    if "select_action" in args.suite:
+        from benchmarks.bench_agent import bench_select_action
+        seed_everything(args.seed)
+        results.update(bench_select_action(10*args.warmup, 50*args.trials, args.seed))
+
+    if "train" in args.suite:
+        from benchmarks.bench_agent import bench_train
+        seed_everything(args.seed)
+        results.update(bench_train(args.buffer_sizes, args.batch_sizes, warmup=1,
+                                   trials=max(args.trials//3, 1), seed=args.seed))
+
+    current = report(results, vars(args))
+    if args.out:
+        write(current, args.out)
+    else:
+        print(json.dumps(current, indent=2))
+
+    for name, result in results.items():
+        print(f"{name:40s} {result['value']:12.3f} {result['unit']}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(current, json.load(f), args.tolerance)
+        for name, base, cur, change in regressions:
+            print(f"REGRESSION {name}: {base:.3f} -> {cur:.3f} ({100*change:+.1f}%)", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
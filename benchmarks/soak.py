@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# Soak test: random masked episodes on the stand-in backend, sampling resident
+# memory, OS handles, COM interfaces and live objects. Fails (exit code 1) when a
+# resource keeps growing after the warm-up.
+#   python -m benchmarks.soak --episodes 100000 --out soak.jsonl
+
+def run_episode(env, rng):
+    _, sin = env.reset()
+    mask = env.action_masks(sin, inlet=True)
+    done = False
+    steps = 0
+    while not done:
+        a = int(rng.choice(np.flatnonzero(mask)))
+        _, _, done, _, sin = env.step({"discrete": a, "continuous": rng.random(21)}, sin)
+        steps += 1
+        if not done:
+            mask = env.action_masks(sin)
+    return steps
+
+
+def soak(env, episodes, sample_every, gauge, writer=None, seed=0, verbose=True):
+    rng = np.random.default_rng(seed)
+    steps = 0
+    start = time.perf_counter()
+    for ep in range(episodes + 1):
+        if ep % sample_every == 0 or ep == episodes:
+            s = gauge.sample(ep, steps=steps, seconds=time.perf_counter() - start)
+            if writer is not None:
+                writer.log("memory", **s)
+            if verbose:
+                print(f"episode {ep:>8d}  rss {s['rss_mb']:8.1f} MiB  handles {s['handles']}  "
+                      f"com {s['com_interfaces']}  objects {s['objects']}", flush=True)
+        if ep < episodes:
+            steps += run_episode(env, rng)
+    return gauge
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that memory stays flat over many episodes")
+    parser.add_argument("--episodes", type=int, default=100000)
+    parser.add_argument("--sample-every", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, help="episodes excluded from the growth fit (default: 10%%)")
+    parser.add_argument("--fidelity", default="shortcut", help="column fidelity of the environment")
+    parser.add_argument("--max-growth-mb", type=float, default=5., help="allowed RSS growth per 10k episodes")
+    parser.add_argument("--max-objects", type=float, default=1000., help="allowed object growth per 10k episodes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="append the samples to this metrics file")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    from benchmarks.bench_env import make_env
+    from gauge import MemoryGauge
+    from metrics import MetricsWriter
+
+    env = make_env("BZN_prod.bkp", os.path.join(ROOT, "Aspen Plus"), fidelity=args.fidelity)
+    warmup = args.warmup if args.warmup is not None else args.episodes//10
+    gauge = MemoryGauge(warmup=warmup, per=10000)
+    writer = MetricsWriter(args.out) if args.out else None
+    try:
+        soak(env, args.episodes, max(args.sample_every, 1), gauge, writer, args.seed)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    growth = gauge.growth()
+    print("growth per 10k episodes: " + ", ".join(f"{k} {v:+.3g}" for k, v in growth.items()))
+    failed = gauge.check(max_rss_mb=args.max_growth_mb, max_objects=args.max_objects)
+    if failed:
+        print("FAILED: " + ", ".join(f"{k} grows {v:+.3g} per 10k episodes" for k, v in failed.items()))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
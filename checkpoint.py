@@ -0,0 +1,141 @@
+import copy
+import glob
+import os
+import queue
+import random
+import tempfile
+import threading
+import numpy as np
+import torch
+
+
+# Crash-safe training checkpoints. The state is copied on the training thread and
+# written by a background thread to a temporary file that is renamed into place, so
+# a crash never leaves a partial checkpoint behind.
+
+def rng_state():
+    return {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+
+
+def capture(ppo, step, **extra):
+    '''Full training state at `step`: networks, optimizers, entropy decay, transition
+    buffers, RNG states and any picklable `extra` (episode counters, design archive...)'''
+    return {"step": step, "ppo": ppo.training_state(), "rng": rng_state(), "extra": copy.deepcopy(extra)}
+
+def restore(ppo, checkpoint):
+    '''Resume from a checkpoint. Returns (step, extra).'''
+    ppo.load_training_state(checkpoint["ppo"])
+    set_rng_state(checkpoint["rng"])
+    return checkpoint["step"], checkpoint["extra"]
+
+
+def atomic_save(obj, path):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def load(path):
+    return torch.load(path, weights_only=False)
+
+
+
+class Checkpointer():
+    '''Background checkpoint writer keeping the last `keep` checkpoints of a run
+    (plus the best one, which is never rotated out).
+
+    save() blocks only when `max_pending` checkpoints are still waiting to be
+    written. Errors of the writer thread are raised by the next call.
+    '''
+    def __init__(self, directory="./checkpoints", keep=3, prefix="ckpt", max_pending=2):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.keep = keep
+        self.prefix = prefix
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def path(self, step):
+        return os.path.join(self.directory, f"{self.prefix}-{step:09d}.pt")
+
+    @property
+    def best_path(self):
+        return os.path.join(self.directory, f"{self.prefix}-best.pt")
+
+    def checkpoints(self):
+        return sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}-[0-9]*.pt")))
+
+    def latest(self):
+        paths = self.checkpoints()
+        return paths[-1] if paths else None
+
+
+    # ------------------------------------ Writing ------------------------------------
+    def save(self, ppo, step, **extra):
+        self._check()
+        self.queue.put((self.path(step), capture(ppo, step, **extra), True))
+
+    def save_best(self, ppo, step, **extra):
+        self._check()
+        self.queue.put((self.best_path, capture(ppo, step, **extra), False))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                path, state, rotate = item
+                atomic_save(state, path)
+                self.written += 1
+                if rotate:
+                    self.rotate()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def rotate(self):
+        for path in self.checkpoints()[:-self.keep] if self.keep > 0 else []:
+            os.remove(path)
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Checkpoint writer failed") from error
+
+    def flush(self):
+        '''Wait until every queued checkpoint is on disk'''
+        self.queue.join()
+        self._check()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+
+    # ------------------------------------ Reading ------------------------------------
+    def resume(self, ppo, path=None):
+        '''Restore the latest (or given) checkpoint into `ppo`.
+        Returns (step, extra), or None when the run has no checkpoint yet.'''
+        path = path or self.latest()
+        if path is None:
+            return None
+        return restore(ppo, load(path))
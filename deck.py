@@ -0,0 +1,293 @@
+import os
+import tempfile
+
+
+# Compiles a complete flowsheet into a single Aspen input-file (.inp keyword deck)
+# that the engine loads in one InitFromFile2 call, instead of the hundreds of COM
+# assignments issued by the unit operation classes of Simulation.py. The paragraphs
+# mirror the inputs set by those classes.
+#
+# The deck only describes streams, blocks and connectivity. Components, property
+# methods and the kinetics of reaction R-1 live in the base simulation, so every
+# deck takes the setup section of an .inp exported from "Aspen Plus/BZN_prod.bkp"
+# as `header` (see read_header).
+
+# Paragraphs of the flowsheet itself, which the header stops before
+_FLOWSHEET_PARAGRAPHS = ("FLOWSHEET", "STREAM", "BLOCK")
+
+
+def read_header(path):
+    '''Setup section (units, components, properties, reactions, ...) of an .inp
+    file exported from the base simulation, without its title and flowsheet'''
+    lines, title = [], False
+    with open(path) as f:
+        for line in f:
+            word = line.split(";")[0].split()[:1]
+            if word and not line[0].isspace():
+                # A new paragraph
+                if word[0] in _FLOWSHEET_PARAGRAPHS:
+                    break
+                title = word[0] == "TITLE"
+            if not title:
+                lines.append(line)
+    return "".join(lines)
+
+
+def _num(x):
+    return f"{float(x):.10g}"
+
+
+class Deck():
+    def __init__(self, header, title="AutoProcRL flowsheet"):
+        self.header = header
+        self.title = title
+        self.connections = {}
+        self.streams = []
+        self.blocks = []
+
+    def _connect(self, block, inlets, outlets):
+        self.connections[block] = ([*inlets], [*outlets])
+
+    def _block(self, name, uo, *lines):
+        self.blocks.append(f"BLOCK {name} {uo}\n" + "".join(f"    {line}\n" for line in lines))
+
+    def connect(self, block, stream):
+        '''Add an inlet to an existing block (recycle streams)'''
+        self.connections[block][0].append(stream)
+
+
+    # ------------------------------------ Unit operations ------------------------------------
+    def feed(self, name, T, P, comp):
+        flows = " / ".join(f"{chemical} {_num(comp[chemical])}" for chemical in comp)
+        self.streams.append(f"STREAM {name}\n"
+                            f"    SUBSTREAM MIXED TEMP={_num(T)} PRES={_num(P)}\n"
+                            f"    MOLE-FLOW {flows}\n")
+
+    def mixer(self, name, inlet, outlet):
+        self._connect(name, [inlet], [outlet])
+        self._block(name, "MIXER", "PARAM NPHASE=2 PRES=0.")
+
+    def heater(self, name, T, P, inlet, outlet):
+        self._connect(name, [inlet], [outlet])
+        self._block(name, "HEATER", f"PARAM TEMP={_num(T)} PRES={_num(P)}")
+
+    def cooler(self, name, T, inlet, outlet):
+        self.heater(name, T, 0, inlet, outlet)
+
+    def pfr_ex(self, name, D, L, inlet, outlet):
+        self._connect(name, [inlet], [outlet])
+        self._block(name, "RPLUG",
+                    f"PARAM TYPE=TCOOL-SPEC LENGTH={_num(L)} DIAM={_num(D)} NPHASE=1 PDROP=0. CAT-PRESENT=NO",
+                    "COOLANT U=80. TEMP=550.",
+                    "REACTIONS RXN-IDS=R-1")
+
+    def pfr_a(self, name, D, L, inlet, outlet):
+        self._connect(name, [inlet], [outlet])
+        self._block(name, "RPLUG",
+                    f"PARAM TYPE=ADIABATIC LENGTH={_num(L)} DIAM={_num(D)} NPHASE=1 PDROP=0. CAT-PRESENT=NO",
+                    "REACTIONS RXN-IDS=R-1")
+
+    def flash(self, name, T, P, inlet, vapor, liquid):
+        self._connect(name, [inlet], [vapor, liquid])
+        self._block(name, "FLASH2", f"PARAM TEMP={_num(T)} PRES={_num(P)}")
+
+    def splitter(self, name, rr, inlet, rec, purge):
+        self._connect(name, [inlet], [rec, purge])
+        self._block(name, "FSPLIT", f"FRAC {rec} {_num(rr)}")
+
+    def column(self, name, nstages, dist_rate, reflux_ratio, press, inlet, distillate, bottoms):
+        self._connect(name, [inlet], [distillate, bottoms])
+        self._block(name, "RADFRAC",
+                    f"PARAM NSTAGE={int(nstages)} ALGORITHM=STANDARD MAXOL=200",
+                    "COL-CONFIG CONDENSER=TOTAL REBOILER=KETTLE",
+                    f"FEEDS {inlet} {int(round(nstages/2, 0))} ABOVE-STAGE",
+                    f"PRODUCTS {distillate} 1 L / {bottoms} {int(nstages)} L",
+                    f"P-SPEC 1 {_num(press)}",
+                    f"COL-SPECS MOLE-D={_num(dist_rate)} MOLE-RR={_num(reflux_ratio)}",
+                    f"TRAY-SIZE 1 2 {int(nstages) - 1} SIEVE")
+
+    def partial_column(self, name, nstages, dist_rate, reflux_ratio, press, inlet, distillate, bottoms, vapor):
+        self._connect(name, [inlet], [vapor, distillate, bottoms])
+        self._block(name, "RADFRAC",
+                    f"PARAM NSTAGE={int(nstages)} ALGORITHM=STANDARD MAXOL=200",
+                    "COL-CONFIG CONDENSER=PARTIAL-V-L REBOILER=KETTLE",
+                    f"FEEDS {inlet} {int(round(nstages/2, 0))} ABOVE-STAGE",
+                    f"PRODUCTS {vapor} 1 V / {distillate} 1 L / {bottoms} {int(nstages)} L",
+                    f"P-SPEC 1 {_num(press)}",
+                    f"COL-SPECS MOLE-D={_num(dist_rate)} MOLE-RR={_num(reflux_ratio)} MOLE-RDV=0.05",
+                    f"TRAY-SIZE 1 2 {int(nstages) - 1} SIEVE")
+
+    def tri_column(self, name, nstages, dist_rate, reflux_ratio, press, mid_rate, inlet, distillate, mid, bottoms):
+        self._connect(name, [inlet], [distillate, mid, bottoms])
+        self._block(name, "RADFRAC",
+                    f"PARAM NSTAGE={int(nstages)} ALGORITHM=STANDARD MAXOL=200",
+                    "COL-CONFIG CONDENSER=TOTAL REBOILER=KETTLE",
+                    f"FEEDS {inlet} {int(round(nstages/3, 0))} ABOVE-STAGE",
+                    f"PRODUCTS {distillate} 1 L / {mid} {int(round(nstages/2, 0))} L / {bottoms} {int(nstages)} L",
+                    f"PROD-FLOW {mid} {_num(mid_rate)}",
+                    f"P-SPEC 1 {_num(press)}",
+                    f"COL-SPECS MOLE-D={_num(dist_rate)} MOLE-RR={_num(reflux_ratio)}",
+                    f"TRAY-SIZE 1 2 {int(nstages) - 1} SIEVE")
+
+
+    def text(self):
+        flowsheet = "FLOWSHEET\n" + "".join(
+            f"    BLOCK {block} IN={' '.join(inlets)} OUT={' '.join(outlets)}\n"
+            for block, (inlets, outlets) in self.connections.items())
+        return "\n".join([f"TITLE '{self.title}'\n", self.header, flowsheet, *self.streams, *self.blocks])
+
+
+
+# ------------------------------------ Flowsheet designs ------------------------------------
+
+def compile_design(steps, inlet_specs, header):
+    '''Deck of a complete design.
+
+    `steps` are the step records of Flowsheet.trajectory (only converged steps are
+    compiled), or (d_action, params[, resolved]) tuples where `params` are the 21
+    interpolated continuous parameters. The purge column (d_action 8) depends on
+    its solved feed; without a recorded `resolved` entry its distillate rate is
+    estimated assuming complete toluene conversion.
+    '''
+    deck = Deck(header)
+    T, P, comp = inlet_specs
+    deck.feed("IN", T, P, comp)
+
+    mixer_count = hex_count = cooler_count = reac_count = column_count = flash_count = 0
+    actions_list = []
+    sin = "IN"
+    press = P
+
+    for step in steps:
+        if isinstance(step, dict):
+            if not step.get("converged", True):
+                break
+            d_action, params, resolved = step["d_action"], step["params"], step.get("resolved") or {}
+            sin = step.get("sin_name", sin)
+        else:
+            d_action, params = step[0], step[1]
+            resolved = step[2] if len(step) > 2 else {}
+
+        P_hex, T_hex, T_cooler, D1, L1, D2, L2,\
+            nstages_cp, dist_rate_cp,\
+            nstages_c, dist_rate_c,\
+            nstages_cr, dist_rate_cr, rr_cr,\
+            nstages_tc, dist_rate_tc,\
+            T_flash, P_flash, T_flashr, P_flashr, rr_flash = params
+        recycle_to = next((uo for uo in actions_list if "M" in uo), None)
+
+        if d_action == 0:
+            mixer_count += 1
+            name = f"M{mixer_count}"
+            deck.mixer(name, sin, f"{name}OUT")
+            sout = f"{name}OUT"
+
+        elif d_action == 1:
+            hex_count += 1
+            name = f"HX{hex_count}"
+            deck.heater(name, T_hex, P_hex, sin, f"{name}OUT")
+            sout, press = f"{name}OUT", P_hex
+
+        elif d_action == 2:
+            column_count += 1
+            name = f"DC{column_count}"
+            deck.column(name, nstages_c, dist_rate_c, 2.5, 1.0, sin, f"{name}DOUT", f"{name}BOUT")
+            sout, press = f"{name}DOUT", 1.0
+
+        elif d_action == 3:
+            cooler_count += 1
+            name = f"C{cooler_count}"
+            deck.cooler(name, T_cooler, sin, f"{name}OUT")
+            sout = f"{name}OUT"
+
+        elif d_action == 4:
+            reac_count += 1
+            name = f"R{reac_count}"
+            deck.pfr_ex(name, D1, L1, sin, f"{name}OUT")
+            sout = f"{name}OUT"
+
+        elif d_action == 5:
+            reac_count += 1
+            name = f"AR{reac_count}"
+            deck.pfr_a(name, D2, L2, sin, f"{name}OUT")
+            sout = f"{name}OUT"
+
+        elif d_action == 6:
+            flash_count += 1
+            name = f"F{flash_count}"
+            deck.flash(name, T_flash, P_flash, sin, f"{name}VOUT", f"{name}LOUT")
+            sout, press = f"{name}LOUT", P_flash
+
+        elif d_action == 7:
+            flash_count += 1
+            name = f"FR{flash_count}"
+            deck.flash(name, T_flashr, P_flashr, sin, f"{name}VOUT", f"{name}LOUT")
+            deck.splitter(f"SF{flash_count}", rr_flash, f"{name}VOUT", f"SF{flash_count}REC", f"SF{flash_count}PURGE")
+            if recycle_to is not None:
+                deck.connect(recycle_to, f"SF{flash_count}REC")
+            sout, press = f"{name}LOUT", P_flashr
+
+        elif d_action == 8:
+            column_count += 1
+            name = f"PDC{column_count}"
+            if "dist_rate" in resolved:
+                distillation_rate, col_press = resolved["dist_rate"], resolved["press"]
+            else:
+                distillation_rate = comp["METHANE"] + comp["TOL"]
+                distillation_rate += dist_rate_cp if recycle_to is not None else 0.
+                col_press = press
+            deck.column(name, nstages_cp, distillation_rate, 1.5, col_press, sin, f"{name}DOUT", f"{name}BOUT")
+            sout = f"{name}BOUT"
+
+        elif d_action == 9:
+            column_count += 1
+            name = f"DCR{column_count}"
+            deck.column(name, nstages_cr, dist_rate_cr, 2.5, 1.0, sin, f"{name}DOUT", f"{name}BOUT")
+            deck.splitter(f"S{column_count}", rr_cr, f"{name}BOUT", f"S{column_count}REC", f"S{column_count}PURGE")
+            if recycle_to is not None:
+                deck.connect(recycle_to, f"S{column_count}REC")
+            sout, press = f"{name}DOUT", 1.0
+
+        elif d_action == 10:
+            column_count += 1
+            name = f"TC{column_count}"
+            deck.partial_column(name, nstages_tc, dist_rate_tc, 2.5, 1.0, sin,
+                                f"{name}DOUT", f"{name}BOUT", f"{name}VOUT")
+            sout, press = f"{name}DOUT", 1.0
+
+        else:
+            raise ValueError(f"Unknown discrete action {d_action}")
+
+        actions_list.append(name)
+        if d_action == 9:
+            actions_list.clear()
+        sin = sout
+
+    return deck.text()
+
+
+def load_deck(sim, text, path=None):
+    '''Replace the simulation document by the deck, in a single engine call. The
+    deck is kept in `path` if given, otherwise in a temporary file removed once
+    loaded.'''
+    if path is not None:
+        with open(path, "w") as f:
+            f.write(text)
+        sim.AspenSimulation.InitFromFile2(os.path.abspath(path))
+        return path
+
+    fd, tmp = tempfile.mkstemp(suffix=".inp", dir=os.getcwd())
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        sim.AspenSimulation.InitFromFile2(os.path.abspath(tmp))
+    finally:
+        os.remove(tmp)
+    return None
+
+
+def evaluate_design(sim, steps, inlet_specs, header, path=None):
+    '''Load and solve a complete design. Returns True if it converged.'''
+    load_deck(sim, compile_design(steps, inlet_specs, header), path)
+    sim.EngineRun()
+    return sim.Convergence()
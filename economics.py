@@ -0,0 +1,138 @@
+import numpy as np
+
+
+# Equipment kinds used in the solve record
+MIXER = "mixer"
+HEATER = "heater"
+REACTOR = "reactor"
+COLUMN = "column"
+FLASH = "flash"
+
+KINDS = (MIXER, HEATER, REACTOR, COLUMN, FLASH)
+
+
+class CostModel():
+    '''Normalized capital and utility costs of the unit operations.
+
+    The normalizing maximum costs only depend on the cost assumptions, so they
+    are evaluated once here instead of on every call. All cost functions accept
+    scalars or NumPy arrays.
+    '''
+    def __init__(self, M_S=1638.2, max_D_reactor=3.5, max_L_reactor=12.0,
+            max_D_column=2.5, max_stages=25, max_V_flash=200.0,
+            utility_norm=30e3, mixer_cost=0.1, unit_cost=0.2):
+
+        self.M_S = M_S  # Marshall & Swift equipment index 2018 (1638.2, fixed)
+        self.max_D_reactor = max_D_reactor
+        self.max_L_reactor = max_L_reactor
+        self.max_D_column = max_D_column
+        self.max_stages = max_stages
+        self.max_V_flash = max_V_flash
+        self.utility_norm = utility_norm
+        self.mixer_cost = mixer_cost
+        self.unit_cost = unit_cost
+
+        # Normalizers
+        self.max_cost_reactor = self._shell(max_D_reactor, max_L_reactor)
+        self.max_H_column = 1.2*0.61*(max_stages - 2)
+        self.max_int_cost_column = self._internals(max_D_column, self.max_H_column)
+        self.max_cost_column = self._shell(max_D_column, self.max_H_column)
+        self.max_cost_flash = self._vessel(max_V_flash)
+
+
+    def _shell(self, D, H):
+        return (self.M_S)/280 * 101.9 * np.power(D, 1.066) * np.power(H, 0.802) * (2.18 + 1.15)
+
+    def _internals(self, D, H):
+        return (self.M_S)/280 * np.power(D, 1.55) * H
+
+    def _vessel(self, V):
+        logV = np.log10(V)
+        return (2.25 + 1.82) * (813/397) * np.power(10., 3.4974 + 0.4485*logV + 0.1074*logV**2)
+
+
+    def reactor(self, D, H):
+        return self._shell(np.asarray(D, dtype=float), np.asarray(H, dtype=float))/self.max_cost_reactor
+
+    def column(self, D, H):
+        D = np.asarray(D, dtype=float)
+        H = np.asarray(H, dtype=float)
+        norm_cost1 = self._internals(D, H)/self.max_int_cost_column  # Internal costs
+        norm_cost2 = self._shell(D, H)/self.max_cost_column  # External costs
+        return norm_cost1 + norm_cost2
+
+    def flash(self, V):
+        return self._vessel(np.asarray(V, dtype=float))/self.max_cost_flash
+
+    def utility(self, duty, scale=1.0):
+        return np.abs(np.asarray(duty, dtype=float))*scale/self.utility_norm
+
+
+    def unit_costs(self, kind, D=0., H=0., V=1., duty=0., scale=1.):
+        '''Positive normalized cost (fixed + variable) of each unit.
+
+        `kind` is an array of equipment kinds (see KINDS); the remaining
+        arguments are broadcast against it. Entries that do not apply to a kind
+        are ignored.
+        '''
+        kind = np.asarray(kind)
+        D, H, V, duty, scale = (np.broadcast_to(np.asarray(x, dtype=float), kind.shape)
+                                for x in (D, H, V, duty, scale))
+
+        capital = np.zeros(kind.shape)
+        for k, fn, args in ((REACTOR, self.reactor, (D, H)),
+                            (COLUMN, self.column, (D, H)),
+                            (FLASH, self.flash, (V,))):
+            sel = kind == k
+            if sel.any():
+                capital[sel] = fn(*(a[sel] for a in args))
+
+        f_cost = np.where(kind == MIXER, self.mixer_cost, self.unit_cost*(1 + capital))
+        v_cost = self.utility(duty, scale)
+        return f_cost + v_cost
+
+
+    def flowsheet(self, record):
+        '''Total normalized cost of one flowsheet from its solve record.
+
+        `record` maps unit names to the equipment entries written by
+        `Flowsheet.step` (or is an iterable of those entries).
+        '''
+        entries = _entries(record)
+        if not entries:
+            return 0.
+        return float(self.unit_costs(*_columns(entries)).sum())
+
+    def flowsheets(self, records):
+        '''Total normalized cost of many flowsheets in a single vectorized pass.'''
+        records = list(records)
+        entries, owner = [], []
+        for i, record in enumerate(records):
+            units = _entries(record)
+            entries.extend(units)
+            owner.extend([i]*len(units))
+
+        if not entries:
+            return np.zeros(len(records))
+        costs = self.unit_costs(*_columns(entries))
+        return np.bincount(np.asarray(owner), weights=costs, minlength=len(records))
+
+
+def equipment(kind, D=0., H=0., V=1., duty=0., scale=1.):
+    '''Entry of the solve record for a single unit'''
+    return {"kind": kind, "D": float(D), "H": float(H), "V": float(V),
+            "duty": float(duty), "scale": float(scale)}
+
+
+def _entries(record):
+    return list(record.values()) if isinstance(record, dict) else list(record)
+
+
+def _columns(entries):
+    kind = np.array([e["kind"] for e in entries])
+    cols = [np.array([e.get(k, d) for e in entries], dtype=float)
+            for k, d in (("D", 0.), ("H", 0.), ("V", 1.), ("duty", 0.), ("scale", 1.))]
+    return (kind, *cols)
+
+
+DEFAULT_COST_MODEL = CostModel()
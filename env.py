@@ -2,18 +2,51 @@ import os
 import numpy as np
 import time
 from Simulation import *
+from economics import *
+from reward import snapshot, step_reward, DEFAULT_REWARD
+import shortcut
+from streams import StreamState, InfoTable
 import copy
-import math
 from gym import Env
 from gym.spaces import Discrete, Box, Dict
 from gym.utils import seeding
 
+# Python-side episode state captured by Flowsheet.snapshot
+EPISODE_STATE = (
+    "iter", "state", "done", "info", "equipment", "trajectory", "actions_list", "avail_actions",
+    "value_step", "bzn_pure", "metan_pure", "bzn_extra_added", "bzn_out", "metan_out",
+    "mixer_count", "hex_count", "cooler_count", "pump_count", "reac_count", "column_count", "flash_count",
+    "inlet_specs", "Cao", "Cbo")
+
+FIDELITIES = ("rigorous", "multi", "shortcut")
+
+# Observation entries of reset() (H2 fraction first), from the StreamState.observation order
+INLET_ORDER = [0, 1, 3, 2, 4, 5, 6]
+
+
 class Flowsheet(Env):
-    def __init__(self, sim, pure, max_iter, inlet_specs):
+    def __init__(self, sim, pure, max_iter, inlet_specs, cost_model=None, reward_config=None,
+            fidelity="rigorous", recovery=None):
 
         # Establish connection with ASPEN
         self.sim = sim
 
+        # Capital and utility cost correlations
+        self.cost_model = cost_model if cost_model is not None else DEFAULT_COST_MODEL
+        self.reward_config = reward_config if reward_config is not None else DEFAULT_REWARD
+
+        # Column fidelity: "rigorous" always solves Radfrac, "multi" screens columns with
+        # a shortcut (FUG) estimate and only solves Radfrac when the product clears its
+        # purity target, "shortcut" never escalates. Final evaluation is always rigorous.
+        if fidelity not in FIDELITIES:
+            raise ValueError(f"Unknown column fidelity '{fidelity}', choose from {FIDELITIES}")
+        self.fidelity = fidelity
+        self.final_evaluation = False
+        self.column_solves = {"shortcut": 0, "rigorous": 0}
+
+        # Engine failure handling of step() (see recovery.StepRecovery)
+        self.recovery = recovery
+
         # Characteristics of the environment
         self.d_actions = 11
         self.pure = pure
@@ -27,13 +60,13 @@ class Flowsheet(Env):
 
 
         # Declare the initial flowrate conditions
-        self.inlet_specs = inlet_specs
-        self.Cao = self.inlet_specs[2]["TOL"]
-        self.Cbo = self.inlet_specs[2]["HYDROGEN"]
+        self.set_inlet(inlet_specs)
 
         # Flowsheet
-        self.info = {}
+        self.info = InfoTable(self.max_iter)
         self.infom = {}
+        self.equipment = {}  # Solve record of sizing and duties (see economics.py)
+        self.trajectory = []  # Step records of the episode (see reward.py)
         self.avail_actions = np.array(
             [1, # Mixer
              0, # Heater
@@ -57,16 +90,10 @@ class Flowsheet(Env):
         self.column_count = 0
         self.flash_count = 0
 
-        # Action declaration
-        self.action_space = Dict({
-            "discrete": Discrete(self.d_actions), 
-            "continuous": Box(low=np.zeros(21,), high=np.ones(21,), dtype=np.float32)})
-
-
-        # Observation
-        self.low = np.zeros((7,))
-        self.high = np.ones((7,))
-        self.observation_space = Box(low=self.low, high=self.high, dtype=np.float32)
+        # Action and observation declaration
+        self.observation_space, self.action_space = Flowsheet.spaces()
+        self.low = self.observation_space.low
+        self.high = self.observation_space.high
 
         self.bzn_out = 0
         self.metan_out = 0
@@ -75,29 +102,45 @@ class Flowsheet(Env):
         self.seed()
     
     
+    @staticmethod
+    def spaces():
+        '''(observation_space, action_space) of a Flowsheet, without building one'''
+        action_space = Dict({
+            "discrete": Discrete(11),
+            "continuous": Box(low=np.zeros(21,), high=np.ones(21,), dtype=np.float32)})
+        observation_space = Box(low=np.zeros((7,)), high=np.ones((7,)), dtype=np.float32)
+        return observation_space, action_space
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
 
-    def get_outputs(self, sout):
-        T = sout.get_temp()
-        P = sout.get_press()
-        Fh = sout.get_molar_flow("HYDROGEN")
-        Ft = sout.get_molar_flow("TOL")
-        Fbzn = sout.get_molar_flow("BZN")
-        Fm = sout.get_molar_flow("METHANE")
-        out_list = [T, P, Ft, Fh, Fm, Fbzn]
+    def set_inlet(self, inlet_specs):
+        '''Feed conditions (T, P, {component: flow}) of the next reset()'''
+        self.inlet_specs = inlet_specs
+        self.Cao = self.inlet_specs[2]["TOL"]
+        self.Cbo = self.inlet_specs[2]["HYDROGEN"]
 
-        return out_list
+    def get_outputs(self, sout):
+        # [T, P, Ft, Fh, Fm, Fbzn]
+        return sout.state().outputs()
 
         
 
     def step(self, action, sin):
+        if self.recovery is not None:
+            return self.recovery.step(self, action, sin)
+        return self.solve_step(action, sin)
+
+    def solve_step(self, action, sin):
         self.iter += 1
         cost = 0
         
         d_action = action["discrete"]
         c_action = action["continuous"]
+        prev_state, mask, n_units = self.state, self.avail_actions.copy(), len(self.equipment)
+        rec2, resolved = None, {}
+
         c_action = self.interpolation(np.array(c_action))
         P_hex, T_hex, T_cooler, D1, L1, D2, L2,\
             nstages_cp, dist_rate_cp,\
@@ -122,9 +165,7 @@ class Flowsheet(Env):
                 self.info[f"M{self.mixer_count}"] = self.get_outputs(sout)
 
                 # Costs --> normalized cost approximation 
-                f_cost = -0.1
-                v_cost = -0 # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                self.equipment[f"M{self.mixer_count}"] = equipment(MIXER)
               
         # ----------------------------------------- HEX -----------------------------------------
         elif d_action == 1:
@@ -139,9 +180,8 @@ class Flowsheet(Env):
                 self.info[f"HX{self.hex_count}"] = [T_hex, self.get_outputs(sout)]
                 
                 # Costs --> normalized cost approximation 
-                f_cost = -0.2
-                v_cost = -hex.enery_consumption()/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = hex.enery_consumption()
+                self.equipment[f"HX{self.hex_count}"] = equipment(HEATER, duty=q)
                 
 
         # ----------------------------------------- Column  -----------------------------------------
@@ -150,7 +190,7 @@ class Flowsheet(Env):
             self.column_count += 1
             self.actions_list.append(f"DC{self.column_count}")
 
-            col = Column(f"DC{self.column_count}", nstages_c, dist_rate_c, 2.5, 1.0, sin)
+            col = self.build_column(f"DC{self.column_count}", nstages_c, dist_rate_c, 2.5, 1.0, sin, resolved)
             
             sout, b = col.distill()
             
@@ -166,9 +206,8 @@ class Flowsheet(Env):
 
                 # Costs --> normalized cost approximation
                 Diam, Height = col.sizing()
-                f_cost = -0.2*(1 + self.fixed_cost_column(Diam, Height))
-                v_cost = -col.enery_consumption()/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = col.enery_consumption()
+                self.equipment[f"DC{self.column_count}"] = equipment(COLUMN, D=Diam, H=Height, duty=q)
  
         
         # ----------------------------------------- Cooler -----------------------------------------
@@ -185,9 +224,8 @@ class Flowsheet(Env):
                 self.info[f"C{self.cooler_count}"] = [T_cooler, self.get_outputs(sout)]
 
                 # Costs --> normalized cost approximation 
-                f_cost = -0.2
-                v_cost = -cool.enery_consumption()/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = cool.enery_consumption()
+                self.equipment[f"C{self.cooler_count}"] = equipment(HEATER, duty=q)
         
 
         # ----------------------------------------- PFR -----------------------------------------
@@ -205,9 +243,8 @@ class Flowsheet(Env):
                 self.info[f"R{self.reac_count}"] = [D1, L1, self.get_outputs(sout)]
 
                 # Costs --> normalized cost approximation
-                f_cost = -0.2*(1 + self.fixed_cost_reactor(D1, L1))
-                v_cost = -pfr.enery_consumption()/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = pfr.enery_consumption()
+                self.equipment[f"R{self.reac_count}"] = equipment(REACTOR, D=D1, H=L1, duty=q)
         
         # ----------------------------------------- Adiabatic PFR -----------------------------------------
         elif d_action == 5:
@@ -223,9 +260,7 @@ class Flowsheet(Env):
                 self.info[f"AR{self.reac_count}"] = [D2,L2, self.get_outputs(sout)]
 
                 # Costs --> normalized cost approximation
-                f_cost = -0.2*(1 + self.fixed_cost_reactor(D2, L2))
-                v_cost = -0 # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                self.equipment[f"AR{self.reac_count}"] = equipment(REACTOR, D=D2, H=L2)
         
         # ----------------------------------------- Flash -----------------------------------------
         elif d_action == 6:
@@ -249,9 +284,8 @@ class Flowsheet(Env):
                 # Costs --> normalized cost approximation
                 Vin = sin.get_volume_flow()
                 V = Vin*0.05/0.2
-                f_cost = -0.2*(1 + self.fixed_cost_flash(V))
-                v_cost = -flash.enery_consumption()/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = flash.enery_consumption()
+                self.equipment[f"F{self.flash_count}"] = equipment(FLASH, V=V, duty=q)
 
 
          # ----------------------------------------- Flash with recycle -----------------------------------------
@@ -283,23 +317,25 @@ class Flowsheet(Env):
                 # Costs --> normalized cost approximatio)
                 Vin = sin.get_volume_flow()
                 V = Vin*0.05/0.2
-                f_cost = -0.2*(1 + self.fixed_cost_flash(V))
-                v_cost = -flash.enery_consumption()*rr_flash/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = flash.enery_consumption()
+                self.equipment[f"FR{self.flash_count}"] = equipment(FLASH, V=V, duty=q, scale=rr_flash)
 
         # ----------------------------------------- Column for purge -----------------------------------------
         elif d_action == 8:
                 
             self.column_count += 1
             self.actions_list.append(f"PDC{self.column_count}")
-            press = sin.get_press()
+            feed = sin.state()
+            press = feed.P
 
             if any("M" in action for action in self.actions_list):
-                distillation_rate = sin.get_molar_flow("METHANE") + dist_rate_cp
+                distillation_rate = feed.flow("METHANE") + dist_rate_cp
             else:
-                distillation_rate = sin.get_molar_flow("METHANE")
+                distillation_rate = feed.flow("METHANE")
                 
-            col = Column(f"PDC{self.column_count}", nstages_cp, distillation_rate, 1.5, press, sin)
+            resolved = {"dist_rate": float(distillation_rate), "press": float(press)}
+            col = self.build_column(f"PDC{self.column_count}", nstages_cp, distillation_rate, 1.5, press, sin,
+                                    resolved, key="METHANE")
             
             d, sout = col.distill()
             self.sim.EngineRun()
@@ -314,16 +350,15 @@ class Flowsheet(Env):
 
                 # Costs --> normalized cost approximation
                 Diam, Height = col.sizing()
-                f_cost = -0.2*(1 + self.fixed_cost_column(Diam, Height))
-                v_cost = -col.enery_consumption()/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = col.enery_consumption()
+                self.equipment[f"PDC{self.column_count}"] = equipment(COLUMN, D=Diam, H=Height, duty=q)
         
         # ----------------------------------------- Column with recycle -----------------------------------------
         elif d_action == 9:
             self.column_count += 1
             self.actions_list.append(f"DCR{self.column_count}")
 
-            col = Column(f"DCR{self.column_count}", nstages_cr, dist_rate_cr, 2.5, 1.0, sin)
+            col = self.build_column(f"DCR{self.column_count}", nstages_cr, dist_rate_cr, 2.5, 1.0, sin, resolved)
             
             sout, b = col.distill()
             splitter = Splitter(f"S{self.column_count}", rr_cr, b)
@@ -349,9 +384,8 @@ class Flowsheet(Env):
 
                 # Costs --> normalized cost approximation
                 Diam, Height = col.sizing()
-                f_cost = -0.2*(1 + self.fixed_cost_column(Diam, Height))
-                v_cost = -col.enery_consumption()*rr_cr/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = col.enery_consumption()
+                self.equipment[f"DCR{self.column_count}"] = equipment(COLUMN, D=Diam, H=Height, duty=q, scale=rr_cr)
 
         # ----------------------------------------- TriColumn -----------------------------------------
         elif d_action == 10:
@@ -359,7 +393,8 @@ class Flowsheet(Env):
             self.column_count += 1
             self.actions_list.append(f"TC{self.column_count}")
 
-            col = PartialColumn(f"TC{self.column_count}", nstages_tc, dist_rate_tc, 2.5, 1.0, sin)
+            col = self.build_column(f"TC{self.column_count}", nstages_tc, dist_rate_tc, 2.5, 1.0, sin, resolved,
+                                    partial=True)
             
             sout, b, _ = col.distill()
             self.sim.EngineRun()
@@ -374,123 +409,29 @@ class Flowsheet(Env):
 
                 # Costs --> normalized cost approximation
                 Diam, Height = col.sizing()
-                f_cost = -0.2*(1 + self.fixed_cost_column(Diam, Height))
-                v_cost = -col.enery_consumption()/(30e3) # Variable cost (heat)
-                cost = f_cost + v_cost # Total cost
+                q = col.enery_consumption()
+                self.equipment[f"TC{self.column_count}"] = equipment(COLUMN, D=Diam, H=Height, duty=q)
                 
         # ---------------------------------- Constraints and rewards ----------------------------------     
-        if self.sim.Convergence():
-
-            # Constraints
-
-            # Cons 1: (Temperature inside of reactor no greater than 704°C)
-            if any("M" in action for action in self.actions_list):
-                if d_action in (4, 5) and sout.get_temp() <= 750:
-                    bonus_T = 0.2
-                else:
-                    bonus_T = 0.
-            else: 
-                if d_action in (4, 5) and sout.get_temp() <= 700:
-                    bonus_T = 0.2
-                else:
-                    bonus_T = 0
-            
-
-            # Cons 2: (The proportion of hydrogen to toluene in the reactor should be at least 3:1)    
-            if d_action == 7 and (rec2.get_molar_flow("HYDROGEN") + self.Cbo) > 3*self.Cao:
-                bonus_F = 0.5
-            elif d_action == 6:
-                bonus_F = -15.0
-            else:
-                bonus_F = 0.
-
-
-            
-            # Driving force (reduction of the amount of TOL)
-            t_frac_prev = sin.get_molar_flow("TOL")/sin.get_total_molar_flow()
-            t_frac = sout.get_molar_flow("TOL")/sout.get_total_molar_flow()
-            if not d_action in (6, 7, 8):
-                bonus = t_frac_prev - t_frac
-            else:
-                bonus = 0.
-
-            # Driving force 2 (reduction of the amount of H2)
-            b_frac_prev = sin.get_molar_flow("HYDROGEN")/sin.get_total_molar_flow()
-            b_frac = sout.get_molar_flow("HYDROGEN")/sout.get_total_molar_flow()
-            if d_action in (6, 7):
-                bonus2 = 0.8*(b_frac_prev - b_frac)
-            else:
-                bonus2 = 0.
-
-            # Driving force 3 (reduction of the amount of CH4)
-            if d_action == 8:
-                bonus3 = 0.4*sout.get_molar_flow("BZN")/ self.Cao
-            else:
-                bonus3 = 0.
-            
-             #bonus3 = 0.4*d.get_molar_flow("METHANE") / d.get_total_molar_flow()
-
-                
-#            b_frac_prev = sin.get_molar_flow("METHANE")/sin.get_total_molar_flow()
- #           b_frac = sout.get_molar_flow("METHANE")/sout.get_total_molar_flow()
-  #          if d_action == 8:
-   #             bonus3 = 4.0*(b_frac_prev - b_frac)
-
-
-            
-            # Cons 3. Output purities   
-            if not self.metan_pure and self.metan_out != 0:
-                w_frac = self.metan_out.get_molar_flow("METHANE")/self.metan_out.get_total_molar_flow()
-                self.metan_pure = w_frac >= 0.80
-                
-            if self.bzn_out != 0:
-                self.bzn_pure = self.bzn_out.get_molar_flow("BZN")/self.bzn_out.get_total_molar_flow() >= self.pure
-
-            penalty = 0
-            reward_flow = 0
-            bzn_extra = 0
-            
-          
-            if self.iter >= self.max_iter:
-                self.done = True
-                
-                if not self.bzn_pure or not self.metan_pure:
-                    bzn_frac = sout.get_molar_flow("BZN")/sout.get_total_molar_flow()
-                    penalty -= 15*(self.pure - bzn_frac)
-            else:
-                if self.bzn_pure and self.metan_pure:
-                    self.done = True
-                    reward_flow += 0.2*(self.max_iter - self.iter)
-                    #if any("M" in action for action in self.actions_list):
-                        #reward_flow += 0.2*(self.max_iter - self.iter + 1)
-                    #else:
-
-            #if self.bzn_out != 0 and self.bzn_out.get_molar_flow("BZN") > 111.8:
-             #   bzn_bonus += 0.5
-                
-            # Reward for more BZN flow
-            if self.bzn_pure and not self.bzn_extra_added:
-                bzn_extra = 1.2*self.bzn_out.get_molar_flow("BZN") / (self.Cao)
-                self.bzn_extra_added = True  # Set the flag to True to indicate that bzn_extra has been added  
-
-       
-            reward = cost + bonus + bonus2 + bonus3 + bonus_T + bonus_F + penalty + reward_flow + bzn_extra 
-            # reward = bonus_F* (cost + bonus + bonus2 + bonus3 + bonus_T  + penalty + reward_flow + bzn_extra )
-
-
-            self.state = np.array([
-                sout.get_temp()/900,
-                sout.get_press()/38,
-                sout.get_molar_flow("TOL")/sout.get_total_molar_flow(),
-                sout.get_molar_flow("HYDROGEN")/sout.get_total_molar_flow(),
-                sout.get_molar_flow("METHANE")/sout.get_total_molar_flow(),
-                sout.get_molar_flow("BZN")/sout.get_total_molar_flow(),
-                self.iter/self.max_iter])        
-        
-        
-        else:
-            self.done = True
-            reward = -8
+        converged = self.sim.Convergence()
+        if len(self.equipment) > n_units:
+            # Normalized fixed and variable cost of the new unit, as reward.rescore
+            cost = -float(self.cost_model.unit_costs(**next(reversed(self.equipment.values()))))
+        step = self.step_record(d_action, action["continuous"], c_action, resolved, prev_state, mask,
+                                converged, cost, sin, sout, rec2, len(self.equipment) > n_units)
+
+        flags = {"bzn_pure": self.bzn_pure, "metan_pure": self.metan_pure,
+                 "bzn_extra_added": self.bzn_extra_added}
+        reward, terms, done, flags = step_reward(step, self.episode_constants(), flags, self.reward_config)
+        self.bzn_pure, self.metan_pure = flags["bzn_pure"], flags["metan_pure"]
+        self.bzn_extra_added = flags["bzn_extra_added"]
+        self.done = self.done or done
+
+        if converged:
+            self.state = sout.state().observation(self.iter, self.max_iter)
+
+        step["reward"], step["terms"], step["done"] = reward, terms, self.done
+        self.trajectory.append(step)
 
         
         # Return step information
@@ -498,33 +439,97 @@ class Flowsheet(Env):
         
 
 
+    def build_column(self, name, nstages, dist_rate, reflux_ratio, press, sin, resolved, key="BZN",
+            partial=False):
+        '''Column block of the configured fidelity. The distillate is screened against
+        `self.pure` (BZN) or the methane purity of the reward (METHANE).'''
+        rigorous = PartialColumn if partial else Column
+        fidelity = "rigorous"
+        if self.fidelity != "rigorous" and not self.final_evaluation:
+            state = sin.state()
+            feed = {c: state.flow(c) for c in shortcut.COMPONENTS}
+            est = shortcut.column(feed, nstages, dist_rate, reflux_ratio, press, partial)
+            target = self.pure if key == "BZN" else self.reward_config.metan_purity
+
+            # Infeasible estimates are left to the rigorous model to judge
+            if est["feasible"] and (self.fidelity == "shortcut" or shortcut.purity(est, "dist", key) < target):
+                fidelity = "shortcut"
+
+        self.column_solves[fidelity] += 1
+        resolved["fidelity"] = fidelity
+        if fidelity == "shortcut":
+            return ShortcutColumn(name, est, sin, partial)
+        return rigorous(name, nstages, dist_rate, reflux_ratio, press, sin)
+
+
+    def step_record(self, d_action, c_action, params, resolved, state, mask, converged, cost,
+            sin, sout, rec, new_unit):
+        '''Solver-independent record of a step, enough to recompute its reward offline'''
+        step = {
+            "iter": self.iter,
+            "d_action": int(d_action),
+            "c_action": np.asarray(c_action, dtype=float).tolist(),
+            "params": [float(p) for p in params],
+            "resolved": resolved,
+            "state": np.asarray(state, dtype=float).tolist(),
+            "mask": np.asarray(mask, dtype=int).tolist(),
+            "sin_name": sin.name,
+            "converged": bool(converged),
+        }
+        if not converged:
+            return step
+
+        step.update({
+            "has_mixer": any("M" in action for action in self.actions_list),
+            "cost": cost,
+            "equipment": next(reversed(self.equipment.values())) if new_unit else None,
+            "sin": snapshot(sin),
+            "sout": snapshot(sout),
+            "rec": snapshot(rec) if rec is not None else None,
+            "bzn_out": snapshot(self.bzn_out) if self.bzn_out != 0 else None,
+            "metan_out": snapshot(self.metan_out) if self.metan_out != 0 else None,
+        })
+        return step
+
+    def episode_constants(self):
+        return {"pure": self.pure, "max_iter": self.max_iter, "Cao": self.Cao, "Cbo": self.Cbo}
+
+    def episode_record(self):
+        '''Recorded episode for offline re-scoring (see reward.rescore)'''
+        record = self.episode_constants()
+        record["inlet_specs"] = self.inlet_specs
+        record["steps"] = list(self.trajectory)
+        return record
+
+
+    def snapshot(self, sin=None):
+        '''Handle of the current mid-episode state, to branch from it with restore()'''
+        return {
+            "sim": self.sim.SaveState(),
+            "env": copy.deepcopy({attr: getattr(self, attr) for attr in EPISODE_STATE}),
+            "sin": sin.name if sin is not None else None,
+        }
+
+    def restore(self, handle):
+        '''Return to a snapshot (which stays valid). Returns (state, sin) like reset().'''
+        self.sim.RestoreState(handle["sim"])
+        for attr, value in copy.deepcopy(handle["env"]).items():
+            setattr(self, attr, value)
+        sin = Stream.ref(handle["sin"]) if handle["sin"] is not None else None
+        return self.state, sin
+
+    def release(self, handle):
+        handle["sim"].discard()
+
+
     def fixed_cost_reactor(self, D, H):
-        M_S = 1638.2  # Marshall & Swift equipment index 2018 (1638.2, fixed)
-        f_cost = (M_S)/280 * 101.9 * D**1.066 * H**0.802 * (2.18 + 1.15)
-        max_cost = (M_S)/280 * 101.9 * 3.5**1.066 * 12**0.802 * (2.18 + 1.15)
-        norm_cost = f_cost/max_cost
-        return norm_cost
+        return float(self.cost_model.reactor(D, H))
     
     def fixed_cost_column(self, D, H):
-        M_S = 1638.2  # Marshall & Swift equipment index 2018 (1638.2, fixed)
-        max_H = 1.2*0.61*(25 - 2)
-        # Internal costs
-        int_cost = (M_S)/280 * D**1.55 * H
-        max_int_cost = (M_S)/280 * 2.5**1.55 * max_H
-        norm_cost1 = int_cost/max_int_cost
-
-        # External costs
-        f_cost = (M_S)/280 * 101.9 * D**1.066 * H**0.802 * (2.18 + 1.15)
-        max_cost = (M_S)/280 * 101.9 * 2.5**1.066 * max_H**0.802 * (2.18 + 1.15)
-        norm_cost2 = f_cost/max_cost
-
-        return norm_cost1 + norm_cost2
+        return float(self.cost_model.column(D, H))
 
     def fixed_cost_flash(self, V):
-        f_cost = (2.25 + 1.82) * (813/397) * 10 ** (3.4974 + 0.4485 * math.log10(V) + 0.1074 * (math.log10(V))**2)
-        max_cost = (2.25 + 1.82) * (813/397) * 10 ** (3.4974 + 0.4485 * math.log10(200) + 0.1074 * (math.log10(200))**2)
-        norm_cost = f_cost/max_cost
-        return norm_cost
+        return float(self.cost_model.flash(V))
     
 
     def action_masks(self, sin, inlet=None):
@@ -586,21 +591,14 @@ class Flowsheet(Env):
         # Reset all instances
         self.iter = 0
         self.sim.Reinitialize()
-        T, P, compounds = self.inlet_specs
-        Fh, Ft, Fm, Fbzn = compounds["HYDROGEN"], compounds["TOL"], compounds["METHANE"], compounds["BZN"]
-        tot_flow = Fh + Ft + Fbzn +Fm
         sin  = Stream("IN", self.inlet_specs)
 
-        self.state = np.array([
-                T/900,
-                P/38, 
-                Fh/tot_flow,
-                Ft/tot_flow,
-                Fm/tot_flow,
-                Fbzn/tot_flow,
-                self.iter/self.max_iter])
+        # The initial state lists H2 before TOL, unlike the states of step()
+        self.state = StreamState.from_specs(self.inlet_specs).observation(self.iter, self.max_iter)[INLET_ORDER]
 
         self.info.clear()
+        self.equipment.clear()
+        self.trajectory.clear()
         self.actions_list.clear()
         self.done = False
         self.avail_actions = np.array([1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], dtype=np.int32)
@@ -632,9 +630,8 @@ class Flowsheet(Env):
             conv = 0
             
         else:
-            T = sin.get_temp()
-            P = sin.get_press()
-            tol_flow = sin.get_molar_flow("TOL")
+            state = sin.state()
+            T, P, tol_flow = state.T, state.P, state.flow("TOL")
             conv = (self.Cao - tol_flow)/self.Cao
             
 
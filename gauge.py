@@ -0,0 +1,101 @@
+import gc
+import os
+import sys
+import numpy as np
+
+
+# Process resource gauge for long runs: resident memory, OS handles (open file
+# descriptors on Linux, kernel handles on Windows), live COM interfaces and Python
+# objects, sampled between episodes to show that memory stays flat.
+
+def rss():
+    '''Resident set size in MiB'''
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/2**20
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                [(name, ctypes.c_size_t) for name in ("PeakWorkingSetSize", "WorkingSetSize",
+                 "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                 "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.WorkingSetSize/2**20
+    import resource
+    # Peak, not current, resident size on other platforms
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/2**10
+
+
+def handles():
+    if sys.platform.startswith("linux"):
+        return len(os.listdir("/proc/self/fd"))
+    if sys.platform == "win32":
+        import ctypes
+        count = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetProcessHandleCount(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                     ctypes.byref(count))
+        return count.value
+    return None
+
+
+def com_interfaces():
+    '''COM interface pointers held by pythoncom (None without pywin32)'''
+    try:
+        import pythoncom
+    except ImportError:
+        return None
+    return pythoncom._GetInterfaceCount()
+
+
+def sample(objects=True):
+    out = {"rss_mb": rss(), "handles": handles(), "com_interfaces": com_interfaces()}
+    if objects:
+        out["objects"] = len(gc.get_objects())
+    return out
+
+
+
+class MemoryGauge():
+    '''Samples of the process resources, and their growth.
+
+    growth() fits a line through the samples taken after `warmup` episodes and
+    returns the slope of each resource per `per` episodes, so a flat process
+    reports values near zero however long it runs.
+    '''
+    def __init__(self, warmup=1000, per=10000, collect=True):
+        self.warmup = warmup
+        self.per = per
+        self.collect = collect
+        self.samples = []
+
+    def sample(self, episode, **extra):
+        if self.collect:
+            gc.collect()
+        s = dict(sample(), episode=episode, **extra)
+        self.samples.append(s)
+        return s
+
+    def growth(self):
+        samples = [s for s in self.samples if s["episode"] >= self.warmup]
+        if len(samples) < 2:
+            return {}
+        x = np.array([s["episode"] for s in samples], dtype=float)
+        out = {}
+        for key in ("rss_mb", "handles", "com_interfaces", "objects"):
+            y = [s.get(key) for s in samples]
+            if any(v is None for v in y):
+                continue
+            out[key] = float(np.polyfit(x, np.array(y, dtype=float), 1)[0])*self.per
+        return out
+
+    def check(self, max_rss_mb=5., max_handles=1., max_objects=1000.):
+        '''Resources growing faster (per `per` episodes) than allowed'''
+        limits = {"rss_mb": max_rss_mb, "handles": max_handles, "com_interfaces": max_handles,
+                  "objects": max_objects}
+        return {k: v for k, v in self.growth().items() if v > limits[k]}
@@ -0,0 +1,270 @@
+import os
+import csv
+import json
+import time
+import queue
+import argparse
+import threading
+import warnings
+import numpy as np
+from collections import defaultdict, deque
+
+
+# Streaming training metrics. Records are appended to a JSON-lines file, one object
+# per line with its "kind" (step, episode, update, eval, ...) and wall-clock "time",
+# by a background thread, so logging costs the training loop one queue put. The file
+# can be tailed and aggregated while it is being written:
+#   python metrics.py runs/run/seed-0/metrics.jsonl --follow --kind episode
+
+class MetricsWriter():
+    '''Append-only metrics file written in batches by a background thread.
+
+    Lines reach the file at most `flush_interval` seconds after log(). log() blocks
+    only when `max_pending` records are still waiting. Records that can't be
+    serialized are skipped and counted in `skipped` (with one warning); other errors
+    of the writer thread are raised by the next call.
+    '''
+    def __init__(self, path, flush_interval=1.0, max_pending=100000):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.file = open(path, "a", buffering=1 << 16)
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.written = 0
+        self.skipped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def log(self, kind, **values):
+        '''Queue a record. The values must not be modified afterwards.'''
+        self._check()
+        self._check_running()
+        record = {"kind": kind, "time": time.time()}
+        record.update(values)
+        self.queue.put(record)
+
+    def _run(self):
+        deadline = time.time() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.time(), 0.))
+            except queue.Empty:
+                item = None
+            batch = [item] if item is not None else []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = any(item is _CLOSE for item in batch)
+            try:
+                for item in batch:
+                    if item is _CLOSE:
+                        continue
+                    if isinstance(item, threading.Event):
+                        deadline = 0.
+                        continue
+                    try:
+                        line = json.dumps(item, default=_to_builtin)
+                    except (TypeError, ValueError) as e:
+                        # A record that can't be serialized is skipped
+                        if not self.skipped:
+                            warnings.warn(f"Skipping {item.get('kind')!r} metrics records that can't be serialized: {e}")
+                        self.skipped += 1
+                        continue
+                    self.file.write(line + "\n")
+                    self.written += 1
+                if closing or time.time() >= deadline:
+                    self.file.flush()
+                    deadline = time.time() + self.flush_interval
+            except Exception as e:
+                self.error = e
+            finally:
+                for item in batch:
+                    if isinstance(item, threading.Event):
+                        item.set()
+                    self.queue.task_done()
+            if closing:
+                self.file.close()
+                return
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Metrics writer failed") from error
+
+    def _check_running(self):
+        # Nothing would write the record or answer the flush
+        if not self.thread.is_alive():
+            raise RuntimeError("Metrics writer is closed")
+
+    def flush(self):
+        '''Wait until every queued record is on disk'''
+        self._check()
+        self._check_running()
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        self._check()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(_CLOSE)
+            self.thread.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_CLOSE = object()
+
+
+def _to_builtin(x):
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    if hasattr(x, "item"):
+        # Scalar tensors
+        return x.item()
+    raise TypeError(f"Object of type {type(x).__name__} is not JSON serializable")
+
+
+
+# ------------------------------------ Reading ------------------------------------
+def tail(path, kinds=None, follow=False, poll=0.5, stop=None):
+    '''Records of a metrics file, optionally only of some kinds. With `follow`, keep
+    waiting for new records (until `stop()` returns True). A line still being
+    written is held back until it is complete.'''
+    kinds = set(kinds) if kinds else None
+    while not os.path.exists(path):
+        if not follow or (stop is not None and stop()):
+            return
+        time.sleep(poll)
+
+    with open(path, "rb") as f:
+        partial = b""
+        while True:
+            data = f.read()
+            if data:
+                lines = (partial + data).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if kinds is None or record.get("kind") in kinds:
+                        yield record
+            elif not follow or (stop is not None and stop()):
+                return
+            else:
+                time.sleep(poll)
+
+
+def read(path, kinds=None):
+    return list(tail(path, kinds))
+
+
+def flatten(record, prefix=""):
+    '''Numeric fields of a record, nested dicts as dotted keys ("terms.cost")'''
+    out = {}
+    for k, v in record.items():
+        if isinstance(v, dict):
+            out.update(flatten(v, f"{prefix}{k}."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool) and v is not None:
+            out[prefix + k] = v
+    return out
+
+
+class Aggregator():
+    '''Running statistics of the numeric fields of records, by kind: count, last
+    value, mean, mean of the last `window` records, min and max'''
+    def __init__(self, window=100):
+        self.window = window
+        self.stats = defaultdict(dict)
+
+    def add(self, record):
+        fields = self.stats[record.get("kind")]
+        for k, v in flatten(record).items():
+            if k == "time":
+                continue
+            s = fields.get(k)
+            if s is None:
+                s = fields[k] = {"count": 0, "sum": 0., "min": v, "max": v, "recent": deque(maxlen=self.window)}
+            s["count"] += 1
+            s["sum"] += v
+            s["min"] = min(s["min"], v)
+            s["max"] = max(s["max"], v)
+            s["recent"].append(v)
+
+    def update(self, records):
+        for record in records:
+            self.add(record)
+        return self
+
+    def summary(self, kind=None):
+        kinds = list(self.stats) if kind is None else [k for k in (kind,) if k in self.stats]
+        return {k: {name: {"count": s["count"], "last": s["recent"][-1], "mean": s["sum"]/s["count"],
+                           "recent": float(np.mean(s["recent"])), "min": s["min"], "max": s["max"]}
+                    for name, s in self.stats[k].items()}
+                for k in kinds}
+
+
+def to_csv(path, out, kind="episode"):
+    '''Flattened records of one kind as a CSV table (e.g. for plotting reward curves)'''
+    rows = [dict(flatten(r), kind=r["kind"]) for r in tail(path, [kind])]
+    columns = sorted({k for row in rows for k in row})
+    with open(out, "w", newline="") as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
+def _print_summary(aggregator, kind, keys):
+    for k, fields in aggregator.summary(kind).items():
+        print(f"--- {k} ---")
+        for name, s in sorted(fields.items()):
+            if keys and name not in keys:
+                continue
+            print(f"  {name:28s} n={s['count']:<7d} last={s['last']:<12.5g} recent={s['recent']:<12.5g} "
+                  f"mean={s['mean']:<12.5g} min={s['min']:<12.5g} max={s['max']:.5g}")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize (or follow) a metrics file")
+    parser.add_argument("path")
+    parser.add_argument("--kind", help="only records of this kind")
+    parser.add_argument("--keys", nargs="*", help="only these fields")
+    parser.add_argument("--window", type=int, default=100, help="records of the recent mean")
+    parser.add_argument("--follow", action="store_true", help="keep reading as the file grows")
+    parser.add_argument("--every", type=float, default=10., help="seconds between summaries with --follow")
+    parser.add_argument("--csv", help="write the records of --kind (default episode) to a CSV file")
+    args = parser.parse_args()
+
+    if args.csv:
+        n = to_csv(args.path, args.csv, args.kind or "episode")
+        print(f"{n} records written to {args.csv}")
+    elif not args.follow:
+        _print_summary(Aggregator(args.window).update(tail(args.path, [args.kind] if args.kind else None)),
+                       args.kind, args.keys)
+    else:
+        aggregator = Aggregator(args.window)
+        last = time.time()
+        try:
+            for record in tail(args.path, [args.kind] if args.kind else None, follow=True, poll=0.5):
+                aggregator.add(record)
+                if time.time() - last >= args.every:
+                    _print_summary(aggregator, args.kind, args.keys)
+                    last = time.time()
+        except KeyboardInterrupt:
+            _print_summary(aggregator, args.kind, args.keys)
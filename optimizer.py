@@ -0,0 +1,254 @@
+import os
+import numpy as np
+import multiprocessing as mp
+
+
+# Entries of the 21 continuous parameters (see Flowsheet.interpolation) read by each
+# discrete action. The mixer has none; the recycle units also read their split ratio.
+ACTION_PARAMS = {
+    0: (),            # Mixer
+    1: (0, 1),        # Heater: P_hex, T_hex
+    2: (9, 10),       # Column: nstages_c, dist_rate_c
+    3: (2,),          # Cooler: T_cooler
+    4: (3, 4),        # PFR: D1, L1
+    5: (5, 6),        # Adiabatic PFR: D2, L2
+    6: (16, 17),      # Flash: T_flash, P_flash
+    7: (18, 19, 20),  # Flash with recycle: T_flashr, P_flashr, rr_flash
+    8: (7, 8),        # Column for CH4: nstages_cp, dist_rate_cp
+    9: (11, 12, 13),  # Column with recycle: nstages_cr, dist_rate_cr, rr_cr
+    10: (14, 15),     # TriColumn: nstages_tc, dist_rate_tc
+}
+
+
+# ------------------------------------ Design problem ------------------------------------
+class DesignProblem():
+    '''Continuous parameters of a fixed discrete action sequence.
+
+    The search vector x in [0, 1]^dim holds, step by step, only the entries of the
+    continuous action that the step's unit reads, so a unit used twice gets its
+    own parameters. The remaining entries are taken from `base`.
+    '''
+    def __init__(self, actions, base=None):
+        self.actions = [int(a) for a in actions]
+        if base is None:
+            base = [np.full(21, 0.5) for _ in self.actions]
+        self.base = [np.array(c, dtype=float) for c in base]
+        self.slots = [(i, j) for i, a in enumerate(self.actions) for j in ACTION_PARAMS[a]]
+        self.dim = len(self.slots)
+
+    @classmethod
+    def from_plan(cls, plan):
+        # Plan of TreeSearchPlanner.best()
+        return cls(plan["actions"], plan["c_actions"])
+
+    def encode(self, c_actions):
+        return np.array([c_actions[i][j] for i, j in self.slots], dtype=float)
+
+    def decode(self, x):
+        c_actions = [c.copy() for c in self.base]
+        for (i, j), v in zip(self.slots, x):
+            c_actions[i][j] = v
+        return c_actions
+
+    def x0(self):
+        return self.encode(self.base)
+
+
+def run_design(env, actions, c_actions):
+    '''Simulate a design from reset(). An action that the masks do not allow (the
+    streams no longer lead to the same topology) ends the episode as a failure.'''
+    _, sin = env.reset()
+    mask = env.action_masks(sin, inlet=True)
+    rewards, done, feasible = [], False, True
+    for a, c in zip(actions, c_actions):
+        if not mask[a]:
+            rewards.append(env.reward_config.failure)
+            feasible = False
+            break
+        _, reward, done, _, sin = env.step({"discrete": a, "continuous": c}, sin)
+        rewards.append(reward)
+        if done:
+            break
+        mask = env.action_masks(sin)
+
+    return {
+        "return": float(sum(rewards)),
+        "rewards": [float(r) for r in rewards],
+        "complete": feasible and len(rewards) == len(actions),
+        "solves": len(rewards) if feasible else len(rewards) - 1,
+    }
+
+
+# ------------------------------------ Evaluators ------------------------------------
+class SerialEvaluator():
+    '''Evaluates a batch of candidates one after the other on a single Flowsheet'''
+    def __init__(self, env):
+        self.env = env
+
+    def evaluate(self, problem, X):
+        return [run_design(self.env, problem.actions, problem.decode(x)) for x in X]
+
+    def close(self):
+        pass
+
+
+_worker_env = None
+
+def _worker_init(config, documents):
+    global _worker_env
+    from Simulation import Simulation
+    from env import Flowsheet
+
+    # Each worker owns one engine document (one per process); with the remote
+    # backend every worker is pointed at its own server document
+    if documents is not None:
+        os.environ["AUTOPROCRL_SIMSERVER_DOC"] = str(documents.get())
+    sim = Simulation(config["aspen_file"], config["directory"], backend=config.get("backend"))
+    _worker_env = Flowsheet(sim, config["pure"], config["max_iter"], config["inlet_specs"],
+                            config.get("cost_model"), config.get("reward_config"),
+                            config.get("fidelity", "rigorous"), config.get("recovery"))
+
+def _worker_run(design):
+    actions, c_actions = design
+    return run_design(_worker_env, actions, c_actions)
+
+
+class ProcessEvaluator():
+    '''Evaluates a batch of candidates in parallel, one simulator per worker process.
+
+    `config` holds the Simulation and Flowsheet arguments: aspen_file, directory,
+    backend, pure, max_iter, inlet_specs and optionally cost_model, reward_config,
+    fidelity and recovery (a StepRecovery, copied into every worker).
+    With backend="remote" the workers use server documents 0..workers-1.
+    '''
+    def __init__(self, config, workers=4):
+        self.workers = workers
+        ctx = mp.get_context("spawn")
+        documents = None
+        if config.get("backend") == "remote":
+            documents = ctx.Queue()
+            for i in range(workers):
+                documents.put(i)
+        self.pool = ctx.Pool(workers, initializer=_worker_init, initargs=(config, documents))
+
+    def evaluate(self, problem, X):
+        designs = [(problem.actions, problem.decode(x)) for x in X]
+        return self.pool.map(_worker_run, designs, chunksize=1)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+
+# ------------------------------------ CMA-ES ------------------------------------
+class CMAES():
+    '''(mu/mu_w, lambda)-CMA-ES maximizing over the unit box.
+    Candidates are clipped to [0, 1] and the clipped points are used in the update.'''
+    def __init__(self, x0, sigma=0.2, popsize=None, seed=None):
+        n = len(x0)
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.mean = np.clip(np.array(x0, dtype=float), 0, 1)
+        self.sigma = sigma
+        self.popsize = popsize or 4 + int(3*np.log(max(n, 1)))
+
+        self.mu = self.popsize//2
+        w = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = w/w.sum()
+        self.mueff = 1/np.sum(self.weights**2)
+
+        self.cc = (4 + self.mueff/n)/(n + 4 + 2*self.mueff/n)
+        self.cs = (self.mueff + 2)/(n + self.mueff + 5)
+        self.c1 = 2/((n + 1.3)**2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2*(self.mueff - 2 + 1/self.mueff)/((n + 2)**2 + self.mueff))
+        self.damps = 1 + 2*max(0, np.sqrt((self.mueff - 1)/(n + 1)) - 1) + self.cs
+        self.chiN = np.sqrt(n)*(1 - 1/(4*n) + 1/(21*n**2))
+
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.B = np.eye(n)
+        self.D = np.ones(n)
+        self.C = np.eye(n)
+        self.generation = 0
+
+    def ask(self):
+        z = self.rng.standard_normal((self.popsize, self.n))
+        y = (z*self.D) @ self.B.T
+        return np.clip(self.mean + self.sigma*y, 0, 1)
+
+    def tell(self, X, fitness):
+        X = np.asarray(X)
+        order = np.argsort(fitness)[::-1][:self.mu]
+        Y = (X[order] - self.mean)/self.sigma
+        yw = self.weights @ Y
+        self.mean = self.mean + self.sigma*yw
+
+        invsqrtC = self.B @ np.diag(1/self.D) @ self.B.T
+        self.ps = (1 - self.cs)*self.ps + np.sqrt(self.cs*(2 - self.cs)*self.mueff)*(invsqrtC @ yw)
+        norm_ps = np.linalg.norm(self.ps)
+        hsig = norm_ps/np.sqrt(1 - (1 - self.cs)**(2*(self.generation + 1)))/self.chiN < 1.4 + 2/(self.n + 1)
+        self.pc = (1 - self.cc)*self.pc + hsig*np.sqrt(self.cc*(2 - self.cc)*self.mueff)*yw
+
+        rank_mu = (Y.T*self.weights) @ Y
+        self.C = (1 - self.c1 - self.cmu)*self.C \
+            + self.c1*(np.outer(self.pc, self.pc) + (1 - hsig)*self.cc*(2 - self.cc)*self.C) \
+            + self.cmu*rank_mu
+        self.sigma *= np.exp((self.cs/self.damps)*(norm_ps/self.chiN - 1))
+
+        self.C = (self.C + self.C.T)/2
+        D2, self.B = np.linalg.eigh(self.C)
+        self.D = np.sqrt(np.maximum(D2, 1e-20))
+        self.generation += 1
+
+
+
+# ------------------------------------ Refinement ------------------------------------
+class DesignRefiner():
+    '''Tunes the continuous parameters of a fixed topology with CMA-ES, evaluating each
+    generation as one batch on the evaluator. `budget` counts simulator solves
+    (Flowsheet.step calls), as in TreeSearchPlanner; an evaluation that fails before
+    its first solve still counts as one. A topology without continuous parameters is
+    only evaluated once.'''
+    def __init__(self, problem, evaluator, budget=500, sigma=0.2, popsize=None, seed=None):
+        self.problem = problem
+        self.evaluator = evaluator
+        self.budget = budget
+        self.es = CMAES(problem.x0(), sigma, popsize, seed) if problem.dim else None
+
+        self.solves = 0
+        self.best_x = None
+        self.best_result = None
+        self.history = []  # Best return found against solves spent
+
+    def consider(self, x, result):
+        self.solves += max(result["solves"], 1)
+        if self.best_result is None or result["return"] > self.best_result["return"]:
+            self.best_x, self.best_result = np.array(x), result
+        self.history.append((self.solves, self.best_result["return"]))
+
+    def refine(self):
+        # Start from the given design
+        x0 = self.problem.x0()
+        self.consider(x0, self.evaluator.evaluate(self.problem, [x0])[0])
+
+        while self.es is not None and self.solves < self.budget:
+            X = self.es.ask()
+            results = self.evaluator.evaluate(self.problem, X)
+            for x, result in zip(X, results):
+                self.consider(x, result)
+            self.es.tell(X, [r["return"] for r in results])
+
+        return self.best()
+
+    def best(self):
+        c_actions = self.problem.decode(self.best_x)
+        return {
+            "actions": self.problem.actions,
+            "c_actions": c_actions,
+            "return": self.best_result["return"],
+            "rewards": self.best_result["rewards"],
+            "complete": self.best_result["complete"],
+            "solves": self.solves,
+            "history": self.history,
+        }
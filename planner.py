@@ -0,0 +1,202 @@
+import math
+import numpy as np
+import torch
+
+
+class Node():
+    def __init__(self, prefix, parent=None, prior=1.0):
+        self.prefix = prefix
+        self.parent = parent
+        self.prior = prior
+        self.children = {}
+        self.N = 0
+        self.W = 0.
+
+        # Filled when the node is simulated
+        self.handle = None
+        self.state = None
+        self.mask = None
+        self.priors = None
+        self.c_action = None
+        self.value = 0.
+        self.reward = 0.
+        self.ret = 0.
+        self.done = False
+
+    @property
+    def Q(self):
+        return self.W/self.N if self.N else None
+
+
+
+class TreeSearchPlanner():
+    '''Monte Carlo tree search over the masked discrete actions of a Flowsheet.
+
+    Priors come from the HybridActorNetwork, leaf values from the
+    HybridCriticNetwork and the continuous parameters of every step are the Beta
+    means (as in PPO.evaluate). Each unique action prefix is simulated at most
+    once: its solved state is kept as a Flowsheet snapshot and branched from with
+    restore(). `budget` bounds the number of simulator solves per plan.
+    '''
+    def __init__(self, env, ppo, budget=100, c_puct=1.5, gamma=0.99, greedy_first=True):
+        self.env = env
+        self.ppo = ppo
+        self.budget = budget
+        self.c_puct = c_puct
+        self.gamma = gamma
+        self.greedy_first = greedy_first
+
+        self.nodes = {}
+        self.solves = 0
+        self.cache_hits = 0
+        self.root = None
+
+
+    # ------------------------------------ Networks ------------------------------------
+    def evaluate(self, node):
+        with torch.no_grad():
+            state = torch.tensor(node.state, dtype=torch.float)
+            mask = torch.tensor(node.mask, dtype=torch.bool)
+            pi, alpha, beta = self.ppo.actor.forward(state, mask)
+            value = self.ppo.critic(state).item()
+        node.priors = pi.numpy()
+        node.c_action = (alpha/(alpha + beta)).numpy().flatten()
+        node.value = value
+
+
+    # ------------------------------------ Tree ------------------------------------
+    def reset(self):
+        for node in self.nodes.values():
+            if node.handle is not None:
+                self.env.release(node.handle)
+        self.nodes.clear()
+        self.solves = 0
+        self.cache_hits = 0
+
+        state, sin = self.env.reset()
+        root = Node(())
+        root.state = state
+        root.mask = self.env.action_masks(sin, inlet=True)
+        root.handle = self.env.snapshot(sin)
+        self.evaluate(root)
+        self.nodes[()] = self.root = root
+
+    def child(self, node, a):
+        prefix = node.prefix + (a,)
+        if prefix in self.nodes:
+            self.cache_hits += 1
+            return self.nodes[prefix]
+
+        # Simulate the step from the parent state
+        _, sin = self.env.restore(node.handle)
+        action = {"discrete": a, "continuous": node.c_action}
+        state, reward, done, _, sout = self.env.step(action, sin)
+        self.solves += 1
+
+        child = Node(prefix, node, node.priors[a])
+        child.state = state
+        child.reward = reward
+        child.ret = node.ret + reward
+        child.done = done
+        if not done:
+            child.mask = self.env.action_masks(sout)
+            child.handle = self.env.snapshot(sout)
+            self.evaluate(child)
+
+        node.children[a] = child
+        self.nodes[prefix] = child
+        return child
+
+    def select(self, node):
+        legal = np.flatnonzero(node.mask)
+        fpu = node.Q if node.Q is not None else node.value
+        sqrt_n = math.sqrt(node.N + 1)
+
+        best, best_score = None, -math.inf
+        for a in legal:
+            child = node.children.get(a)
+            q = child.Q if child is not None and child.Q is not None else fpu
+            n = child.N if child is not None else 0
+            score = q + self.c_puct*node.priors[a]*sqrt_n/(1 + n)
+            if score > best_score:
+                best, best_score = int(a), score
+        return best
+
+    def backup(self, path, leaf):
+        G = 0. if leaf.done else leaf.value
+        for node in reversed(path):
+            G = node.reward + self.gamma*G
+            node.N += 1
+            node.W += G
+
+
+    # ------------------------------------ Planning ------------------------------------
+    def plan(self):
+        self.reset()
+        if self.greedy_first:
+            self.rollout_greedy()
+
+        stale = 0
+        while self.solves < self.budget and stale < 10*self.budget:
+            solves = self.solves
+            node, path = self.root, [self.root]
+            while not node.done:
+                a = self.select(node)
+                node = self.child(node, a)
+                path.append(node)
+                if node.N == 0:
+                    break
+            self.backup(path[1:], node)
+            self.root.N += 1
+            stale = stale + 1 if self.solves == solves else 0
+
+        return self.best()
+
+    def rollout_greedy(self):
+        node = self.root
+        while not node.done and self.solves < self.budget:
+            node = self.child(node, int(np.argmax(node.priors)))
+        path = []
+        while node.parent is not None:
+            path.append(node)
+            node = node.parent
+        self.backup(path[::-1], path[0] if path else self.root)
+
+    def best(self):
+        '''Best complete design found, by episode return'''
+        done = [n for n in self.nodes.values() if n.done]
+        if done:
+            node = max(done, key=lambda n: n.ret)
+        else:
+            node = self.root
+            while node.children:
+                node = max(node.children.values(), key=lambda n: n.N)
+
+        actions, c_actions = [], []
+        n = node
+        while n.parent is not None:
+            actions.append(n.prefix[-1])
+            c_actions.append(n.parent.c_action)
+            n = n.parent
+        return {
+            "actions": actions[::-1],
+            "c_actions": c_actions[::-1],
+            "return": node.ret,
+            "complete": node.done,
+            "solves": self.solves,
+            "cache_hits": self.cache_hits,
+        }
+
+    def replay(self, plan):
+        '''Re-simulate a plan from reset() (costs one solve per step). Returns the
+        rewards and the info of the last step (None for an empty plan).'''
+        _, sin = self.env.reset()
+        self.env.action_masks(sin, inlet=True)
+        rewards, info = [], None
+        for a, c in zip(plan["actions"], plan["c_actions"]):
+            _, reward, done, info, sin = self.env.step({"discrete": a, "continuous": c}, sin)
+            rewards.append(reward)
+            if done:
+                break
+            self.env.action_masks(sin)
+        return rewards, info
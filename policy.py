@@ -0,0 +1,231 @@
+import os
+import copy
+import argparse
+import numpy as np
+
+
+# Exported policies for evaluation and planning workers. export() writes the weights
+# of a HybridActorNetwork (and optionally the HybridCriticNetwork) to a .npz file,
+# optionally quantized to float16 or int8, and PolicyRuntime runs them with NumPy
+# only: the deterministic policy of PPO.evaluate (masked argmax and Beta mean)
+# without importing torch. export_torchscript() and export_onnx() write the same
+# deterministic policy for other runtimes.
+#   python policy.py best_model/ppo_actor.pth --critic best_model/ppo_critic.pth --quantize int8
+
+ACTOR_LAYERS = ("fc1", "fc2", "fc3", "fc_pi", "pi_l", "fc_cont", "alpha", "beta")
+CRITIC_LAYERS = ("fc1", "fc2", "v")
+MASKED_LOGIT = -1e+8
+FORMAT = 1
+
+
+def _state_dict(module):
+    if isinstance(module, dict):
+        return module
+    if isinstance(module, str):
+        import torch
+        return torch.load(module, map_location="cpu")
+    return module.state_dict()
+
+
+def quantize(w, mode):
+    '''Stored form of a weight matrix: (weights, per-row scales or None)'''
+    if mode is None:
+        return w.astype(np.float32), None
+    if mode == "fp16":
+        return w.astype(np.float16), None
+    if mode == "int8":
+        # Symmetric, one scale per output unit
+        scale = np.abs(w).max(axis=1)/127.
+        scale[scale == 0] = 1.
+        return np.round(w/scale[:, None]).astype(np.int8), scale.astype(np.float32)
+    raise ValueError(f"Unknown quantization {mode!r} (None, 'fp16' or 'int8')")
+
+
+def dequantize(w, scale):
+    w = w.astype(np.float32)
+    return w*scale[:, None] if scale is not None else w
+
+
+def export(actor, path, critic=None, quantize_weights=None):
+    '''Write the actor (and critic) weights to a NumPy .npz file. `actor` and
+    `critic` are modules, state dicts or .pth files of PPO.save/best_save.
+    Biases are kept in float32.'''
+    arrays = {"format": np.array(FORMAT), "quantize": np.array(quantize_weights or "")}
+    for prefix, module, layers in (("actor", actor, ACTOR_LAYERS), ("critic", critic, CRITIC_LAYERS)):
+        if module is None:
+            continue
+        state = _state_dict(module)
+        for layer in layers:
+            w, scale = quantize(state[f"{layer}.weight"].detach().cpu().numpy(), quantize_weights)
+            arrays[f"{prefix}/{layer}/w"] = w
+            arrays[f"{prefix}/{layer}/b"] = state[f"{layer}.bias"].detach().cpu().numpy().astype(np.float32)
+            if scale is not None:
+                arrays[f"{prefix}/{layer}/scale"] = scale
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+    return path
+
+
+
+# ------------------------------------ NumPy runtime ------------------------------------
+def _softplus(x):
+    return np.logaddexp(0., x)
+
+
+class PolicyRuntime():
+    '''Deterministic hybrid policy of an exported .npz file.
+
+    evaluate(state, mask) returns the same (discrete action, continuous
+    parameters) as PPO.evaluate for one state, and (n,) actions and (n, 21)
+    parameters for a batch of states and masks. forward() mirrors
+    HybridActorNetwork.forward and value() the critic, when it was exported.
+    Quantized weights are expanded to float32 on load.
+    '''
+    def __init__(self, path):
+        with np.load(path) as data:
+            if int(data["format"]) != FORMAT:
+                raise ValueError(f"{path} is not a policy file of format {FORMAT}")
+            self.quantize = str(data["quantize"]) or None
+            self.actor = self._layers(data, "actor", ACTOR_LAYERS)
+            self.critic = self._layers(data, "critic", CRITIC_LAYERS) if "critic/v/w" in data else None
+
+        self.state_dim = self.actor["fc1"][0].shape[0]
+        self.d_actions = self.actor["pi_l"][0].shape[1]
+        self.c_actions = self.actor["alpha"][0].shape[1]
+
+    @staticmethod
+    def _layers(data, prefix, layers):
+        out = {}
+        for layer in layers:
+            scale = data.get(f"{prefix}/{layer}/scale")
+            # Transposed once, so that a layer is x @ w + b
+            w = np.ascontiguousarray(dequantize(data[f"{prefix}/{layer}/w"], scale).T)
+            out[layer] = (w, data[f"{prefix}/{layer}/b"])
+        return out
+
+    def _trunk(self, state):
+        a = self.actor
+        x = np.tanh(state @ a["fc1"][0] + a["fc1"][1])
+        x = np.tanh(x @ a["fc2"][0] + a["fc2"][1])
+        return np.tanh(x @ a["fc3"][0] + a["fc3"][1])
+
+    def _heads(self, state, mask):
+        a = self.actor
+        x = self._trunk(state)
+        x_d = np.tanh(x @ a["fc_pi"][0] + a["fc_pi"][1])
+        logits = np.where(mask, x_d @ a["pi_l"][0] + a["pi_l"][1], np.float32(MASKED_LOGIT))
+        x_c = np.tanh(x @ a["fc_cont"][0] + a["fc_cont"][1])
+        alpha = _softplus(x_c @ a["alpha"][0] + a["alpha"][1]) + 1
+        beta = _softplus(x_c @ a["beta"][0] + a["beta"][1]) + 1
+        return logits, alpha, beta
+
+    def forward(self, state, mask):
+        '''(pi, alpha, beta) of HybridActorNetwork.forward'''
+        logits, alpha, beta = self._heads(np.asarray(state, dtype=np.float32), np.asarray(mask, dtype=bool))
+        e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return e/e.sum(axis=-1, keepdims=True), alpha, beta
+
+    def evaluate(self, state, mask):
+        '''Masked argmax and Beta mean (PPO.evaluate)'''
+        logits, alpha, beta = self._heads(np.asarray(state, dtype=np.float32), np.asarray(mask, dtype=bool))
+        a_d = logits.argmax(axis=-1)
+        a_c = alpha/(alpha + beta)
+        if a_d.ndim == 0:
+            return int(a_d), a_c
+        return a_d, a_c
+
+    def value(self, state):
+        if self.critic is None:
+            raise ValueError("The critic was not exported with this policy")
+        c = self.critic
+        x = np.maximum(np.asarray(state, dtype=np.float32) @ c["fc1"][0] + c["fc1"][1], 0.)
+        x = np.maximum(x @ c["fc2"][0] + c["fc2"][1], 0.)
+        return (x @ c["v"][0] + c["v"][1])[..., 0]
+
+    def __repr__(self):
+        return (f"PolicyRuntime(state_dim={self.state_dim}, discrete={self.d_actions}, "
+                f"continuous={self.c_actions}, quantize={self.quantize}, critic={self.critic is not None})")
+
+
+
+# ------------------------------------ TorchScript / ONNX ------------------------------------
+def _deterministic(actor):
+    import torch
+    import torch.nn as nn
+
+    class DeterministicPolicy(nn.Module):
+        '''Batched PPO.evaluate: (states, masks) -> (actions, parameters)'''
+        def __init__(self, actor):
+            super().__init__()
+            # A frozen copy: the exported graph carries no gradients
+            self.actor = copy.deepcopy(actor).requires_grad_(False)
+
+        def forward(self, state, mask):
+            pi, alpha, beta = self.actor.forward(state, mask, dim=-1)
+            return torch.argmax(pi, dim=-1), alpha/(alpha + beta)
+
+    return DeterministicPolicy(actor).eval()
+
+
+def _example(actor):
+    import torch
+    mask = torch.ones(1, actor.d_actions, dtype=torch.bool)
+    return torch.zeros(1, actor.state_dim), mask
+
+
+def export_torchscript(actor, path):
+    '''Traced deterministic policy, loadable with torch.jit.load(path)(states, masks)'''
+    import torch
+    with torch.no_grad():
+        module = torch.jit.trace(_deterministic(actor), _example(actor))
+    module.save(path)
+    return path
+
+
+def export_onnx(actor, path, opset=17):
+    '''Deterministic policy as an ONNX graph with inputs "state" (n, state_dim) and
+    "mask" (n, discrete) and outputs "action" and "parameters" (requires onnx and
+    onnxscript)'''
+    import torch
+    with torch.no_grad():
+        torch.onnx.export(_deterministic(actor), _example(actor), path, opset_version=opset,
+                          input_names=["state", "mask"], output_names=["action", "parameters"],
+                          dynamic_axes={"state": {0: "n"}, "mask": {0: "n"}, "action": {0: "n"},
+                                        "parameters": {0: "n"}})
+    return path
+
+
+def load_actor(path):
+    '''HybridActorNetwork of a .pth file, its sizes read from the weights'''
+    import torch
+    from gym.spaces import Discrete, Box, Dict
+    from agent import HybridActorNetwork
+
+    state = torch.load(path, map_location="cpu")
+    c_actions = state["alpha.weight"].shape[0]
+    actions = Dict({"discrete": Discrete(state["pi_l.weight"].shape[0]),
+                    "continuous": Box(low=np.zeros(c_actions), high=np.ones(c_actions), dtype=np.float32)})
+    actor = HybridActorNetwork(state["fc1.weight"].shape[1], actions, state["fc1.weight"].shape[0], 0.)
+    actor.load_state_dict(state)
+    return actor.eval()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained actor for inference")
+    parser.add_argument("actor", help="actor weights (e.g. best_model/ppo_actor.pth)")
+    parser.add_argument("--critic", help="critic weights, for PolicyRuntime.value")
+    parser.add_argument("--format", choices=["npz", "torchscript", "onnx"], default="npz")
+    parser.add_argument("--quantize", choices=["fp16", "int8"], help="weight quantization (npz)")
+    parser.add_argument("--out", help="output file (default: policy.npz, policy.pt or policy.onnx)")
+    args = parser.parse_args()
+
+    out = args.out or {"npz": "policy.npz", "torchscript": "policy.pt", "onnx": "policy.onnx"}[args.format]
+    if args.format == "npz":
+        export(args.actor, out, critic=args.critic, quantize_weights=args.quantize)
+        print(PolicyRuntime(out), "->", out)
+    elif args.format == "torchscript":
+        print(export_torchscript(load_actor(args.actor), out))
+    else:
+        print(export_onnx(load_actor(args.actor), out))
@@ -0,0 +1,67 @@
+import numpy as np
+from archive import transitions, episode_return
+from optimizer import ACTION_PARAMS
+from reward import read_trajectories
+
+
+# Offline pretraining of the PPO actor-critic from an archive of recorded episodes
+# (line-delimited JSON of Flowsheet.episode_record, see reward.write_trajectory).
+# The archive is read in chunks of episodes, so it never has to fit in memory.
+
+def successful(record):
+    '''Episode that ended by meeting both purities (no failure, no purity penalty)'''
+    if not record["steps"]:
+        return False
+    last = record["steps"][-1]
+    return last["converged"] and last.get("done", False) and last.get("terms", {}).get("purity", 0) == 0
+
+
+def parameter_masks(d_actions, n=21):
+    '''Continuous entries read by each discrete action (see optimizer.ACTION_PARAMS)'''
+    masks = np.zeros((len(d_actions), n))
+    for i, a in enumerate(np.asarray(d_actions).flatten()):
+        masks[i, list(ACTION_PARAMS[int(a)])] = 1
+    return masks
+
+
+def chunks(path, chunk_size=64, gamma=0.99, min_return=None):
+    '''Yields the transitions of `chunk_size` episodes at a time, as the arguments of
+    PPO.bc_update: (s, masks, acts_d, acts_c, c_masks, returns, imitate)'''
+    records = []
+    for record in read_trajectories(path):
+        if record["steps"]:
+            records.append(record)
+        if len(records) == chunk_size:
+            yield _chunk(records, gamma, min_return)
+            records = []
+    if records:
+        yield _chunk(records, gamma, min_return)
+
+
+def _chunk(records, gamma, min_return):
+    s, masks, acts_d, acts_c, returns = transitions(records, gamma)
+    imitate = np.concatenate([
+        np.full(len(r["steps"]), successful(r) if min_return is None else episode_return(r) >= min_return)
+        for r in records])
+    return s, masks, acts_d, acts_c, parameter_masks(acts_d, acts_c.shape[1]), returns, imitate
+
+
+def pretrain(ppo, path, epochs=5, chunk_size=64, gamma=None, min_return=None, n_epochs=1):
+    '''Fit the actor (behaviour cloning of successful episodes, or of those with a
+    return of at least `min_return`) and the critic (discounted returns of all
+    episodes) before PPO fine-tuning.
+    Returns the mean actor and critic losses of every epoch, weighting the losses of
+    each chunk by its imitated and its total transitions.'''
+    gamma = ppo.gamma if gamma is None else gamma
+    history = []
+    for _ in range(epochs):
+        a_losses, a_weights, c_losses, c_weights = [], [], [], []
+        for chunk in chunks(path, chunk_size, gamma, min_return):
+            a_loss, c_loss = ppo.bc_update(*chunk, n_epochs=n_epochs)
+            a_losses.append(a_loss.item())
+            a_weights.append(float(np.sum(chunk[-1])))
+            c_losses.append(c_loss.item())
+            c_weights.append(len(chunk[0]))
+        a_mean = np.average(a_losses, weights=a_weights) if sum(a_weights) else 0.
+        history.append((float(a_mean), float(np.average(c_losses, weights=c_weights))))
+    return history
@@ -0,0 +1,119 @@
+import numpy as np
+import torch
+from collections import deque
+
+
+# Fewest steps still needed to reach a purified BZN product from each value_step
+# (see Flowsheet.masking): heater, reactor, cooler, flash, purge column, column.
+STEPS_TO_GO = {"pre": 6, "hex": 6, "reac": 5, "cool": 4, "flash": 3, "predistill": 2,
+               "distill": 1, "pure": 1}
+
+# Flowsheet only takes a column distillate as the BZN product above this flow
+BZN_OUT_MIN = 10
+
+# Phases after the reactors, where no more BZN is formed
+POST_REACTION = ("cool", "flash", "predistill", "distill")
+
+
+class EpisodePruner():
+    '''Ends hopeless Flowsheet episodes before they are simulated out.
+
+    An episode is cut when it can no longer finish (too few iterations left for
+    the remaining units, or too little BZN left for a product), or when the
+    critic's estimate of its return falls below a running threshold: the
+    `quantile` of the returns of the last `window` episodes, once `warmup`
+    episodes have been seen.
+
+    Call check() after every step (after action_masks, so value_step is
+    current). A pruned step should be stored with done=True but dw=False, so
+    that PPO bootstraps its target from the critic value of the last state.
+    '''
+    def __init__(self, env, critic, gamma=0.99, quantile=0.1, margin=0., window=200, warmup=50,
+            bounds=True):
+        self.env = env
+        self.critic = critic
+        self.gamma = gamma
+        self.quantile = quantile
+        self.margin = margin
+        self.warmup = warmup
+        self.bounds = bounds
+
+        self.returns = deque(maxlen=window)
+        self.lengths = deque(maxlen=window)  # Of episodes that ran to the end
+
+        self.ret = 0.
+        self.reason = None
+        self.episodes = 0
+        self.pruned = {"steps": 0, "bzn": 0, "critic": 0}
+        self.solves_saved = 0.
+
+    def threshold(self):
+        if len(self.returns) < self.warmup:
+            return None
+        return float(np.quantile(self.returns, self.quantile)) - self.margin
+
+    def value(self, state):
+        with torch.no_grad():
+            return self.critic(torch.tensor(state, dtype=torch.float)).item()
+
+    def hopeless(self, sin):
+        env = self.env
+        if env.max_iter - env.iter < STEPS_TO_GO.get(env.value_step, 1):
+            return "steps"
+        if env.value_step in POST_REACTION:
+            state = sin.state()
+            bzn = state.flow("BZN")
+            if any("M" in uo for uo in env.actions_list):
+                # Unreacted toluene may still be recycled to the reactors
+                bzn += state.flow("TOL")
+            if bzn <= BZN_OUT_MIN:
+                return "bzn"
+        return None
+
+
+    def reset(self):
+        # Drop the running return of an episode abandoned by the caller
+        self.ret = 0.
+
+    def check(self, state, sin, reward, done):
+        '''Returns (prune, value): whether to end the episode now and the bootstrapped
+        value gamma*V(state) of its remainder (0 when it ended by itself)'''
+        self.ret += reward
+        self.reason = None
+        if done:
+            self.finish(self.env.iter)
+            return False, 0.
+
+        value = self.gamma*self.value(state)
+        reason = self.hopeless(sin) if self.bounds else None
+        threshold = self.threshold()
+        if reason is None and threshold is not None and self.ret + value < threshold:
+            reason = "critic"
+        if reason is None:
+            return False, value
+
+        self.reason = reason
+        self.pruned[reason] += 1
+        # Episodes that cannot finish run to max_iter; others are taken as long as usual
+        remaining = self.env.max_iter - self.env.iter
+        if reason != "steps" and self.lengths:
+            remaining = min(max(float(np.mean(self.lengths)) - self.env.iter, 1), remaining)
+        self.solves_saved += remaining
+        self.ret += value
+        self.finish(None)
+        return True, value
+
+    def finish(self, length):
+        self.returns.append(self.ret)
+        if length is not None:
+            self.lengths.append(length)
+        self.episodes += 1
+        self.ret = 0.
+
+    def stats(self):
+        return {
+            "episodes": self.episodes,
+            "pruned": dict(self.pruned),
+            "solves_saved": self.solves_saved,
+            "threshold": self.threshold(),
+        }
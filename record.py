@@ -0,0 +1,463 @@
+import os
+import sys
+import math
+import time
+import atexit
+import struct
+from collections import Counter, defaultdict, deque
+from wire import encode, decode
+from Simulation import SimulationError, save_document_state, restore_document_state
+
+
+# Recorder of the traffic between Simulation and the engine document, and a replayer
+# serving the recorded responses without the engine (e.g. on Linux), to benchmark and
+# regression-test Flowsheet.step and the unit operation classes offline.
+#
+# File:   MAGIC, then one frame per event: length (uint32) | wire-encoded event
+# Event:  [op, path, value, error]
+#   get / set        path from the document Tree, Value read or written
+#   add / remove     path of the Elements collection, element name
+#   remove_all       path
+#   insert_row       path, [dimension, location]
+#   count            path, Elements.Count
+#   elements         path of a failed Elements(...) lookup (only recorded when it fails)
+#   call             [method], [args, result, seconds] (Run2, Reinit, InitFromArchive2, ...)
+#   attr / setattr   [name], value (FullName, Visible, SuppressDialogs, IsRunning)
+# `error` is None, or the repr of the exception raised by the engine, which the
+# replayer raises again as a ReplayedError.
+
+MAGIC = b"AUTOPROCRL-REC1\n"
+_LEN = struct.Struct("!I")
+
+CALLS = ("Run2", "Reinit", "Stop", "Close", "Save", "SaveAs", "InitFromArchive2", "InitFromFile2")
+ATTRS = ("FullName", "Visible", "SuppressDialogs")
+
+
+class ReplayMismatch(RuntimeError):
+    '''The code under replay asked for something the recording does not contain'''
+    pass
+
+class ReplayedError(SimulationError):
+    '''An engine error that occurred while recording'''
+    pass
+
+
+def read_events(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an engine recording")
+        data = f.read()
+    events, pos = [], 0
+    while pos < len(data):
+        n, = _LEN.unpack_from(data, pos)
+        pos += _LEN.size
+        if pos + n > len(data):
+            break   # Truncated last frame of an interrupted recording
+        events.append(decode(data[pos:pos + n]))
+        pos += n
+    return events
+
+def summary(path):
+    '''Number of recorded events by operation (document calls by method)'''
+    counts = Counter()
+    for op, p, _, error in read_events(path):
+        counts[f"call:{p[0]}" if op == "call" else op] += 1
+        if error is not None:
+            counts["errors"] += 1
+    return counts
+
+
+
+# ---------------------------------------------- Recording ----------------------------------------------
+
+class Recorder():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.stats = Counter()
+
+    def log(self, op, path, value=None, error=None):
+        data = encode([op, path, value, error])
+        self.file.write(_LEN.pack(len(data)) + data)
+        self.stats[op] += 1
+
+    def run(self, op, path, fn, value=lambda result: result):
+        '''Call fn() and log its result (or the error it raises)'''
+        try:
+            result = fn()
+        except Exception as e:
+            self.log(op, path, None, repr(e))
+            raise
+        self.log(op, path, value(result))
+        return result
+
+    def flush(self):
+        if not self.file.closed:
+            self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+_recorders = {}
+
+def recorder(path):
+    '''Recorder of a file, shared by every document of the process (a restarted
+    engine keeps appending to the same recording)'''
+    path = os.path.abspath(path)
+    if path not in _recorders:
+        _recorders[path] = Recorder(path)
+        atexit.register(_recorders[path].close)
+    return _recorders[path]
+
+
+class RecordingNode():
+    def __init__(self, target, path, recorder):
+        self._target = target
+        self._path = path
+        self._recorder = recorder
+
+    @property
+    def Elements(self):
+        return RecordingElements(self._target.Elements, self._path, self._recorder)
+
+    @property
+    def Value(self):
+        return self._recorder.run("get", self._path, lambda: self._target.Value)
+
+    @Value.setter
+    def Value(self, value):
+        def set():
+            self._target.Value = value
+        self._recorder.run("set", self._path, set, lambda _: value)
+
+    def RemoveAll(self):
+        self._recorder.run("remove_all", self._path, self._target.RemoveAll, lambda _: None)
+
+    def FindNode(self, path):
+        self._recorder.stats["find"] += 1
+        return RecordingNode(self._target.FindNode(path), self._path + _split(path), self._recorder)
+
+
+class RecordingElements():
+    def __init__(self, target, path, recorder):
+        self._target = target
+        self._path = path
+        self._recorder = recorder
+
+    def __call__(self, key):
+        self._recorder.stats["navigate"] += 1
+        try:
+            node = self._target(key)
+        except Exception as e:
+            self._recorder.log("elements", self._path + [key], None, repr(e))
+            raise
+        return RecordingNode(node, self._path + [key], self._recorder)
+
+    def Item(self, key):
+        return self(key)
+
+    def Add(self, composite):
+        node = self._recorder.run("add", self._path, lambda: self._target.Add(composite), lambda _: composite)
+        return RecordingNode(node, self._path + [_name(composite)], self._recorder)
+
+    def Remove(self, name):
+        self._recorder.run("remove", self._path, lambda: self._target.Remove(name), lambda _: name)
+
+    def InsertRow(self, dimension, location):
+        self._recorder.run("insert_row", self._path, lambda: self._target.InsertRow(dimension, location),
+                           lambda _: [dimension, location])
+
+    @property
+    def Count(self):
+        return self._recorder.run("count", self._path, lambda: self._target.Count)
+
+
+class RecordingEngine():
+    def __init__(self, target, recorder):
+        self._target = target
+        self._recorder = recorder
+
+    @property
+    def IsRunning(self):
+        return self._recorder.run("attr", ["IsRunning"], lambda: self._target.IsRunning)
+
+
+class RecordedState():
+    '''Saved copy of the recorded document'''
+    def __init__(self, state):
+        self.state = state
+
+    def discard(self):
+        if self.state is not None:
+            self.state.discard()
+            self.state = None
+
+    def __del__(self):
+        # A finalizer must not send to a server: a served copy (RemoteState) is
+        # dropped by its own finalizer, only a saved archive is removed here
+        if self.state is not None and self.state.kind == "archive":
+            self.state.discard()
+
+
+class RecordingDocument():
+    '''Proxy of an engine document logging every operation to a Recorder'''
+    def __init__(self, target, recorder):
+        object.__setattr__(self, "target", target)
+        object.__setattr__(self, "recorder", recorder)
+
+    @property
+    def Application(self):
+        return self
+
+    @property
+    def Tree(self):
+        # The document may replace its tree (InitFromArchive2)
+        return RecordingNode(self.target.Tree, [], self.recorder)
+
+    @property
+    def Engine(self):
+        return RecordingEngine(self.target.Engine, self.recorder)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in CALLS:
+            return lambda *args: self.call(name, args, lambda: getattr(self.target, name)(*args))
+        if name not in ATTRS:
+            raise AttributeError(name)
+        return self.recorder.run("attr", [name], lambda: getattr(self.target, name))
+
+    def __setattr__(self, name, value):
+        self.recorder.run("setattr", [name], lambda: setattr(self.target, name, value), lambda _: value)
+
+    def call(self, name, args, fn):
+        t = time.perf_counter()
+        result = self.recorder.run("call", [name], fn,
+                                   lambda result: [list(args), _plain(result), time.perf_counter() - t])
+        if name in ("Run2", "Close"):
+            self.recorder.flush()
+        return result
+
+    def snapshot_state(self):
+        return RecordedState(self.call("snapshot_state", (), lambda: save_document_state(self.target)))
+
+    def restore_state(self, state):
+        self.call("restore_state", (), lambda: restore_document_state(self.target, state.state))
+
+
+
+# ---------------------------------------------- Replay ----------------------------------------------
+
+class Replayer():
+    '''Serves the events of a recording.
+
+    With `strict`, operations must come in the recorded order and the values
+    written must match the recorded ones; otherwise every operation is served the
+    next recorded response of the same operation and path, and the values written
+    are not checked. With `delay`, document calls (Run2, ...) take as long as they
+    did while recording.
+    '''
+    def __init__(self, path, strict=True, delay=False, rel_tol=1e-9):
+        self.path = path
+        self.strict = strict
+        self.delay = delay
+        self.rel_tol = rel_tol
+        self.stats = Counter()
+        self.rewind()
+
+    def rewind(self):
+        events = read_events(self.path)
+        self.position = 0
+        self.events = deque(events)
+        self.by_key = defaultdict(deque)
+        if not self.strict:
+            for event in events:
+                self.by_key[(event[0], _key(event[1]))].append(event)
+
+    @property
+    def remaining(self):
+        return len(self.events) if self.strict else sum(len(q) for q in self.by_key.values())
+
+    def take(self, op, path, value=None, check=False):
+        if self.strict:
+            if not self.events:
+                raise ReplayMismatch(f"Recording exhausted at {op} {path} (event {self.position})")
+            event = self.events[0]
+            if event[0] != op or _key(event[1]) != _key(path):
+                raise ReplayMismatch(f"Event {self.position}: {op} {path} requested, "
+                                     f"{event[0]} {event[1]} recorded")
+            if check and event[3] is None and not _same(event[2], value, self.rel_tol):
+                raise ReplayMismatch(f"Event {self.position}: {op} {path} = {value!r}, "
+                                     f"{event[2]!r} recorded")
+            self.events.popleft()
+        else:
+            queue = self.by_key.get((op, _key(path)))
+            if not queue:
+                raise ReplayMismatch(f"No recorded {op} {path} left")
+            event = queue.popleft()
+
+        self.position += 1
+        self.stats[op] += 1
+        if event[3] is not None:
+            raise ReplayedError(event[3])
+        return event[2]
+
+    def navigate(self, path):
+        # Elements(...) lookups are only recorded when they fail
+        self.stats["navigate"] += 1
+        if self.strict:
+            failed = self.events and self.events[0][0] == "elements" and _key(self.events[0][1]) == _key(path)
+        else:
+            failed = bool(self.by_key.get(("elements", _key(path))))
+        if failed:
+            self.take("elements", path)
+
+    def call(self, name, args):
+        _, result, seconds = self.take("call", [name])
+        if self.delay:
+            time.sleep(seconds)
+        return result
+
+
+_replayers = {}
+
+def replayer(path, strict=True, delay=False):
+    '''Replayer of a file, shared by every document of the process'''
+    path = os.path.abspath(path)
+    if path not in _replayers:
+        _replayers[path] = Replayer(path, strict, delay)
+    return _replayers[path]
+
+
+class ReplayNode():
+    def __init__(self, replayer, path):
+        self._replayer = replayer
+        self._path = path
+        self.Elements = ReplayElements(replayer, path)
+
+    @property
+    def Value(self):
+        return self._replayer.take("get", self._path)
+
+    @Value.setter
+    def Value(self, value):
+        self._replayer.take("set", self._path, value, check=True)
+
+    def RemoveAll(self):
+        self._replayer.take("remove_all", self._path)
+
+    def FindNode(self, path):
+        self._replayer.stats["find"] += 1
+        return ReplayNode(self._replayer, self._path + _split(path))
+
+
+class ReplayElements():
+    def __init__(self, replayer, path):
+        self._replayer = replayer
+        self._path = path
+
+    def __call__(self, key):
+        self._replayer.navigate(self._path + [key])
+        return ReplayNode(self._replayer, self._path + [key])
+
+    def Item(self, key):
+        return self(key)
+
+    def Add(self, composite):
+        self._replayer.take("add", self._path, composite, check=True)
+        return ReplayNode(self._replayer, self._path + [_name(composite)])
+
+    def Remove(self, name):
+        self._replayer.take("remove", self._path, name, check=True)
+
+    def InsertRow(self, dimension, location):
+        self._replayer.take("insert_row", self._path, [dimension, location], check=True)
+
+    @property
+    def Count(self):
+        return self._replayer.take("count", self._path)
+
+
+class ReplayEngine():
+    def __init__(self, replayer):
+        self._replayer = replayer
+
+    @property
+    def IsRunning(self):
+        return self._replayer.take("attr", ["IsRunning"])
+
+
+class ReplayState():
+    pass
+
+
+class ReplayDocument():
+    '''Engine document answering with the responses of a recording'''
+    def __init__(self, replayer):
+        object.__setattr__(self, "replayer", replayer)
+        object.__setattr__(self, "Tree", ReplayNode(replayer, []))
+        object.__setattr__(self, "Engine", ReplayEngine(replayer))
+
+    @property
+    def Application(self):
+        return self
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in CALLS:
+            return lambda *args: self.replayer.call(name, args)
+        if name not in ATTRS:
+            raise AttributeError(name)
+        return self.replayer.take("attr", [name])
+
+    def __setattr__(self, name, value):
+        self.replayer.take("setattr", [name], value, check=True)
+
+    def snapshot_state(self):
+        self.replayer.call("snapshot_state", ())
+        return ReplayState()
+
+    def restore_state(self, state):
+        self.replayer.call("restore_state", ())
+
+
+
+def _split(path):
+    return [p for p in path.strip("/").split("/")]
+
+def _name(composite):
+    return str(composite).partition("!")[0]
+
+def _key(path):
+    return tuple(path)
+
+def _plain(result):
+    # Results that cannot be stored (COM objects, saved states) are recorded as None
+    try:
+        encode(result)
+        return result
+    except TypeError:
+        return None
+
+def _same(recorded, value, rel_tol):
+    if isinstance(recorded, (list, tuple)) and isinstance(value, (list, tuple)):
+        return len(recorded) == len(value) and all(_same(a, b, rel_tol) for a, b in zip(recorded, value))
+    if isinstance(recorded, (int, float)) and isinstance(value, (int, float)) \
+            and not isinstance(recorded, bool) and not isinstance(value, bool):
+        return math.isclose(recorded, value, rel_tol=rel_tol, abs_tol=1e-12) or recorded == value
+    if hasattr(value, "item"):
+        return _same(recorded, value.item(), rel_tol)
+    return recorded == value
+
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        counts = summary(path)
+        print(f"{path}: {sum(v for k, v in counts.items() if k != 'errors')} events")
+        for op, n in sorted(counts.items()):
+            print(f"  {op:24s} {n}")
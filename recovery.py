@@ -0,0 +1,84 @@
+import time
+from Simulation import SimulationError, EngineTimeout
+
+
+def engine_errors():
+    '''Exceptions that mean the engine (not the flowsheet) failed'''
+    errors = [SimulationError, OSError, EOFError]
+    try:
+        import pywintypes
+        errors.append(pywintypes.com_error)
+    except ImportError:
+        pass
+    try:
+        from simserver import SimServerError
+        errors.append(SimServerError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+
+class StepRecovery():
+    '''Self-healing Flowsheet steps.
+
+    When a step raises an engine error (COM error, hung Run2, lost server
+    connection, ...) the engine is restarted from the archive, the episode is
+    rebuilt by replaying its recorded actions and the step is retried, waiting
+    `backoff`, 2*`backoff`, ... (at most `max_backoff`) seconds between attempts.
+    After `max_retries` failed attempts the error is raised.
+
+    Pass it as Flowsheet(..., recovery=StepRecovery()). `run_timeout` bounds the
+    seconds a single Run2 may take.
+    '''
+    def __init__(self, max_retries=3, backoff=1.0, max_backoff=60.0, run_timeout=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.run_timeout = run_timeout
+        self.errors = engine_errors()
+
+        self.stats = {"errors": 0, "timeouts": 0, "restarts": 0, "retries": 0,
+                      "replayed_steps": 0, "recovered": 0, "gave_up": 0}
+        self.last_error = None
+
+    def step(self, env, action, sin):
+        if self.run_timeout is not None:
+            env.sim.run_timeout = self.run_timeout
+
+        history = [(s["d_action"], s["c_action"]) for s in env.trajectory]
+        attempt = 0
+        while True:
+            try:
+                if attempt:
+                    sin = self.rebuild(env, history)
+                result = env.solve_step(action, sin)
+                if attempt:
+                    self.stats["recovered"] += 1
+                return result
+
+            except self.errors as e:
+                self.last_error = repr(e)
+                self.stats["errors"] += 1
+                if isinstance(e, EngineTimeout):
+                    self.stats["timeouts"] += 1
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.stats["gave_up"] += 1
+                    raise
+                time.sleep(min(self.backoff*2**(attempt - 1), self.max_backoff))
+                self.stats["retries"] += 1
+
+    def rebuild(self, env, history):
+        '''Restart the engine and replay the episode up to the failed step.
+        Returns the inlet stream of that step.'''
+        env.sim.Restart()
+        self.stats["restarts"] += 1
+
+        _, sin = env.reset()
+        env.action_masks(sin, inlet=True)
+        for d_action, c_action in history:
+            _, _, _, _, sin = env.solve_step({"discrete": d_action, "continuous": c_action}, sin)
+            env.action_masks(sin)
+            self.stats["replayed_steps"] += 1
+        return sin
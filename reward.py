@@ -0,0 +1,212 @@
+import json
+import argparse
+import numpy as np
+from economics import DEFAULT_COST_MODEL
+from streams import T_, TOL_, H2_, CH4_, BZN_, TOT_  # Layout of a recorded stream snapshot
+
+# Reward terms, in the order they are summed by Flowsheet.step
+TERMS = ("cost", "tol", "h2", "ch4", "temperature", "h2_ratio", "purity", "flow", "bzn_extra")
+
+
+def snapshot(stream):
+    '''Solved state of a stream: [T, P, F_TOL, F_H2, F_CH4, F_BZN, F_total]'''
+    return stream.state().snapshot()
+
+
+def fraction(snap, idx):
+    return snap[idx]/snap[TOT_]
+
+
+
+class RewardConfig():
+    '''Coefficients of the Flowsheet reward. Defaults reproduce Flowsheet.step.'''
+    def __init__(self, T_max_recycle=750, T_max=700, bonus_T=0.2,
+            h2_tol_ratio=3, bonus_F=0.5, flash_penalty=-15.0,
+            tol_weight=1.0, h2_weight=0.8, ch4_weight=0.4,
+            metan_purity=0.80, purity_penalty=15, flow_bonus=0.2,
+            bzn_extra=1.2, failure=-8):
+
+        self.T_max_recycle = T_max_recycle
+        self.T_max = T_max
+        self.bonus_T = bonus_T
+        self.h2_tol_ratio = h2_tol_ratio
+        self.bonus_F = bonus_F
+        self.flash_penalty = flash_penalty
+        self.tol_weight = tol_weight
+        self.h2_weight = h2_weight
+        self.ch4_weight = ch4_weight
+        self.metan_purity = metan_purity
+        self.purity_penalty = purity_penalty
+        self.flow_bonus = flow_bonus
+        self.bzn_extra = bzn_extra
+        self.failure = failure
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+DEFAULT_REWARD = RewardConfig()
+
+
+
+def step_reward(step, episode, flags, config=DEFAULT_REWARD):
+    '''Reward of one recorded step.
+
+    `step` is a step record (see Flowsheet.step_record) and `episode` holds the
+    episode constants (pure, max_iter, Cao, Cbo). `flags` carries the purity
+    flags between steps and is not modified.
+
+    Returns (reward, terms, done, flags).
+    '''
+    flags = dict(flags)
+    if not step["converged"]:
+        return config.failure, {}, True, flags
+
+    d_action = step["d_action"]
+    sin, sout = step["sin"], step["sout"]
+    pure, max_iter = episode["pure"], episode["max_iter"]
+    Cao, Cbo = episode["Cao"], episode["Cbo"]
+    done = False
+
+    # Cons 1: (Temperature inside of reactor no greater than 704°C)
+    T_max = config.T_max_recycle if step["has_mixer"] else config.T_max
+    bonus_T = config.bonus_T if d_action in (4, 5) and sout[T_] <= T_max else 0.
+
+    # Cons 2: (The proportion of hydrogen to toluene in the reactor should be at least 3:1)
+    if d_action == 7 and (step["rec"][H2_] + Cbo) > config.h2_tol_ratio*Cao:
+        bonus_F = config.bonus_F
+    elif d_action == 6:
+        bonus_F = config.flash_penalty
+    else:
+        bonus_F = 0.
+
+    # Driving force (reduction of the amount of TOL)
+    if not d_action in (6, 7, 8):
+        bonus = config.tol_weight*(fraction(sin, TOL_) - fraction(sout, TOL_))
+    else:
+        bonus = 0.
+
+    # Driving force 2 (reduction of the amount of H2)
+    if d_action in (6, 7):
+        bonus2 = config.h2_weight*(fraction(sin, H2_) - fraction(sout, H2_))
+    else:
+        bonus2 = 0.
+
+    # Driving force 3 (reduction of the amount of CH4)
+    if d_action == 8:
+        bonus3 = config.ch4_weight*sout[BZN_]/Cao
+    else:
+        bonus3 = 0.
+
+    # Cons 3. Output purities
+    if not flags["metan_pure"] and step["metan_out"] is not None:
+        flags["metan_pure"] = fraction(step["metan_out"], CH4_) >= config.metan_purity
+
+    if step["bzn_out"] is not None:
+        flags["bzn_pure"] = fraction(step["bzn_out"], BZN_) >= pure
+
+    penalty = 0
+    reward_flow = 0
+    bzn_extra = 0
+
+    if step["iter"] >= max_iter:
+        done = True
+        if not flags["bzn_pure"] or not flags["metan_pure"]:
+            penalty -= config.purity_penalty*(pure - fraction(sout, BZN_))
+    elif flags["bzn_pure"] and flags["metan_pure"]:
+        done = True
+        reward_flow += config.flow_bonus*(max_iter - step["iter"])
+
+    # Reward for more BZN flow
+    if flags["bzn_pure"] and not flags["bzn_extra_added"]:
+        bzn_extra = config.bzn_extra*step["bzn_out"][BZN_]/Cao
+        flags["bzn_extra_added"] = True
+
+    terms = dict(zip(TERMS, (step["cost"], bonus, bonus2, bonus3, bonus_T, bonus_F,
+                             penalty, reward_flow, bzn_extra)))
+    reward = sum(terms.values())
+    return reward, terms, done, flags
+
+
+def initial_flags():
+    return {"bzn_pure": False, "metan_pure": False, "bzn_extra_added": False}
+
+
+
+# ---------------------------------------- Offline re-scoring ----------------------------------------
+
+def rescore(trajectory, config=DEFAULT_REWARD, cost_model=None, gamma=1.0):
+    '''Recompute the rewards of a recorded trajectory without the simulator.
+
+    With a `cost_model` the cost term is re-evaluated from the recorded
+    equipment, otherwise the logged cost is kept. Returns (rewards, ret).
+    '''
+    flags = initial_flags()
+    rewards = []
+    for step in trajectory["steps"]:
+        if cost_model is not None and step.get("equipment") is not None:
+            step = dict(step, cost=-float(cost_model.unit_costs(**step["equipment"])))
+        reward, _, done, flags = step_reward(step, trajectory, flags, config)
+        rewards.append(reward)
+        if done:
+            break
+
+    ret = 0.
+    for r in reversed(rewards):
+        ret = r + gamma*ret
+    return rewards, ret
+
+
+def rescore_archive(trajectories, config=DEFAULT_REWARD, cost_model=None, gamma=1.0):
+    '''Rewards and returns of every trajectory of an archive'''
+    rewards, returns = [], []
+    for trajectory in trajectories:
+        r, ret = rescore(trajectory, config, cost_model, gamma)
+        rewards.append(r)
+        returns.append(ret)
+    return rewards, np.array(returns)
+
+
+def write_trajectory(path, trajectory):
+    with open(path, "a") as f:
+        f.write(json.dumps(trajectory, default=_to_builtin) + "\n")
+
+
+def read_trajectories(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _to_builtin(x):
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError(f"Object of type {type(x).__name__} is not JSON serializable")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score an archive of recorded trajectories")
+    parser.add_argument("archive", help="line-delimited JSON written by write_trajectory")
+    parser.add_argument("--config", help="JSON file with RewardConfig coefficients")
+    parser.add_argument("--recost", action="store_true", help="re-evaluate costs with the default CostModel")
+    parser.add_argument("--gamma", type=float, default=1.0)
+    args = parser.parse_args()
+
+    config = DEFAULT_REWARD
+    if args.config:
+        with open(args.config) as f:
+            config = RewardConfig.from_dict(json.load(f))
+
+    cost_model = DEFAULT_COST_MODEL if args.recost else None
+    _, returns = rescore_archive(read_trajectories(args.archive), config, cost_model, args.gamma)
+    print(f"episodes: {len(returns)}")
+    if len(returns):
+        print(f"mean return: {returns.mean():.4f}  max return: {returns.max():.4f}")
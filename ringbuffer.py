@@ -0,0 +1,424 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+
+# Shared-memory transition buffers between collector processes and the PPO learner.
+# A TrajectoryRing holds transitions in columns laid out like PPO.make_batch (states,
+# discrete and continuous actions, rewards, next states, log-probabilities, done,
+# dw and masks). Collectors write whole episodes into it in place and the learner
+# maps the filled rows as tensors without copying them.
+#
+# Handoff uses sequence counters instead of locks. Every row has a sequence number,
+# and the first row of an episode also holds the episode length. A writer fills its
+# rows first and then publishes the episode by writing the sequence number of the
+# first row. The reader takes rows while the sequence number of the next episode
+# start equals its read position, and publishes its read position (tail) once the
+# rows are free again. Writers only wait, in write_episode(), while the ring is
+# full (backpressure). Several writers need the `lock` of the ring, which is held
+# only to reserve rows. An episode never wraps around the end of the ring: the rows
+# left at the end are published as an empty episode of skipped rows first, which
+# the reader frees right away. A take() may wrap around: its rows are then copied
+# out of the two segments.
+#
+# SharedWeights passes the learner's network weights back to the collectors with a
+# sequence lock: the version is odd while the learner writes.
+
+_HEADER = ("capacity", "state_dim", "c_dim", "d_dim", "reserved", "tail", "episodes", "closed", "waiting")
+_ALIGN = 64
+
+
+def _columns(state_dim, c_dim, d_dim):
+    '''(name, dtype, row shape) of the columns, in make_batch order'''
+    return (("s", np.float32, (state_dim,)), ("a", np.int64, (1,)), ("c", np.float32, (c_dim,)),
+            ("r", np.float32, (1,)), ("s_prime", np.float32, (state_dim,)), ("p_d", np.float32, (1,)),
+            ("p_c", np.float32, (c_dim,)), ("done", np.float32, (1,)), ("dw", np.float32, (1,)),
+            ("mask", np.bool_, (d_dim,)), ("seq", np.int64, ()), ("length", np.int64, ()))
+
+
+def _layout(capacity, state_dim, c_dim, d_dim):
+    offset = -(-8*len(_HEADER)//_ALIGN)*_ALIGN
+    layout = []
+    for name, dtype, shape in _columns(state_dim, c_dim, d_dim):
+        nbytes = capacity*int(np.prod(shape, dtype=int))*np.dtype(dtype).itemsize
+        layout.append((name, dtype, (capacity,) + shape, offset))
+        offset += -(-nbytes//_ALIGN)*_ALIGN
+    return layout, offset
+
+
+class RingClosed(RuntimeError):
+    pass
+
+
+class TrajectoryRing():
+    '''Ring of `capacity` transitions in shared memory. Create it in the learner and
+    attach(name) in the collectors.
+
+    Writers: write_episode(transitions) with PPO.put_data tuples. Reader: take()
+    returns the published whole episodes as tensors in PPO.make_batch order, and
+    release() frees them once the update is done.
+    '''
+    def __init__(self, capacity, state_dim, c_dim=21, d_dim=11, name=None, lock=None, _shm=None):
+        layout, size = _layout(capacity, state_dim, c_dim, d_dim)
+        self.owner = _shm is None
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size) if _shm is None else _shm
+        self.name = self.shm.name
+        self.lock = lock
+        self.capacity = capacity
+        self.header = np.ndarray(len(_HEADER), np.int64, self.shm.buf)
+        self.cols = {name: np.ndarray(shape, dtype, self.shm.buf, offset) for name, dtype, shape, offset in layout}
+        if self.owner:
+            self.header[:] = 0
+            self.header[:4] = capacity, state_dim, c_dim, d_dim
+            self.cols["seq"][:] = -1
+        self.taken = 0
+        self.poll = 0.001
+
+    @classmethod
+    def attach(cls, name, lock=None):
+        shm = shared_memory.SharedMemory(name=name)
+        capacity, state_dim, c_dim, d_dim = np.ndarray(4, np.int64, shm.buf).tolist()
+        return cls(capacity, state_dim, c_dim, d_dim, lock=lock, _shm=shm)
+
+    def _get(self, field):
+        return int(self.header[_HEADER.index(field)])
+
+    def _set(self, field, value):
+        self.header[_HEADER.index(field)] = value
+
+    @property
+    def closed(self):
+        return bool(self._get("closed"))
+
+    def __len__(self):
+        '''Rows reserved by writers and not yet released by the reader'''
+        return self._get("reserved") - self._get("tail")
+
+
+    # ------------------------------------ Writer ------------------------------------
+    def _wait(self, rows, deadline):
+        # Rows needed, for the reader to tell that the ring is full
+        self._set("waiting", rows)
+        if self.closed:
+            self._set("waiting", 0)
+            raise RingClosed("The trajectory ring was closed")
+        if deadline is not None and time.time() > deadline:
+            self._set("waiting", 0)
+            raise TimeoutError("The learner is not releasing rows")
+        time.sleep(self.poll)
+
+    def _reserve(self, n, timeout):
+        '''First row of `n` rows reserved for an episode'''
+        deadline = None if timeout is None else time.time() + timeout
+        seq, length = self.cols["seq"], self.cols["length"]
+        while True:
+            start = self._get("reserved")
+            pos = start % self.capacity
+            if pos + n <= self.capacity:
+                break
+            # An episode never wraps around: the rows up to the end are skipped on
+            # their own, published as an empty episode, before the episode is
+            # reserved from the start of the ring
+            pad = self.capacity - pos
+            if start + pad - self._get("tail") <= self.capacity:
+                self._set("reserved", start + pad)
+                length[pos] = -pad
+                seq[pos] = start
+                continue
+            self._wait(pad, deadline)
+
+        while start + n - self._get("tail") > self.capacity:
+            self._wait(n, deadline)
+        self._set("reserved", start + n)
+        self._set("waiting", 0)
+        return start
+
+    def write_episode(self, transitions, timeout=None):
+        '''Write the (s, a, c, r, s_prime, p_d, p_c, done, dw, mask) transitions of
+        one episode. Blocks while the ring is full.'''
+        n = len(transitions)
+        if not 0 < n <= self.capacity:
+            raise ValueError(f"Episode of {n} transitions does not fit a ring of {self.capacity}")
+        if self.closed:
+            raise RingClosed("The trajectory ring was closed")
+        if self.lock is not None:
+            with self.lock:
+                start = self._reserve(n, timeout)
+        else:
+            start = self._reserve(n, timeout)
+
+        cols, seq, length = self.cols, self.cols["seq"], self.cols["length"]
+        pos = start % self.capacity
+        rows = slice(pos, pos + n)
+        fields = list(zip(*transitions))
+        for name, values in zip(("s", "a", "c", "r", "s_prime", "p_d", "p_c", "done", "dw", "mask"), fields):
+            cols[name][rows] = np.asarray(values).reshape(cols[name][rows].shape)
+        seq[pos + 1:pos + n] = np.arange(start + 1, start + n)
+        length[pos] = n
+        # Publishes the episode
+        seq[pos] = start
+        return n
+
+
+    # ------------------------------------ Reader ------------------------------------
+    def _published(self, start):
+        '''(rows, episodes, skipped, at_end) of the episodes published from row
+        `start` up to the end of the ring, after `skipped` rows at the end'''
+        seq, length = self.cols["seq"], self.cols["length"]
+        i, episodes, skipped = start, 0, 0
+        while seq[i % self.capacity] == i:
+            n = int(length[i % self.capacity])
+            if n < 0:
+                if i > start:
+                    return i - start, episodes, skipped, True
+                # Skip the rows at the end and read from the start of the ring
+                skipped, start, i = -n, start - n, i - n
+                continue
+            i += n
+            episodes += 1
+            if i % self.capacity == 0:
+                return i - start, episodes, skipped, True
+        return i - start, episodes, skipped, False
+
+    def _segments(self, min_rows):
+        '''([(start, rows)], rows, episodes, end) of the published episodes from the
+        read position, until `min_rows` rows, continued across the end of the ring'''
+        segments, total, episodes = [], 0, 0
+        i = self._get("tail")
+        while total < min_rows:
+            rows, n, skipped, at_end = self._published(i)
+            i += skipped
+            if rows:
+                segments.append((i, rows))
+                total += rows
+                episodes += n
+                i += rows
+            if not (rows and at_end):
+                break
+        return segments, total, episodes, i
+
+    def take(self, min_rows=1, timeout=None):
+        '''Tensors of the published episodes at the read position (at least
+        `min_rows` rows), in PPO.make_batch order. They are views of the shared
+        memory, valid until release(), unless the rows wrap around the end of the
+        ring, where they are copied. Fewer rows are only taken when the ring is
+        full. Returns None on timeout or when the ring is closed.'''
+        import torch
+        if self.taken:
+            raise RuntimeError("release() the rows taken before")
+        deadline = None if timeout is None else time.time() + timeout
+        min_rows = min(min_rows, self.capacity)
+        while True:
+            segments, rows, episodes, end = self._segments(min_rows)
+            if rows >= min_rows:
+                break
+            if not rows and end > self._get("tail"):
+                # Only skipped rows at the end of the ring: free them for the writer
+                # waiting to write its episode at the start
+                self._set("tail", end)
+                continue
+            # Every reserved row is published and a writer waits for rows that are
+            # only freed by this take: the ring can't hold `min_rows` rows of whole
+            # episodes
+            reserved, waiting = self._get("reserved"), self._get("waiting")
+            if rows and end == reserved and waiting and reserved + waiting - self._get("tail") > self.capacity:
+                break
+            if self.closed or (deadline is not None and time.time() > deadline):
+                return None
+            time.sleep(self.poll)
+
+        self.taken = end - self._get("tail")
+        self._set("episodes", self._get("episodes") + episodes)
+        names = ("s", "a", "c", "r", "s_prime", "p_d", "p_c", "done", "dw", "mask")
+        views = [[torch.from_numpy(self.cols[name][start % self.capacity:start % self.capacity + n])
+                  for start, n in segments] for name in names]
+        return tuple(v[0] if len(v) == 1 else torch.cat(v) for v in views)
+
+    def release(self):
+        '''Free the rows of the last take() for the writers'''
+        self._set("tail", self._get("tail") + self.taken)
+        self.taken = 0
+
+
+    def close(self):
+        '''Stop the writers (RingClosed) and the reader; the owner frees the memory'''
+        self._set("closed", 1)
+
+    def unlink(self):
+        self.header = self.cols = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+
+class SharedWeights():
+    '''Network weights published by the learner and read by the collectors'''
+    def __init__(self, shapes, name=None, _shm=None):
+        self.shapes = dict(shapes)
+        size = _ALIGN + 4*sum(int(np.prod(s, dtype=int)) for s in self.shapes.values())
+        self.owner = _shm is None
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size) if _shm is None else _shm
+        self.name = self.shm.name
+        self.version = np.ndarray(1, np.int64, self.shm.buf)
+        self.data = np.ndarray((size - _ALIGN)//4, np.float32, self.shm.buf, _ALIGN)
+        if self.owner:
+            self.version[0] = 0
+        self.seen = 0
+
+    @classmethod
+    def of(cls, modules):
+        '''Weights of {prefix: torch module}'''
+        return cls({f"{p}.{k}": tuple(v.shape) for p, m in modules.items() for k, v in m.state_dict().items()})
+
+    @classmethod
+    def attach(cls, name, shapes):
+        return cls(shapes, _shm=shared_memory.SharedMemory(name=name))
+
+    def publish(self, modules):
+        self.version[0] += 1
+        pos = 0
+        for m in modules.values():
+            for v in m.state_dict().values():
+                n = v.numel()
+                self.data[pos:pos + n] = v.detach().cpu().numpy().ravel()
+                pos += n
+        self.version[0] += 1
+
+    def load(self, modules):
+        '''Load the newest published weights into {prefix: torch module}. Returns
+        the version, or None when there is nothing new.'''
+        import torch
+        version = int(self.version[0])
+        if version == self.seen or version % 2:
+            return None
+        data = self.data.copy()
+        if int(self.version[0]) != version:
+            # Published again while copying
+            return None
+        pos, states = 0, {p: {} for p in modules}
+        for key, shape in self.shapes.items():
+            p, _, k = key.partition(".")
+            n = int(np.prod(shape, dtype=int))
+            states[p][k] = torch.from_numpy(data[pos:pos + n].reshape(shape))
+            pos += n
+        for p, m in modules.items():
+            m.load_state_dict(states[p])
+        self.seen = version
+        return version
+
+    def unlink(self):
+        self.version = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+
+# ------------------------------------ Local collectors ------------------------------------
+def _collector(config, seed, ring_name, weights_name, shapes, lock, document):
+    import tempfile
+    from train import build, run_episode, seed_everything
+
+    if document is not None:
+        os.environ["AUTOPROCRL_SIMSERVER_DOC"] = str(document)
+    seed_everything(seed)
+    # The collector never saves its copy of the networks
+    with tempfile.TemporaryDirectory() as run_dir:
+        env, ppo, pruner = build(dict(config, seed=seed), run_dir)
+    ring = TrajectoryRing.attach(ring_name, lock)
+    weights = SharedWeights.attach(weights_name, shapes)
+    nets = {"actor": ppo.actor, "critic": ppo.critic}
+    try:
+        while weights.load(nets) is None and not ring.closed:
+            time.sleep(0.01)
+        while not ring.closed:
+            weights.load(nets)
+            ppo.data = []
+            run_episode(env, ppo, pruner)
+            ring.write_episode(ppo.data)
+    except RingClosed:
+        pass
+    finally:
+        ring.unlink()
+        weights.unlink()
+
+
+def train_shared(config, collectors=2, updates=100, capacity=None, run_dir=None, log=print):
+    '''PPO updates on the episodes of `collectors` local processes, passed through a
+    TrajectoryRing; the weights go back through SharedWeights. The final weights
+    are saved in `run_dir` (default: out/name/shared). With the remote backend,
+    collector i steps server document AUTOPROCRL_SIMSERVER_DOC + i.'''
+    from train import build_agent, seed_everything
+
+    seed = config.get("seed", 0)
+    seed_everything(seed)
+    # The learner only trains: it builds no environment
+    ppo = build_agent(config, run_dir or os.path.join(config["out"], config["name"], "shared"))
+    remote = (config.get("backend") or os.environ.get("AUTOPROCRL_BACKEND")) == "remote"
+    doc = int(os.environ.get("AUTOPROCRL_SIMSERVER_DOC", 0))
+    capacity = capacity or 4*config["update_every"]
+    ctx = mp.get_context("spawn")
+    ring = TrajectoryRing(capacity, ppo.s_dim, ppo.acts_dims, ppo.masks_dims, lock=ctx.Lock())
+    nets = {"actor": ppo.actor, "critic": ppo.critic}
+    weights = SharedWeights.of(nets)
+    weights.publish(nets)
+
+    procs = [ctx.Process(target=_collector, daemon=True,
+                         args=(config, seed + 1 + i, ring.name, weights.name, weights.shapes, ring.lock,
+                               doc + i if remote else None))
+             for i in range(collectors)]
+    for p in procs:
+        p.start()
+    update = 0
+    try:
+        for update in range(1, updates + 1):
+            t = time.time()
+            batch = None
+            while batch is None:
+                batch = ring.take(config["update_every"], timeout=1.)
+                if batch is None and not any(p.is_alive() for p in procs):
+                    raise RuntimeError(f"The collectors exited (exit codes {[p.exitcode for p in procs]})")
+            if not ppo.env_with_Dead:
+                batch = batch[:8] + (batch[8].clone().zero_(),) + batch[9:]
+            if ppo.replay.maxlen > 1:
+                # Older batches are replayed after their rows were released
+                batch = tuple(b.clone() for b in batch)
+            rows, ret, ends = len(batch[0]), float(batch[3].sum()), float(batch[7].sum())
+            ppo.train(batch)
+            ring.release()
+            weights.publish(nets)
+            log(f"update {update}: {rows} transitions, {ring._get('episodes')} episodes, "
+                f"mean return {ret/max(ends, 1.):.3f}, {time.time() - t:.2f} s")
+        ppo.save(update)
+    finally:
+        ring.close()
+        for p in procs:
+            p.join(timeout=30)
+            if p.is_alive():
+                p.terminate()
+        ring.unlink()
+        weights.unlink()
+    return ppo
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train PPO on episodes of local collector processes")
+    parser.add_argument("config", nargs="?", help="JSON training config (see train.DEFAULTS)")
+    parser.add_argument("--set", nargs="*", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--collectors", type=int, default=2)
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--capacity", type=int, help="rows of the ring (default: 4 x update_every)")
+    args = parser.parse_args()
+
+    from train import load_config
+    config = load_config(args.config, args.set)
+    # Simulation changes the working directory
+    config["directory"], config["out"] = os.path.abspath(config["directory"]), os.path.abspath(config["out"])
+    train_shared(config, args.collectors, args.updates, args.capacity)
+    sys.exit(0)
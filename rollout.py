@@ -0,0 +1,620 @@
+import os
+import sys
+import time
+import zlib
+import queue
+import socket
+import struct
+import argparse
+import threading
+import numpy as np
+from wire import encode, decode, recv_exact
+
+
+# Distributed rollout collection. Collector processes (on any number of nodes) run
+# Flowsheet episodes with their copy of the actor and ship compressed batches of
+# whole episodes to a central PPO learner, which broadcasts the actor weights after
+# every update. Messages travel over a transport: TCPTransport between nodes, or the
+# in-process LoopbackTransport for tests.
+#
+# Frame:  kind (uint8) | length (uint32) | zlib(wire.encode(payload))
+#
+# Backpressure: the learner holds at most `max_pending` unread batches; past that it
+# stops reading, and collectors block in send() until it catches up. Collectors send
+# a heartbeat every `heartbeat` seconds while their episodes run; one that
+# disconnects or stays silent for `timeout` seconds is dropped without the learner
+# waiting for it, and batches from policies more than `max_lag` updates old are
+# discarded.
+#   python rollout.py learner config.json --address tcp://0.0.0.0:5555
+#   python rollout.py collector config.json --address tcp://learner-host:5555
+
+HELLO = 1       # collector -> learner: {"name"}
+BATCH = 2       # collector -> learner: {"version", "episodes", "returns", "lengths", "columns"}
+WEIGHTS = 3     # learner -> collector: {"version", "weights": {"actor", "critic"}}
+BYE = 4         # either way
+JOIN = 5        # transport events of the learner endpoint
+LEAVE = 6
+HEARTBEAT = 7   # collector -> learner: None
+
+_FRAME = struct.Struct("!BI")
+
+# Transition columns of a batch, in PPO.put_data order
+COLUMNS = ("s", "a", "c", "r", "s_prime", "p_d", "p_c", "done", "dw", "mask")
+
+
+class TransportClosed(ConnectionError):
+    pass
+
+
+def pack(payload, level=1):
+    return zlib.compress(encode(payload), level)
+
+def unpack(data):
+    return decode(zlib.decompress(data))
+
+
+def pack_arrays(arrays):
+    return {k: [str(v.dtype), list(v.shape), v.tobytes()] for k, v in arrays.items()}
+
+def unpack_arrays(packed):
+    return {k: np.frombuffer(data, dtype=dtype).reshape(shape) for k, (dtype, shape, data) in packed.items()}
+
+
+def batch_columns(transitions, state_dim, c_dim, d_dim):
+    '''Column arrays of PPO.put_data transitions'''
+    n = len(transitions)
+    out = {"s": np.empty((n, state_dim), np.float32), "a": np.empty(n, np.int64), "c": np.empty((n, c_dim), np.float32),
+           "r": np.empty(n), "s_prime": np.empty((n, state_dim), np.float32), "p_d": np.empty(n),
+           "p_c": np.empty((n, c_dim), np.float32), "done": np.empty(n, bool), "dw": np.empty(n, bool),
+           "mask": np.empty((n, d_dim), bool)}
+    for i, transition in enumerate(transitions):
+        for name, value in zip(COLUMNS, transition):
+            out[name][i] = value
+    return out
+
+def transitions(columns):
+    '''PPO.put_data transitions of column arrays'''
+    cols = [columns[name] for name in COLUMNS]
+    return [(s, int(a), c, float(r), s_, float(p_d), p_c, bool(done), bool(dw), mask)
+            for s, a, c, r, s_, p_d, p_c, done, dw, mask in zip(*cols)]
+
+
+
+# ------------------------------------ Loopback transport ------------------------------------
+class _LoopbackLearner():
+    def __init__(self, transport):
+        self.transport = transport
+        self.inbox = queue.Queue()
+        self.outboxes = {}
+        self.lock = threading.Lock()
+        self.bytes = 0
+
+    def recv(self, timeout=None):
+        try:
+            peer, kind, data = self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if data is None:
+            return peer, kind, None
+        self.transport.pending.release()
+        self.bytes += len(data)
+        return peer, kind, unpack(data)
+
+    def send(self, peer, kind, payload):
+        with self.lock:
+            outbox = self.outboxes.get(peer)
+        if outbox is None:
+            return False
+        outbox.put((kind, pack(payload)))
+        return True
+
+    def drop(self, peer):
+        with self.lock:
+            outbox = self.outboxes.pop(peer, None)
+        if outbox is not None:
+            outbox.put((BYE, None))
+
+    def peers(self):
+        with self.lock:
+            return list(self.outboxes)
+
+    def close(self):
+        for peer in self.peers():
+            self.drop(peer)
+
+
+class _LoopbackCollector():
+    def __init__(self, transport, peer):
+        self.transport = transport
+        self.peer = peer
+        self.inbox = queue.Queue()
+        self.closed = False
+
+    def send(self, kind, payload):
+        # One slot of the learner's pending messages each (backpressure); a
+        # collector dropped while it waits stops waiting
+        while True:
+            if self.closed or self.peer not in self.transport.learner.peers():
+                raise TransportClosed("Dropped by the learner")
+            if self.transport.pending.acquire(timeout=0.1):
+                break
+        self.transport.learner.inbox.put((self.peer, kind, pack(payload)))
+
+    def recv(self, timeout=None):
+        try:
+            kind, data = self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if kind == BYE:
+            self.closed = True
+            raise TransportClosed("Dropped by the learner")
+        return kind, unpack(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            learner = self.transport.learner
+            with learner.lock:
+                learner.outboxes.pop(self.peer, None)
+            learner.inbox.put((self.peer, LEAVE, None))
+
+
+class LoopbackTransport():
+    '''Learner and collectors in one process, with the framing, compression and
+    backpressure of the TCP transport'''
+    def __init__(self, max_pending=16):
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.learner = _LoopbackLearner(self)
+        self.count = 0
+
+    def listen(self):
+        return self.learner
+
+    def connect(self):
+        self.count += 1
+        peer = f"loopback-{self.count}"
+        collector = _LoopbackCollector(self, peer)
+        with self.learner.lock:
+            self.learner.outboxes[peer] = collector.inbox
+        self.learner.inbox.put((peer, JOIN, None))
+        return collector
+
+
+
+# ------------------------------------ TCP transport ------------------------------------
+def _send_frame(sock, kind, data):
+    sock.sendall(_FRAME.pack(kind, len(data)) + data)
+
+def _recv_frame(sock):
+    kind, n = _FRAME.unpack(recv_exact(sock, _FRAME.size))
+    return kind, recv_exact(sock, n)
+
+
+class _TCPLearner():
+    def __init__(self, address, max_pending, max_outbox):
+        self.max_outbox = max_outbox
+        self.inbox = queue.Queue(maxsize=max_pending)
+        self.socks = {}
+        self.outboxes = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.bytes = 0
+
+        self.server = socket.create_server(_split_tcp(address), reuse_port=False)
+        self.address = "tcp://%s:%d" % self.server.getsockname()[:2]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while not self.closed:
+            try:
+                sock, addr = self.server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            peer = "%s:%d" % addr[:2]
+            outbox = queue.Queue(maxsize=self.max_outbox)
+            with self.lock:
+                self.socks[peer] = sock
+                self.outboxes[peer] = outbox
+            self.inbox.put((peer, JOIN, None))
+            threading.Thread(target=self._read, args=(peer, sock), daemon=True).start()
+            threading.Thread(target=self._write, args=(peer, sock, outbox), daemon=True).start()
+
+    def _read(self, peer, sock):
+        try:
+            while True:
+                kind, data = _recv_frame(sock)
+                # Blocks while max_pending batches are unread: the collector's
+                # sendall then stalls on the full socket buffers
+                self.inbox.put((peer, kind, data))
+                if kind == BYE:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        self._forget(peer)
+        self.inbox.put((peer, LEAVE, None))
+
+    def _write(self, peer, sock, outbox):
+        try:
+            while True:
+                item = outbox.get()
+                if item is None:
+                    return
+                _send_frame(sock, *item)
+        except (ConnectionError, OSError):
+            self.drop(peer)
+
+    def _forget(self, peer):
+        with self.lock:
+            sock = self.socks.pop(peer, None)
+            outbox = self.outboxes.pop(peer, None)
+        if outbox is not None:
+            try:
+                outbox.put_nowait(None)
+            except queue.Full:
+                pass
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def recv(self, timeout=None):
+        try:
+            peer, kind, data = self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if data is None:
+            return peer, kind, None
+        self.bytes += len(data)
+        return peer, kind, unpack(data)
+
+    def send(self, peer, kind, payload):
+        '''Queue a message to a collector; one that leaves `max_outbox` messages
+        unsent is stalled and dropped'''
+        with self.lock:
+            outbox = self.outboxes.get(peer)
+        if outbox is None:
+            return False
+        try:
+            outbox.put_nowait((kind, pack(payload)))
+            return True
+        except queue.Full:
+            self.drop(peer)
+            return False
+
+    def drop(self, peer):
+        with self.lock:
+            sock = self.socks.get(peer)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def peers(self):
+        with self.lock:
+            return list(self.socks)
+
+    def close(self):
+        self.closed = True
+        self.server.close()
+        for peer in self.peers():
+            self.drop(peer)
+
+
+class _TCPCollector():
+    def __init__(self, address, connect_timeout):
+        self.sock = socket.create_connection(_split_tcp(address), timeout=connect_timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.inbox = queue.Queue()
+        self.send_lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        try:
+            while True:
+                kind, data = _recv_frame(self.sock)
+                self.inbox.put((kind, data))
+        except (ConnectionError, OSError):
+            self.inbox.put((BYE, None))
+
+    def send(self, kind, payload):
+        '''Blocks while the learner is behind (backpressure)'''
+        if self.closed:
+            raise TransportClosed("Connection closed")
+        try:
+            with self.send_lock:
+                _send_frame(self.sock, kind, pack(payload))
+        except OSError as e:
+            self.closed = True
+            raise TransportClosed("Connection closed") from e
+
+    def recv(self, timeout=None):
+        try:
+            kind, data = self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if kind == BYE:
+            self.closed = True
+            raise TransportClosed("Dropped by the learner")
+        return kind, unpack(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                with self.send_lock:
+                    _send_frame(self.sock, BYE, pack(None))
+            except OSError:
+                pass
+        self.sock.close()
+
+
+class TCPTransport():
+    '''Learner listening on tcp://host:port (port 0: any free port, see
+    listen().address), collectors connecting to it'''
+    def __init__(self, address, max_pending=16, max_outbox=4, connect_timeout=10.):
+        self.address = address
+        self.max_pending = max_pending
+        self.max_outbox = max_outbox
+        self.connect_timeout = connect_timeout
+
+    def listen(self):
+        return _TCPLearner(self.address, self.max_pending, self.max_outbox)
+
+    def connect(self):
+        return _TCPCollector(self.address, self.connect_timeout)
+
+
+def _split_tcp(address):
+    if address.startswith("tcp://"):
+        address = address[len("tcp://"):]
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+
+# ------------------------------------ Learner ------------------------------------
+def weights(ppo):
+    '''Actor and critic weights (the critic is used by the collectors' pruners)'''
+    return {name: pack_arrays({k: v.detach().cpu().numpy() for k, v in net.state_dict().items()})
+            for name, net in (("actor", ppo.actor), ("critic", ppo.critic))}
+
+def load_weights(ppo, packed):
+    import torch
+    for name, net in (("actor", ppo.actor), ("critic", ppo.critic)):
+        net.load_state_dict({k: torch.from_numpy(v.copy()) for k, v in unpack_arrays(packed[name]).items()})
+
+
+class RolloutLearner():
+    '''PPO learner fed by remote collectors.
+
+    collect() puts the transitions of received batches into the PPO buffer, whole
+    episodes one after the other, and update() trains and broadcasts the new actor
+    weights. The learner never waits on a particular collector: collect() returns
+    after its timeout with whatever arrived.
+    '''
+    def __init__(self, ppo, endpoint, max_lag=2, timeout=120.):
+        self.ppo = ppo
+        self.endpoint = endpoint
+        self.max_lag = max_lag
+        self.timeout = timeout
+        self.version = 0
+        self.collectors = {}    # peer -> {"name", "seen", "batches", "episodes"}
+        self.stats = {"batches": 0, "episodes": 0, "transitions": 0, "stale": 0, "joined": 0, "dropped": 0}
+        self.returns = []
+
+    def _handle(self, peer, kind, payload):
+        now = time.time()
+        if kind == JOIN:
+            self.stats["joined"] += 1
+            self.collectors[peer] = {"name": peer, "seen": now, "batches": 0, "episodes": 0}
+            self.endpoint.send(peer, WEIGHTS, {"version": self.version, "weights": weights(self.ppo)})
+            return 0
+        if kind in (LEAVE, BYE):
+            if self.collectors.pop(peer, None) is not None:
+                self.stats["dropped"] += 1
+            return 0
+
+        info = self.collectors.setdefault(peer, {"name": peer, "seen": now, "batches": 0, "episodes": 0})
+        info["seen"] = now
+        if kind == HELLO:
+            info["name"] = payload["name"]
+            return 0
+        if kind != BATCH:
+            return 0
+        if self.version - payload["version"] > self.max_lag:
+            self.stats["stale"] += 1
+            return 0
+
+        batch = transitions(unpack_arrays(payload["columns"]))
+        for transition in batch:
+            self.ppo.put_data(transition)
+        info["batches"] += 1
+        info["episodes"] += payload["episodes"]
+        self.stats["batches"] += 1
+        self.stats["episodes"] += payload["episodes"]
+        self.stats["transitions"] += len(batch)
+        self.returns.extend(payload["returns"])
+        return len(batch)
+
+    def _drop_silent(self):
+        now = time.time()
+        for peer, info in list(self.collectors.items()):
+            if now - info["seen"] > self.timeout:
+                self.endpoint.drop(peer)
+                self.collectors.pop(peer)
+                self.stats["dropped"] += 1
+
+    def collect(self, n, timeout=None):
+        '''Receive batches until the PPO buffer holds `n` transitions or `timeout`
+        seconds passed. Returns the number of transitions received.'''
+        deadline = time.time() + timeout if timeout is not None else None
+        received = 0
+        while len(self.ppo.data) < n:
+            wait = 1. if deadline is None else min(1., deadline - time.time())
+            if wait <= 0:
+                break
+            message = self.endpoint.recv(timeout=wait)
+            if message is not None:
+                received += self._handle(*message)
+            self._drop_silent()
+        return received
+
+    def update(self):
+        '''PPO update on the buffer, then the new weights to every collector'''
+        losses = self.ppo.train()
+        self.version += 1
+        self.broadcast()
+        return losses
+
+    def broadcast(self):
+        message = {"version": self.version, "weights": weights(self.ppo)}
+        for peer in self.endpoint.peers():
+            self.endpoint.send(peer, WEIGHTS, message)
+
+    def close(self):
+        self.endpoint.close()
+
+
+
+# ------------------------------------ Collector ------------------------------------
+class RolloutCollector():
+    '''Runs training episodes (train.run_episode) with the latest actor weights of
+    the learner and sends them in batches of `episodes_per_batch` episodes, with a
+    heartbeat every `heartbeat` seconds in between (keep it well below the
+    learner's timeout)'''
+    def __init__(self, env, ppo, endpoint, episodes_per_batch=4, name=None, pruner=None, heartbeat=30.):
+        self.env = env
+        self.ppo = ppo
+        self.endpoint = endpoint
+        self.episodes_per_batch = episodes_per_batch
+        self.pruner = pruner
+        self.heartbeat = heartbeat
+        self.version = None
+        self.stats = {"episodes": 0, "batches": 0, "updates": 0}
+        self.endpoint.send(HELLO, {"name": name or f"{socket.gethostname()}-{os.getpid()}"})
+
+    def poll(self, timeout=0.):
+        '''Apply the newest weights received. Raises TransportClosed when dropped.'''
+        latest = None
+        while True:
+            message = self.endpoint.recv(timeout=timeout if latest is None else 0.)
+            if message is None:
+                break
+            kind, payload = message
+            if kind == WEIGHTS:
+                latest = payload
+        if latest is not None:
+            load_weights(self.ppo, latest["weights"])
+            self.version = latest["version"]
+            self.stats["updates"] += 1
+
+    def run(self, episodes=None, stop=None):
+        '''Collect until `episodes` episodes were sent, `stop()` returns True or the
+        learner goes away'''
+        from train import run_episode
+
+        # Episodes (rigorous columns) may take longer than the learner's timeout
+        stopped = threading.Event()
+        def beat():
+            while not stopped.wait(self.heartbeat):
+                try:
+                    self.endpoint.send(HEARTBEAT, None)
+                except TransportClosed:
+                    return
+        threading.Thread(target=beat, daemon=True).start()
+
+        try:
+            # The first weights of the learner
+            while self.version is None:
+                self.poll(timeout=1.)
+            while (episodes is None or self.stats["episodes"] < episodes) and not (stop and stop()):
+                returns, lengths = [], []
+                self.ppo.data = []
+                for _ in range(self.episodes_per_batch):
+                    n = len(self.ppo.data)
+                    ret, _ = run_episode(self.env, self.ppo, self.pruner)
+                    returns.append(ret)
+                    lengths.append(len(self.ppo.data) - n)
+                columns = batch_columns(self.ppo.data, self.ppo.s_dim, self.ppo.acts_dims, self.ppo.masks_dims)
+                self.ppo.data = []
+                self.endpoint.send(BATCH, {"version": self.version, "episodes": len(returns), "returns": returns,
+                                           "lengths": lengths, "columns": pack_arrays(columns)})
+                self.stats["episodes"] += len(returns)
+                self.stats["batches"] += 1
+                self.poll()
+        except TransportClosed:
+            pass
+        finally:
+            stopped.set()
+        return self.stats
+
+    def close(self):
+        self.endpoint.close()
+
+
+
+def serve_learner(config, address, updates, metrics_path=None, collect_timeout=300.):
+    '''Learner process of the CLI: `updates` PPO updates on remote episodes'''
+    from train import build_agent, seed_everything
+    from metrics import MetricsWriter
+
+    # The learner only trains: no simulator is started on its node
+    run_dir = os.path.join(config["out"], config["name"], "learner")
+    seed_everything(config["seeds"][0])
+    ppo = build_agent(config, run_dir)
+    learner = RolloutLearner(ppo, TCPTransport(address).listen())
+    print(f"Learner on {learner.endpoint.address}", flush=True)
+    metrics = MetricsWriter(metrics_path or os.path.join(run_dir, "metrics.jsonl"))
+    try:
+        while learner.version < updates:
+            t = time.time()
+            learner.collect(config["update_every"], timeout=collect_timeout)
+            if not ppo.data:
+                continue
+            returns, learner.returns = learner.returns, []
+            learner.update()
+            metrics.log("update", update=learner.version, seconds=time.time() - t,
+                        ret=float(np.mean(returns)) if returns else None, collectors=len(learner.collectors),
+                        received_mb=learner.endpoint.bytes/2**20, **learner.stats)
+            if config["save_every"] and learner.version % config["save_every"] == 0:
+                ppo.save(learner.version)
+        ppo.save(learner.version)
+    finally:
+        learner.close()
+        metrics.close()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed rollout learner and collectors")
+    parser.add_argument("role", choices=["learner", "collector"])
+    parser.add_argument("config", nargs="?", help="JSON training config (see train.DEFAULTS)")
+    parser.add_argument("--address", default="tcp://127.0.0.1:5555")
+    parser.add_argument("--set", nargs="*", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--updates", type=int, default=100, help="PPO updates of the learner")
+    parser.add_argument("--episodes", type=int, help="episodes of a collector (default: until the learner stops)")
+    parser.add_argument("--batch", type=int, default=4, help="episodes per batch sent by a collector")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from train import load_config, build
+    config = load_config(args.config, args.set)
+    # Simulation changes the working directory
+    config["directory"], config["out"] = os.path.abspath(config["directory"]), os.path.abspath(config["out"])
+    if args.role == "learner":
+        serve_learner(config, args.address, args.updates)
+    else:
+        import tempfile
+        # The collector never saves its copy of the networks
+        with tempfile.TemporaryDirectory() as run_dir:
+            env, ppo, pruner = build(dict(config, seed=args.seed), run_dir)
+        collector = RolloutCollector(env, ppo, TCPTransport(args.address).connect(), args.batch, pruner=pruner)
+        stats = collector.run(args.episodes)
+        collector.close()
+        print(stats)
+        sys.exit(0)
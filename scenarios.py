@@ -0,0 +1,287 @@
+import os
+import types
+import traceback
+import numpy as np
+import multiprocessing as mp
+from gym.spaces import Box
+
+
+# Multi-scenario training. A FeedDistribution draws inlet feed conditions, a
+# ScenarioFlowsheet resets its Flowsheet to a new draw every episode and appends the
+# scaled feed conditions to the observation, and a VectorFlowsheet steps several
+# scenario environments in worker processes, so one policy is trained across the
+# feed cases in parallel.
+
+VARIABLES = ("T", "P", "TOL", "HYDROGEN", "METHANE", "BZN")
+
+
+class FeedDistribution():
+    '''Distribution of the inlet specifications [T, P, {component: flow}].
+
+    Each variable of VARIABLES is a number (fixed), [low, high] (uniform) or
+    {"values": [...], "p": [...]} (discrete, p optional). Variables left out keep
+    their value in `base`. The toluene flow must be positive and the other flows and
+    P non-negative. The varying variables are the scenario features, each scaled to
+    [0, 1] over its range.
+    '''
+    def __init__(self, base, spec=None):
+        T, P, comp = base
+        values = dict(comp, T=T, P=P)
+        self.spec = {}
+        for name in VARIABLES:
+            s = (spec or {}).get(name, values.get(name, 0.))
+            if isinstance(s, dict):
+                s = {"values": [float(v) for v in s["values"]], "p": s.get("p")}
+            elif isinstance(s, (list, tuple)):
+                if len(s) != 2 or s[0] > s[1]:
+                    raise ValueError(f"Range of feed variable {name} must be [low, high], not {s}")
+                s = (float(s[0]), float(s[1]))
+            else:
+                s = float(s)
+            self.spec[name] = s
+            low = self._bounds(name)[0]
+            # Flowsheet divides by the toluene feed (Cao)
+            if name == "TOL" and low <= 0:
+                raise ValueError(f"Feed variable TOL must be positive, not {s}")
+            if name != "T" and low < 0:
+                raise ValueError(f"Feed variable {name} must not be negative, not {s}")
+        unknown = set(spec or {}) - set(VARIABLES)
+        if unknown:
+            raise ValueError(f"Unknown feed variables {sorted(unknown)}, choose from {VARIABLES}")
+
+        self.features = [name for name in VARIABLES if self._bounds(name)[0] < self._bounds(name)[1]]
+
+    def _bounds(self, name):
+        s = self.spec[name]
+        if isinstance(s, dict):
+            return min(s["values"]), max(s["values"])
+        if isinstance(s, tuple):
+            return s
+        return s, s
+
+    def sample(self, rng):
+        values = {}
+        for name in VARIABLES:
+            s = self.spec[name]
+            if isinstance(s, dict):
+                values[name] = float(rng.choice(s["values"], p=s["p"]))
+            elif isinstance(s, tuple):
+                values[name] = float(rng.uniform(*s))
+            else:
+                values[name] = s
+        return specs(values)
+
+    def encode(self, inlet_specs):
+        '''Scenario features of inlet specifications'''
+        values = variables(inlet_specs)
+        out = np.empty(len(self.features))
+        for i, name in enumerate(self.features):
+            low, high = self._bounds(name)
+            out[i] = (values[name] - low)/(high - low)
+        return out
+
+    def __repr__(self):
+        return f"FeedDistribution({self.spec})"
+
+
+def specs(values):
+    '''Inlet specifications of a {variable: value} dict'''
+    return [values["T"], values["P"], {c: values[c] for c in VARIABLES[2:]}]
+
+def variables(inlet_specs):
+    T, P, comp = inlet_specs
+    return dict(comp, T=T, P=P)
+
+def observation_space(space, feeds):
+    '''Observation space of Flowsheet states `space` followed by the scenario features'''
+    n = len(feeds.features)
+    return Box(low=np.concatenate([space.low, np.zeros(n)]),
+               high=np.concatenate([space.high, np.ones(n)]), dtype=np.float32)
+
+
+
+# ------------------------------------ Scenario environment ------------------------------------
+class ScenarioFlowsheet():
+    '''Flowsheet drawing its feed conditions from `feeds` at every reset.
+
+    States are the Flowsheet states followed by the scenario features. Other
+    attributes are those of the wrapped Flowsheet, whose inlet_specs, Cao and Cbo
+    follow the current scenario.
+    '''
+    OWN = ("env", "feeds", "rng", "features", "observation_space")
+
+    def __init__(self, env, feeds, seed=None):
+        self.env = env
+        self.feeds = feeds
+        self.rng = np.random.default_rng(seed)
+        self.features = feeds.encode(env.inlet_specs)
+
+        self.observation_space = observation_space(env.observation_space, feeds)
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def __setattr__(self, name, value):
+        # Settings such as final_evaluation belong to the Flowsheet
+        if name in ScenarioFlowsheet.OWN:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.env, name, value)
+
+    def observe(self, state):
+        return np.concatenate([state, self.features])
+
+    def reset(self, inlet_specs=None):
+        '''Start an episode in a new scenario, or in the given feed conditions'''
+        self.env.set_inlet(inlet_specs if inlet_specs is not None else self.feeds.sample(self.rng))
+        self.features = self.feeds.encode(self.env.inlet_specs)
+        state, sin = self.env.reset()
+        return self.observe(state), sin
+
+    def step(self, action, sin):
+        state, reward, done, info, sout = self.env.step(action, sin)
+        return self.observe(state), reward, done, info, sout
+
+    @property
+    def state(self):
+        return self.observe(self.env.state)
+
+    def episode_record(self):
+        record = self.env.episode_record()
+        record["features"] = self.features.tolist()
+        return record
+
+    def restore(self, handle):
+        state, sin = self.env.restore(handle)
+        self.features = self.feeds.encode(self.env.inlet_specs)
+        return self.observe(state), sin
+
+
+
+# ------------------------------------ Vector environment ------------------------------------
+def _worker(conn, env_fn, config, seed, document):
+    if document is not None:
+        os.environ["AUTOPROCRL_SIMSERVER_DOC"] = str(document)
+    try:
+        env = env_fn(config, seed)
+        sin = None
+
+        def reset():
+            nonlocal sin
+            s, sin = env.reset()
+            return s, env.action_masks(sin, inlet=True)
+
+        while True:
+            cmd, arg = conn.recv()
+            if cmd == "reset":
+                conn.send(("ok", reset()))
+            elif cmd == "step":
+                s, r, done, _, sin = env.step(arg, sin)
+                step = env.trajectory[-1]
+                out = {"state": s, "reward": r, "done": done, "step": step}
+                if done:
+                    out["record"] = env.episode_record()
+                    out["engine"] = {"column_solves": dict(env.column_solves),
+                                     "recovery": dict(env.recovery.stats) if env.recovery is not None else None}
+                    out["reset"] = reset()
+                else:
+                    out["mask"] = env.action_masks(sin)
+                conn.send(("ok", out))
+            elif cmd == "close":
+                conn.send(("ok", None))
+                return
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+
+
+class VectorFlowsheet():
+    '''`n` environments stepped in parallel, one worker process (and simulator) each.
+
+    `env_fn(config, seed)` builds the environment of a worker, with seeds spawned
+    from `seed`. step() takes one action per environment and returns one result
+    dict per environment: "state", "reward", "done", the step record and, when
+    the episode ended, its "record", the engine counters and the "reset" state
+    and mask of the next episode (environments reset themselves). Otherwise
+    "mask" is the mask of the next step. With the remote backend, worker i uses
+    server document `first_document + i`.
+    '''
+    def __init__(self, env_fn, config, n, seed=None, first_document=0):
+        self.n = n
+        ctx = mp.get_context("spawn")
+        seeds = np.random.SeedSequence(seed).generate_state(n)
+        remote = (config.get("backend") or os.environ.get("AUTOPROCRL_BACKEND")) == "remote"
+        self.conns, self.procs = [], []
+        for i in range(n):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_worker, daemon=True,
+                               args=(child, env_fn, config, int(seeds[i]), first_document + i if remote else None))
+            proc.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(proc)
+
+        self.engine = [None]*n
+        self.closed = False
+
+    def _call(self, cmds):
+        for conn, cmd in zip(self.conns, cmds):
+            conn.send(cmd)
+        out = []
+        for i, conn in enumerate(self.conns):
+            status, value = conn.recv()
+            if status == "error":
+                self.close()
+                raise RuntimeError(f"Environment worker {i} failed:\n{value}")
+            out.append(value)
+        return out
+
+    def reset(self):
+        '''States and masks of the first episodes'''
+        return self._call([("reset", None)]*self.n)
+
+    def step(self, actions):
+        results = self._call([("step", a) for a in actions])
+        for i, result in enumerate(results):
+            if "engine" in result:
+                self.engine[i] = result["engine"]
+        return results
+
+    @property
+    def column_solves(self):
+        solves = {"shortcut": 0, "rigorous": 0}
+        for e in self.engine:
+            for k, v in (e or {}).get("column_solves", {}).items():
+                solves[k] += v
+        return solves
+
+    @property
+    def recovery(self):
+        '''Summed recovery counters of the workers, or None without recovery'''
+        stats = [e["recovery"] for e in self.engine if e is not None and e["recovery"] is not None]
+        if not stats:
+            return None
+        return types.SimpleNamespace(stats={k: sum(s.get(k, 0) for s in stats) for k in stats[0]})
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for conn in self.conns:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self.procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for conn in self.conns:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
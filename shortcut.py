@@ -0,0 +1,168 @@
+import math
+
+
+# Fenske-Underwood-Gilliland estimate of a simple column specified like the Radfrac
+# blocks of Simulation.py (stages, distillate rate, reflux ratio, pressure). It is
+# used to screen columns before paying for a rigorous solve.
+
+COMPONENTS = ("TOL", "HYDROGEN", "METHANE", "BZN")
+
+# Antoine constants (log10 mmHg, °C)
+ANTOINE = {
+    "TOL": (6.95464, 1344.8, 219.482),
+    "BZN": (6.90565, 1211.033, 220.79),
+    "METHANE": (6.61184, 389.93, 266.0),
+    "HYDROGEN": (5.824, 67.5, 275.7),
+}
+NONCONDENSABLE = ("HYDROGEN", "METHANE")
+
+LATENT = 30000.0     # kJ/kmol
+FLOOD_VELOCITY = 1.5 # m/s, allowable vapor velocity for the diameter
+
+
+def psat(c, T):
+    A, B, C = ANTOINE[c]
+    return max(10**(A - B/(T + C))/750.06, 1e-30)   # bar
+
+
+def bubble_point(flows, P):
+    return _saturation(flows, P, dew=False)
+
+
+def dew_point(flows, P):
+    return _saturation(flows, P, dew=True)
+
+
+def _saturation(flows, P, dew):
+    total = sum(flows.values())
+    if total <= 0:
+        return 25.
+    z = {c: f/total for c, f in flows.items()}
+    lo, hi = -200., 600.
+    for _ in range(60):
+        T = (lo + hi)/2
+        if dew:
+            s = sum(z[c]*P/psat(c, T) for c in z)
+            lo, hi = (T, hi) if s > 1 else (lo, T)
+        else:
+            s = sum(z[c]*psat(c, T)/P for c in z)
+            lo, hi = (lo, T) if s > 1 else (T, hi)
+    return T
+
+
+def _logistic(x):
+    if x >= 0:
+        return 1/(1 + math.exp(-x))
+    e = math.exp(x)
+    return e/(1 + e)
+
+
+def fenske_split(flows, alpha, D, Nmin):
+    '''Distillate flows with d_i/b_i = C*alpha_i^Nmin, C set by the distillate rate'''
+    def distillate(logc):
+        return {c: flows[c]*_logistic(logc + Nmin*math.log(alpha[c])) for c in flows}
+
+    lo, hi = -500., 500.
+    for _ in range(100):
+        mid = (lo + hi)/2
+        lo, hi = (mid, hi) if sum(distillate(mid).values()) < D else (lo, mid)
+    return distillate((lo + hi)/2)
+
+
+def underwood_rmin(z, xd, alpha, lk, hk):
+    '''Minimum reflux for a saturated liquid feed (q = 1)'''
+    if alpha[lk] <= alpha[hk]*(1 + 1e-9):
+        return 0.
+    f = lambda theta: sum(alpha[c]*z[c]/(alpha[c] - theta) for c in z if alpha[c] != theta)
+    lo, hi = alpha[hk], alpha[lk]
+    for _ in range(100):
+        theta = (lo + hi)/2
+        # f increases with theta between the key volatilities
+        lo, hi = (theta, hi) if f(theta) < 0 else (lo, theta)
+    theta = (lo + hi)/2
+    return max(sum(alpha[c]*xd[c]/(alpha[c] - theta) for c in xd if alpha[c] != theta) - 1, 0.)
+
+
+def gilliland(R, Rmin, Nmin):
+    '''Stages required at reflux R (Molokanov form of the Gilliland correlation)'''
+    if R <= Rmin:
+        return math.inf
+    X = (R - Rmin)/(R + 1)
+    Y = 1 - math.exp((1 + 54.4*X)/(11 + 117.2*X)*(X - 1)/math.sqrt(X))
+    return (Nmin + Y)/(1 - Y)
+
+
+def keys(flows, alpha, D):
+    '''Light and heavy key: the components around the cut set by the distillate rate'''
+    order = sorted(flows, key=lambda c: alpha[c], reverse=True)
+    cum = 0.
+    for i, c in enumerate(order):
+        cum += flows[c]
+        if cum >= D:
+            break
+    i = min(i, len(order) - 2)
+    return order[i], order[i + 1]
+
+
+def column(flows, nstages, dist_rate, reflux_ratio, press, partial=False):
+    '''Shortcut rating of a column.
+
+    Returns a dict with the specification and feed, the product flows ("dist",
+    "bott" and, with a partial condenser, "vap" holding the non-condensables),
+    their temperatures, the condenser and reboiler duties (kW), the tray
+    diameter (m), Nmin and Rmin.
+    "feasible" is False when the specification cannot be met (distillate rate
+    outside the feed or reflux below the minimum at every split).
+    '''
+    flows = {c: max(float(flows.get(c, 0.)), 0.) for c in COMPONENTS}
+    total = sum(flows.values())
+    N, D, R, P = int(nstages), float(dist_rate), float(reflux_ratio), float(press)
+    result = {"feasible": False, "feed": flows, "nstages": N, "dist_rate": D,
+              "reflux_ratio": R, "press": P}
+    if total <= 0 or not 0 < D < total or N < 3:
+        return result
+
+    # Relative volatilities at the feed bubble point
+    T_ref = bubble_point(flows, P)
+    K = {c: psat(c, T_ref) for c in COMPONENTS}
+    lk, hk = keys(flows, K, D)
+    alpha = {c: K[c]/K[hk] for c in COMPONENTS}
+    z = {c: flows[c]/total for c in COMPONENTS}
+
+    # Rating: the minimum stages (and split) at which Gilliland needs N stages
+    def required(Nmin):
+        dist = fenske_split(flows, alpha, D, Nmin)
+        xd = {c: dist[c]/D for c in COMPONENTS}
+        Rmin = underwood_rmin(z, xd, alpha, lk, hk)
+        return gilliland(R, Rmin, Nmin), dist, Rmin
+
+    lo, hi = 0., float(N)
+    for _ in range(40):
+        Nmin = (lo + hi)/2
+        lo, hi = (Nmin, hi) if required(Nmin)[0] < N else (lo, Nmin)
+    n_req, dist, Rmin = required(lo)
+    if not math.isfinite(n_req):
+        return result
+    bott = {c: flows[c] - dist[c] for c in COMPONENTS}
+
+    result.update(feasible=True, Nmin=lo, Rmin=Rmin, light_key=lk, heavy_key=hk)
+    if partial:
+        vap = {c: dist[c] if c in NONCONDENSABLE else 0. for c in COMPONENTS}
+        dist = {c: dist[c] - vap[c] for c in COMPONENTS}
+        result["vap"], result["T_vap"] = vap, dew_point(vap, P)
+    result["dist"], result["T_dist"] = dist, bubble_point(dist, P)
+    result["bott"], result["T_bott"] = bott, bubble_point(bott, P)
+
+    # Duties and diameter from the top vapor traffic
+    vap_flow = (R + 1)*D
+    q = vap_flow*LATENT/3600
+    vol = vap_flow*8.314*(result["T_dist"] + 273.15)/(100*P)/3600    # m3/s
+    result["cond_duty"], result["reb_duty"] = -q, q
+    result["diameter"] = math.sqrt(4*vol/(math.pi*FLOOD_VELOCITY))
+    return result
+
+
+def purity(result, product, component):
+    flows = result[product]
+    total = sum(flows.values())
+    return flows[component]/total if total > 0 else 0.
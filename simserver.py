@@ -0,0 +1,493 @@
+import os
+import sys
+import socket
+import struct
+import argparse
+import tempfile
+import threading
+import queue
+import collections
+import socketserver
+from wire import encode, decode, recv_exact
+
+
+# Long-lived simulator server. It owns one or more warm engine documents and serves
+# tree operations to any number of clients over a local socket, so that training and
+# evaluation processes do not pay the engine start-up and InitFromArchive2 per run.
+#
+# Request frame:  op (uint8) | document (uint16) | length (uint32) | payload
+# Reply frame:    status (uint8) | length (uint32) | payload
+# Payloads are encoded with wire.encode. Tree nodes are addressed by their path from
+# the document Tree, a list of element names (str) or positions (int).
+
+# Unix sockets are not available on Windows, where the Aspen backend runs
+if sys.platform == "win32":
+    DEFAULT_ADDRESS = "tcp://127.0.0.1:5560"
+else:
+    DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), "autoprocrl-sim.sock")
+
+_REQUEST = struct.Struct("!BHI")
+_REPLY = struct.Struct("!BI")
+
+OK, ERROR = 0, 1
+
+OPEN = 1            # archive path -> FullName (archive loaded only if not warm)
+GET = 2             # path -> Value
+SET = 3             # [path, value]
+SET_MANY = 4        # [[path, value], ...]
+ADD = 5             # [path, name] (Elements.Add)
+REMOVE = 6          # [path, name] (Elements.Remove)
+REMOVE_ALL = 7      # path
+INSERT_ROW = 8      # [path, dimension, location]
+COUNT = 9           # path -> Elements.Count
+CALL = 10           # [method, args] on the document (Run2, Reinit, Stop, Close)
+GET_MANY = 11       # [path, ...] -> [Value, ...]
+CREATE_BLOCK = 12   # [name, uo]
+SNAPSHOT = 13       # [stream, ...] -> [[T, P, F_TOL, F_H2, F_CH4, F_BZN, F_total], ...]
+ATTR = 14           # [name] -> value, or [name, value] to set
+DOCUMENTS = 15      # -> number of documents served
+SAVE_STATE = 16     # -> handle of a saved copy of the document
+RESTORE_STATE = 17  # handle
+DROP_STATE = 18     # handle
+RESTART = 19        # replace the document by a new one of the backend (archive not loaded)
+
+CALLS = ("Run2", "Reinit", "Stop", "Close", "Save", "SaveAs")
+ATTRS = ("FullName", "Visible", "SuppressDialogs")
+SETTABLE = ("Visible", "SuppressDialogs")
+
+
+class SimServerError(RuntimeError):
+    pass
+
+
+
+# ---------------------------------------------- Server ----------------------------------------------
+
+class DocumentWorker(threading.Thread):
+    '''Owns one engine document. COM documents are apartment threaded, so every
+    operation on the document is executed by this thread.'''
+    def __init__(self, factory):
+        super().__init__(daemon=True)
+        self.factory = factory
+        self.requests = queue.Queue()
+        self.archive = None
+        self.states = {}
+        self.next_state = 0
+        self.error = None
+        self.ready = threading.Event()
+        self.start()
+
+    def run(self):
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()
+        except ImportError:
+            pass
+        try:
+            self.doc = self.factory()
+        except Exception as e:
+            # The engine did not start: requests are answered with the error
+            self.error = e
+            self.ready.set()
+            return
+        self.ready.set()
+        while True:
+            item = self.requests.get()
+            if item is None:
+                # Replaced by a new worker
+                self.close()
+                return
+            op, args, reply = item
+            try:
+                reply.put((OK, self.execute(op, args)))
+            except Exception as e:
+                reply.put((ERROR, f"{type(e).__name__}: {e}"))
+
+    def close(self):
+        for state in self.states.values():
+            state.discard()
+        self.states.clear()
+        try:
+            self.doc.Close()
+        except Exception:
+            pass
+
+    def submit(self, op, args):
+        reply = queue.Queue(maxsize=1)
+        self.requests.put((op, args, reply))
+        return reply.get()
+
+    def node(self, path):
+        node = self.doc.Tree
+        for key in path:
+            node = node.Elements(key)
+        return node
+
+    def execute(self, op, args):
+        doc = self.doc
+        if op == OPEN:
+            path = os.path.abspath(args)
+            if self.archive != path:
+                doc.InitFromArchive2(path)
+                doc.SuppressDialogs = True
+                self.archive = path
+            return doc.FullName
+        if op == GET:
+            return self.node(args).Value
+        if op == GET_MANY:
+            return [self.node(path).Value for path in args]
+        if op == SET:
+            self.node(args[0]).Value = args[1]
+            return None
+        if op == SET_MANY:
+            for path, value in args:
+                self.node(path).Value = value
+            return None
+        if op == ADD:
+            self.node(args[0]).Elements.Add(args[1])
+            return None
+        if op == REMOVE:
+            self.node(args[0]).Elements.Remove(args[1])
+            return None
+        if op == REMOVE_ALL:
+            self.node(args).RemoveAll()
+            return None
+        if op == INSERT_ROW:
+            self.node(args[0]).Elements.InsertRow(args[1], args[2])
+            return None
+        if op == COUNT:
+            return self.node(args).Elements.Count
+        if op == CALL:
+            method, call_args = args
+            if method not in CALLS:
+                raise ValueError(f"Method '{method}' is not exposed")
+            return getattr(doc, method)(*call_args)
+        if op == CREATE_BLOCK:
+            self.node(["Data", "Blocks"]).Elements.Add(f"{args[0]}!{args[1]}")
+            return None
+        if op == SNAPSHOT:
+            return [self.snapshot(name) for name in args]
+        if op == SAVE_STATE:
+            from Simulation import save_document_state
+            self.next_state += 1
+            self.states[self.next_state] = save_document_state(doc)
+            return self.next_state
+        if op == RESTORE_STATE:
+            from Simulation import restore_document_state
+            restore_document_state(doc, self.states[args])
+            return None
+        if op == DROP_STATE:
+            state = self.states.pop(args, None)
+            if state is not None:
+                state.discard()
+            return None
+        if op == ATTR:
+            if len(args) == 2:
+                if args[0] not in SETTABLE:
+                    raise AttributeError(f"Attribute '{args[0]}' can't be set")
+                setattr(doc, args[0], args[1])
+                return None
+            if args[0] == "IsRunning":
+                return bool(doc.Engine.IsRunning)
+            if args[0] not in ATTRS:
+                raise AttributeError(args[0])
+            return getattr(doc, args[0])
+        raise ValueError(f"Unknown operation {op}")
+
+    def snapshot(self, name):
+        out = self.node(["Data", "Streams", name, "Output"])
+        flows = out.Elements("MOLEFLOW").Elements("MIXED")
+        return [out.Elements("TEMP_OUT").Elements("MIXED").Value,
+                out.Elements("PRES_OUT").Elements("MIXED").Value,
+                *(flows.Elements(c).Value for c in ("TOL", "HYDROGEN", "METHANE", "BZN")),
+                out.Elements("MOLEFLMX").Elements("MIXED").Value]
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        workers = self.server.workers
+        while True:
+            try:
+                op, doc, n = _REQUEST.unpack(recv_exact(sock, _REQUEST.size))
+                args = decode(recv_exact(sock, n))
+            except ConnectionError:
+                return
+
+            if op == DOCUMENTS:
+                status, result = OK, len(workers)
+            elif doc >= len(workers):
+                status, result = ERROR, f"No document {doc}, the server holds {len(workers)}"
+            else:
+                if op == RESTART:
+                    # Not queued: the old worker may be stuck in a hung engine call. It
+                    # closes its document once it is free again. Concurrent restarts
+                    # of a document each retire the worker they replace.
+                    with self.server.restart_lock:
+                        old = workers[doc]
+                        worker = workers[doc] = DocumentWorker(old.factory)
+                    old.requests.put(None)
+                else:
+                    worker = workers[doc]
+                worker.ready.wait()
+                if worker.error is not None:
+                    status, result = ERROR, f"Document {doc} failed to start: {type(worker.error).__name__}: {worker.error}"
+                elif op == RESTART:
+                    status, result = OK, None
+                else:
+                    status, result = worker.submit(op, args)
+
+            payload = encode(result)
+            sock.sendall(_REPLY.pack(status, len(payload)) + payload)
+
+
+class SimServer():
+    '''Serves `documents` warm engine documents of the given backend'''
+    def __init__(self, address=DEFAULT_ADDRESS, backend="standin", documents=1):
+        from Simulation import BACKENDS
+        self.address = address
+        self.workers = [DocumentWorker(BACKENDS[backend]) for _ in range(documents)]
+
+        if _is_tcp(address):
+            host, port = _split_tcp(address)
+            server_cls = type("_TCPServer", (socketserver.ThreadingMixIn, socketserver.TCPServer),
+                              {"daemon_threads": True, "allow_reuse_address": True})
+            self.server = server_cls((host, port), _Handler)
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server_cls = type("_UnixServer", (socketserver.ThreadingMixIn, socketserver.UnixStreamServer),
+                              {"daemon_threads": True})
+            self.server = server_cls(address, _Handler)
+        self.server.workers = self.workers
+        self.server.restart_lock = threading.Lock()
+        self.thread = None
+
+    def wait_ready(self):
+        '''Wait for the engines to start, raising the error of one that failed'''
+        for worker in self.workers:
+            worker.ready.wait()
+            if worker.error is not None:
+                raise worker.error
+
+    def serve_forever(self):
+        try:
+            self.wait_ready()
+        except Exception:
+            self.close()
+            raise
+        self.server.serve_forever()
+
+    def start(self):
+        '''Serve from a background thread (for tests and in-process use)'''
+        try:
+            self.wait_ready()
+        except Exception:
+            self.close()
+            raise
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.close()
+
+    def close(self):
+        self.server.server_close()
+        if not _is_tcp(self.address) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+
+# ---------------------------------------------- Client ----------------------------------------------
+
+class SimClient():
+    def __init__(self, address=DEFAULT_ADDRESS, doc=0):
+        self.address = address
+        self.doc = doc
+        if _is_tcp(address):
+            self.sock = socket.create_connection(_split_tcp(address))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.lock = threading.Lock()
+        # State handles released by finalizers, dropped with the next request
+        self.dropped = collections.deque()
+
+    def _exchange(self, op, args):
+        payload = encode(args)
+        self.sock.sendall(_REQUEST.pack(op, self.doc, len(payload)) + payload)
+        status, n = _REPLY.unpack(recv_exact(self.sock, _REPLY.size))
+        return status, decode(recv_exact(self.sock, n))
+
+    def request(self, op, args=None):
+        with self.lock:
+            while self.dropped:
+                self._exchange(DROP_STATE, self.dropped.popleft())
+            status, result = self._exchange(op, args)
+        if status != OK:
+            raise SimServerError(result)
+        return result
+
+    def close(self):
+        # Dropped states are sent unless a request is still waiting for its reply
+        if self.dropped and self.lock.acquire(blocking=False):
+            try:
+                while self.dropped:
+                    self._exchange(DROP_STATE, self.dropped.popleft())
+            except OSError:
+                pass
+            finally:
+                self.lock.release()
+        self.sock.close()
+
+
+class RemoteNode():
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+        self.Elements = RemoteElements(client, path)
+
+    @property
+    def Value(self):
+        return self._client.request(GET, self._path)
+
+    @Value.setter
+    def Value(self, value):
+        self._client.request(SET, [self._path, value])
+
+    def RemoveAll(self):
+        self._client.request(REMOVE_ALL, self._path)
+
+    def FindNode(self, path):
+        return RemoteNode(self._client, self._path + [p for p in path.strip("/").split("/")])
+
+
+class RemoteElements():
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+
+    def __call__(self, key):
+        return RemoteNode(self._client, self._path + [key])
+
+    def Item(self, key):
+        return self(key)
+
+    def Add(self, name):
+        self._client.request(ADD, [self._path, name])
+
+    def Remove(self, name):
+        self._client.request(REMOVE, [self._path, name])
+
+    def InsertRow(self, dimension, location):
+        self._client.request(INSERT_ROW, [self._path, dimension, location])
+
+    @property
+    def Count(self):
+        return self._client.request(COUNT, self._path)
+
+
+class RemoteEngine():
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def IsRunning(self):
+        return self._client.request(ATTR, ["IsRunning"])
+
+
+class RemoteDocument():
+    '''Client-side stand-in of the engine document, backed by a SimServer'''
+    def __init__(self, address=DEFAULT_ADDRESS, doc=0):
+        object.__setattr__(self, "client", SimClient(address, doc))
+        object.__setattr__(self, "Tree", RemoteNode(self.client, []))
+        object.__setattr__(self, "Engine", RemoteEngine(self.client))
+
+    @property
+    def Application(self):
+        return self
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in CALLS:
+            return lambda *args: self.client.request(CALL, [name, list(args)])
+        if name not in ATTRS:
+            raise AttributeError(name)
+        return self.client.request(ATTR, [name])
+
+    def __setattr__(self, name, value):
+        self.client.request(ATTR, [name, value])
+
+    def InitFromArchive2(self, path, *args):
+        return self.client.request(OPEN, path)
+
+    def set_many(self, items):
+        self.client.request(SET_MANY, [[path, value] for path, value in items])
+
+    def get_many(self, paths):
+        return self.client.request(GET_MANY, list(paths))
+
+    def snapshot(self, streams):
+        return self.client.request(SNAPSHOT, list(streams))
+
+    def create_block(self, name, uo):
+        self.client.request(CREATE_BLOCK, [name, uo])
+
+    def snapshot_state(self):
+        return RemoteState(self.client, self.client.request(SAVE_STATE))
+
+    def restore_state(self, state):
+        self.client.request(RESTORE_STATE, state.handle)
+
+    def restart(self):
+        '''Have the server replace the document by a new one, without an archive'''
+        self.client.request(RESTART)
+
+
+class RemoteState():
+    '''Document copy held by the server. discard() drops it; a state that is
+    garbage collected first is dropped with the next request of its client (a
+    finalizer must not send, it may run in the middle of a request).'''
+    def __init__(self, client, handle):
+        self.client = client
+        self.handle = handle
+
+    def discard(self):
+        if self.handle is not None:
+            handle, self.handle = self.handle, None
+            self.client.request(DROP_STATE, handle)
+
+    def __del__(self):
+        if self.handle is not None:
+            self.client.dropped.append(self.handle)
+            self.handle = None
+
+
+
+def _is_tcp(address):
+    return address.startswith("tcp://")
+
+def _split_tcp(address):
+    host, _, port = address[len("tcp://"):].rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent simulator server")
+    parser.add_argument("--address", default=os.environ.get("AUTOPROCRL_SIMSERVER", DEFAULT_ADDRESS),
+                        help="unix socket path or tcp://host:port")
+    parser.add_argument("--backend", default=os.environ.get("AUTOPROCRL_BACKEND", "aspen"))
+    parser.add_argument("--documents", type=int, default=1)
+    args = parser.parse_args()
+
+    server = SimServer(args.address, args.backend, args.documents)
+    print(f"Serving {args.documents} {args.backend} document(s) on {args.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,621 @@
+import math
+import os
+import weakref
+from shortcut import COMPONENTS, ANTOINE
+
+
+# Stand-in for the Aspen Plus document ("Apwn.Document") used on machines without
+# Aspen. It reproduces the parts of the COM tree touched by Simulation.py and solves
+# the flowsheet with simple short-cut models, so that Flowsheet episodes, benchmarks
+# and unit tests can run on Linux. The numbers are plausible, not rigorous.
+
+T_BOIL = {"TOL": 110.6, "BZN": 80.1, "METHANE": -161.5, "HYDROGEN": -252.9}
+
+CP = 40.0            # kJ/kmol/K, all components
+LATENT = 30000.0     # kJ/kmol, aromatics
+DH_RXN = -41800.0    # kJ/kmol of toluene converted
+K0, EA = 3.4e13, 25000.0   # 1/h, K (TOL + H2 -> BZN + CH4)
+LIQ_VOLUME = 0.1     # m3/kmol
+
+
+
+class Node():
+    # Nodes hold no reference cycles (the parent link and the node of Elements are
+    # weak), so subtrees dropped by RemoveAll, Reinit or restore_state are freed at
+    # once instead of piling up for the cycle collector
+    def __init__(self, name, parent=None):
+        self.name = name
+        self._parent = weakref.ref(parent) if parent is not None else None
+        self.uo = None
+        self.Value = None
+        self.children = {}
+        self.Elements = Elements(self)
+
+    @property
+    def parent(self):
+        return self._parent() if self._parent is not None else None
+
+    def child(self, name):
+        name = str(name)
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = Node(name, self)
+        return node
+
+    def RemoveAll(self):
+        self.children.clear()
+
+    def value(self, *path, default=None):
+        node = self
+        for p in path:
+            node = node.children.get(str(p))
+            if node is None:
+                return default
+        return default if node.Value is None else node.Value
+
+    def set(self, *path, value):
+        node = self
+        for p in path:
+            node = node.child(p)
+        node.Value = value
+
+    def copy(self, parent=None):
+        node = type(self)(self.name, parent)
+        node.uo = self.uo
+        node.Value = self.Value
+        node.children = {k: v.copy(node) for k, v in self.children.items()}
+        return node
+
+
+class Elements():
+    def __init__(self, node):
+        self._node = weakref.ref(node)
+
+    @property
+    def node(self):
+        return self._node()
+
+    def __call__(self, key):
+        if isinstance(key, int):
+            return list(self.node.children.values())[key]
+        return self.node.child(key)
+
+    def Item(self, key):
+        return self(key)
+
+    def Add(self, composite):
+        name, _, uo = str(composite).partition("!")
+        node = self.node.child(name)
+        node.uo = uo or None
+        return node
+
+    def Remove(self, name):
+        self.node.children.pop(str(name), None)
+
+    def InsertRow(self, dimension, location):
+        return self.node.child(location)
+
+    @property
+    def Count(self):
+        return len(self.node.children)
+
+    def __iter__(self):
+        return iter(list(self.node.children.values()))
+
+
+class Tree(Node):
+    def FindNode(self, path):
+        node = self
+        for p in path.strip("/").split("/"):
+            node = node.child(p)
+        return node
+
+
+class Engine():
+    def __init__(self):
+        self.IsRunning = False
+
+
+
+class StandInDocument():
+    '''Drop-in replacement of the Aspen Plus document for Simulation'''
+    max_passes = 400
+    tolerance = 1e-7
+
+    def __init__(self):
+        self.Tree = Tree("Root")
+        self.Application = self
+        self.Engine = Engine()
+        self.Visible = False
+        self.SuppressDialogs = True
+        self.FullName = ""
+        self.saved = {}
+        self.runs = 0
+        self._status(0)
+
+    # ------------------------------------ Document ------------------------------------
+    def InitFromArchive2(self, path, *args):
+        self.FullName = os.path.abspath(path)
+        if self.FullName in self.saved:
+            self.Tree = self.saved[self.FullName].copy()
+            return
+        self.Tree = Tree("Root")
+        self.Tree.child("Data").child("Blocks")
+        self.Tree.child("Data").child("Streams")
+        self._status(0)
+
+    def InitFromFile2(self, path, *args):
+        self.InitFromArchive2(path)
+        with open(path) as f:
+            _load_deck(self.Tree, f.read())
+
+    def Close(self, *args):
+        pass
+
+    def Reinit(self):
+        for strm in self._data("Streams").children.values():
+            strm.children.pop("Output", None)
+        for blk in self._data("Blocks").children.values():
+            blk.children.pop("Output", None)
+        self._status(0)
+
+    def Stop(self):
+        self.Engine.IsRunning = False
+
+    def Run2(self, *args):
+        self.runs += 1
+        try:
+            converged = self._solve()
+        except (ArithmeticError, ValueError):
+            converged = False
+        self._status(0 if converged else 1)
+
+    def SaveAs(self, path, *args):
+        # Archives are kept in memory, the file only marks the name
+        self.FullName = os.path.abspath(path)
+        self.saved[self.FullName] = self.Tree.copy()
+        open(path, "a").close()
+
+    def snapshot_state(self):
+        return self.Tree.copy()
+
+    def restore_state(self, state):
+        self.Tree = state.copy()
+
+    def _data(self, name):
+        return self.Tree.child("Data").child(name)
+
+    def _status(self, error):
+        self.Tree.FindNode("/Data/Results Summary/Run-Status/Output/PER_ERROR").Value = error
+
+
+    # ------------------------------------ Solver ------------------------------------
+    def _solve(self):
+        blocks = self._data("Blocks").children
+        streams = self._data("Streams").children
+        state = {}
+
+        # Feed streams
+        for name, strm in streams.items():
+            if strm.value("Input", "TEMP", "MIXED") is not None:
+                flows = {c: float(strm.value("Input", "FLOW", "MIXED", c, default=0.)) for c in COMPONENTS}
+                state[name] = (float(strm.value("Input", "TEMP", "MIXED")),
+                               float(strm.value("Input", "PRES", "MIXED")), flows)
+
+        # Sequential-modular passes, recycle streams start empty
+        duties = {}
+        for _ in range(self.max_passes):
+            change = 0.
+            self._infeasible = False
+            for name, blk in blocks.items():
+                feeds = [state.get(s, (25., 1., dict.fromkeys(COMPONENTS, 0.)))
+                         for s in self._ports(blk, "F(IN)")]
+                if not feeds:
+                    return False
+                outs, duties[name] = self._unit(blk, _mix(feeds))
+                for s, new in outs.items():
+                    old = state.get(s)
+                    if old is not None:
+                        change = max(change, *(abs(new[2][c] - old[2][c]) for c in COMPONENTS))
+                    else:
+                        change = math.inf
+                    state[s] = new
+            if change < self.tolerance:
+                break
+        else:
+            return False
+        if self._infeasible:
+            return False
+
+        for name, (T, P, flows) in state.items():
+            if name not in streams or any(not math.isfinite(f) or f < -1e-9 for f in flows.values()):
+                return False
+            self._write_stream(streams[name], T, P, flows)
+        for name, blk in blocks.items():
+            for key, value in duties[name].items():
+                blk.set(*key.split("/"), value=value)
+        return True
+
+    def _ports(self, blk, port):
+        return list(blk.child("Ports").child(port).children)
+
+    def _write_stream(self, strm, T, P, flows):
+        total = sum(flows.values())
+        vfrac, vap, liq = _flash(T, P, flows)
+        strm.set("Output", "TEMP_OUT", "MIXED", value=T)
+        strm.set("Output", "PRES_OUT", "MIXED", value=P)
+        for c in COMPONENTS:
+            strm.set("Output", "MOLEFLOW", "MIXED", c, value=flows[c])
+        strm.set("Output", "MOLEFLMX", "MIXED", value=total)
+        strm.set("Output", "STR_MAIN", "VFRAC", "MIXED", value=vfrac)
+        vol = sum(vap.values())*8.314*(T + 273.15)/(100*P) + sum(liq.values())*LIQ_VOLUME
+        strm.set("Output", "VOLFLMX", "MIXED", value=vol)
+
+
+    def _unit(self, blk, feed):
+        uo = (blk.uo or "").upper()
+        inp = lambda *p, default=None: blk.value("Input", *p, default=default)
+        T, P, flows = feed
+        out = lambda port: self._ports(blk, port)
+
+        if uo == "MIXER":
+            return {s: feed for s in out("P(OUT)")}, {}
+
+        if uo == "FSPLIT":
+            outlets = out("P(OUT)")
+            fracs = {s: inp("FRAC", s) for s in outlets}
+            given = sum(f for f in fracs.values() if f is not None)
+            free = [s for s, f in fracs.items() if f is None]
+            res = {}
+            for s in outlets:
+                f = fracs[s] if fracs[s] is not None else (1 - given)/len(free)
+                res[s] = (T, P, {c: flows[c]*f for c in COMPONENTS})
+            return res, {}
+
+        if uo in ("HEATER", "PUMP"):
+            P_out = _pressure(inp("PRES", default=0), P)
+            if uo == "PUMP":
+                P_out = float(inp("PRES", default=P))
+                work = sum(flows.values())*LIQ_VOLUME*(P_out - P)*100/3600
+                return {s: (T, P_out, flows) for s in out("P(OUT)")}, {"Output/WNET": work}
+            if inp("SPEC_OPT") == "PV":
+                vf = float(inp("VFRAC", default=0))
+                T_out = _bubble_point(flows, P_out) if vf == 0 else _dew_point(flows, P_out)
+            else:
+                T_out = float(inp("TEMP", default=T))
+            q = sum(flows.values())*CP*(T_out - T)/3600
+            q += _latent(flows, T, P, T_out, P_out)
+            return {s: (T_out, P_out, flows) for s in out("P(OUT)")}, {"Output/QCALC": q}
+
+        if uo == "RPLUG":
+            return self._rplug(blk, inp, feed, out("P(OUT)"))
+
+        if uo == "FLASH2":
+            T_out = float(inp("TEMP", default=T))
+            P_out = _pressure(inp("PRES", default=0), P)
+            _, vap, liq = _flash(T_out, P_out, flows)
+            q = sum(flows.values())*CP*(T_out - T)/3600 + _latent(flows, T, P, T_out, P_out)
+            res = {s: (T_out, P_out, vap) for s in out("V(OUT)")}
+            res.update({s: (T_out, P_out, liq) for s in out("L(OUT)")})
+            return res, {"Output/QCALC": q}
+
+        if uo == "SEP":
+            res = {}
+            outlets = [s for s in out("P(OUT)")]
+            given = {c: 0. for c in COMPONENTS}
+            for s in outlets[:-1]:
+                split = {c: float(inp("FRACS", s, "MIXED", c, default=0.)) for c in COMPONENTS}
+                for c in COMPONENTS:
+                    given[c] += split[c]
+                res[s] = {c: flows[c]*split[c] for c in COMPONENTS}
+            if outlets:
+                res[outlets[-1]] = {c: flows[c]*max(0., 1 - given[c]) for c in COMPONENTS}
+            # Outlet conditions default to the feed
+            return {s: (float(inp("TEMP", s, default=T)), float(inp("PRES", s, default=P)), f)
+                    for s, f in res.items()}, {}
+
+        if uo == "RADFRAC":
+            return self._radfrac(blk, inp, feed, out)
+
+        raise ValueError(f"Unsupported block type {blk.uo}")
+
+
+    def _rplug(self, blk, inp, feed, outlets):
+        T, P, flows = feed
+        D = float(inp("DIAM"))
+        L = float(inp("LENGTH"))
+        volume = math.pi*D**2/4*L
+        total = sum(flows.values())
+        spec = inp("TYPE")
+
+        T_rx = float(inp("REAC_TEMP", default=T)) if spec == "T-SPEC" else T
+        q_flow = max(total, 1e-12)*8.314*(T_rx + 273.15)/(100*P)   # m3/h
+        k = K0*math.exp(-EA/(T_rx + 273.15))
+        conv = 1 - math.exp(-k*volume/q_flow)
+        extent = min(conv*flows["TOL"], flows["HYDROGEN"])
+
+        out = dict(flows)
+        out["TOL"] -= extent
+        out["HYDROGEN"] -= extent
+        out["BZN"] += extent
+        out["METHANE"] += extent
+
+        dT_ad = -DH_RXN*extent/(max(total, 1e-12)*CP)
+        if spec == "T-SPEC":
+            T_out = T_rx
+        elif spec == "TCOOL-SPEC":
+            U, T_cool = float(inp("U", default=0)), float(inp("CTEMP", default=T))
+            ntu = U*math.pi*D*L*3.6/(max(total, 1e-12)*CP)
+            T_ad = T + dT_ad
+            T_out = T_cool + (T_ad - T_cool)*math.exp(-ntu)
+        else:
+            T_out = T + dT_ad
+        q = total*CP*(T_out - T)/3600 + DH_RXN*extent/3600
+        return {s: (T_out, P, out) for s in outlets}, {"Output/QCALC": q}
+
+
+    def _radfrac(self, blk, inp, feed, out):
+        _, P, flows = feed
+        N = int(inp("NSTAGE"))
+        D = float(inp("BASIS_D"))
+        R = float(inp("BASIS_RR"))
+        P_col = float(inp("PRES1", default=P))
+        total = sum(flows.values())
+        if not 0 < D < total or N < 3:
+            # Recycle loops may not be filled yet, judge feasibility on the last pass
+            self._infeasible = True
+            D = min(max(D, 1e-6), 0.999*total)
+
+        dist = _distribute(flows, D, N, R, P_col)
+        bott = {c: flows[c] - dist[c] for c in COMPONENTS}
+        res = {}
+
+        # Liquid side product taken from the bottoms section
+        for s in out("SP(OUT)"):
+            rate = min(float(inp("PROD_FLOW", s, default=0.)), 0.99*sum(bott.values()))
+            frac = rate/max(sum(bott.values()), 1e-12)
+            side = {c: bott[c]*frac for c in COMPONENTS}
+            bott = {c: bott[c] - side[c] for c in COMPONENTS}
+            res[s] = (_bubble_point(side, P_col), P_col, side)
+
+        vapor = out("VD(OUT)")
+        if vapor:
+            gas = {c: dist[c] if c in ("HYDROGEN", "METHANE") else 0. for c in COMPONENTS}
+            dist = {c: dist[c] - gas[c] for c in COMPONENTS}
+            for s in vapor:
+                res[s] = (_dew_point(gas, P_col), P_col, gas)
+        for s in out("LD(OUT)"):
+            res[s] = (_bubble_point(dist, P_col), P_col, dist)
+        for s in out("B(OUT)"):
+            res[s] = (_bubble_point(bott, P_col), P_col, bott)
+
+        # Duties and tray sizing
+        vap_flow = (R + 1)*D
+        q = vap_flow*LATENT/3600
+        vol = vap_flow*8.314*(T_BOIL["BZN"] + 273.15)/(100*P_col)/3600    # m3/s
+        diam = math.sqrt(4*vol/(math.pi*1.5))
+        return res, {"Output/COND_DUTY": -q, "Output/REB_DUTY": q,
+                     "Subobjects/Tray Sizing/1/Output/DIAM4/1": diam}
+
+
+
+# ------------------------------------ Thermodynamics ------------------------------------
+
+def _pressure(spec, P_in):
+    spec = float(spec)
+    return P_in + spec if spec <= 0 else spec
+
+
+def _mix(feeds):
+    flows = {c: sum(f[2][c] for f in feeds) for c in COMPONENTS}
+    total = sum(flows.values())
+    if total > 0:
+        T = sum(f[0]*sum(f[2].values()) for f in feeds)/total
+    else:
+        T = feeds[0][0]
+    P = min(f[1] for f in feeds)
+    return T, P, flows
+
+
+def _psat(c, T):
+    A, B, C = ANTOINE[c]
+    return 10**(A - B/(T + C))/750.06   # bar
+
+
+def _flash(T, P, flows):
+    '''Rachford-Rice flash with Raoult K-values. Returns (vfrac, vapor, liquid).'''
+    total = sum(flows.values())
+    if total <= 0:
+        return 0., dict.fromkeys(COMPONENTS, 0.), dict.fromkeys(COMPONENTS, 0.)
+    z = {c: flows[c]/total for c in COMPONENTS}
+    K = {c: max(_psat(c, min(T, 1500.))/P, 1e-12) for c in COMPONENTS}
+
+    rr = lambda v: sum(z[c]*(K[c] - 1)/(1 + v*(K[c] - 1)) for c in COMPONENTS)
+    if rr(0.) <= 0:
+        v = 0.
+    elif rr(1.) >= 0:
+        v = 1.
+    else:
+        lo, hi = 0., 1.
+        for _ in range(60):
+            v = (lo + hi)/2
+            lo, hi = (v, hi) if rr(v) > 0 else (lo, v)
+    vap = {c: flows[c]*v*K[c]/(1 + v*(K[c] - 1)) for c in COMPONENTS}
+    liq = {c: flows[c] - vap[c] for c in COMPONENTS}
+    return v, vap, liq
+
+
+def _bubble_point(flows, P):
+    return _saturation(flows, P, lambda s: s - 1)
+
+
+def _dew_point(flows, P):
+    return _saturation(flows, P, lambda s: 1 - 1/s if s > 0 else -1, dew=True)
+
+
+def _saturation(flows, P, residual, dew=False):
+    total = sum(flows.values())
+    if total <= 0:
+        return 25.
+    z = {c: flows[c]/total for c in COMPONENTS}
+    if dew:
+        s_of = lambda T: 1/max(sum(z[c]*P/_psat(c, T) for c in COMPONENTS), 1e-300)
+    else:
+        s_of = lambda T: sum(z[c]*_psat(c, T)/P for c in COMPONENTS)
+    lo, hi = -200., 600.
+    for _ in range(60):
+        T = (lo + hi)/2
+        lo, hi = (lo, T) if residual(s_of(T)) > 0 else (T, hi)
+    return T
+
+
+def _latent(flows, T_in, P_in, T_out, P_out):
+    v_in = _flash(T_in, P_in, flows)[0]
+    v_out = _flash(T_out, P_out, flows)[0]
+    aromatics = flows["TOL"] + flows["BZN"]
+    return (v_out - v_in)*aromatics*LATENT/3600
+
+
+def _distribute(flows, D, N, R, P):
+    '''Fenske distribution with an effective stage count set by the reflux ratio'''
+    T_ref = T_BOIL["TOL"]
+    alpha = {c: _psat(c, T_ref)/_psat("TOL", T_ref) for c in COMPONENTS}
+    n_eff = N*R/(R + 1)
+
+    def distillate(logc):
+        return {c: flows[c]*_logistic(logc + n_eff*math.log(alpha[c])) for c in COMPONENTS}
+
+    lo, hi = -500., 500.
+    for _ in range(200):
+        mid = (lo + hi)/2
+        lo, hi = (mid, hi) if sum(distillate(mid).values()) < D else (lo, mid)
+    return distillate((lo + hi)/2)
+
+
+def _logistic(x):
+    if x >= 0:
+        return 1/(1 + math.exp(-x))
+    e = math.exp(x)
+    return e/(1 + e)
+
+
+
+# ------------------------------------ Input decks ------------------------------------
+
+# Unit operation names of the deck keywords and the ports of their ordered outlets
+DECK_BLOCKS = {"MIXER": "Mixer", "HEATER": "Heater", "RPLUG": "RPlug", "FLASH2": "Flash2",
+               "FSPLIT": "FSplit", "RADFRAC": "Radfrac", "SEP": "Sep", "PUMP": "Pump"}
+
+
+def _load_deck(tree, text):
+    '''Build the stand-in tree from the subset of .inp keywords written by deck.py'''
+    paragraphs = []
+    for line in text.splitlines():
+        line = line.split(";")[0].rstrip()
+        if not line.strip():
+            continue
+        if line[0].isspace():
+            if paragraphs:
+                paragraphs[-1][1].append(line.split())
+        else:
+            paragraphs.append((line.split(), []))
+
+    blk_root = tree.child("Data").child("Blocks")
+    strm_root = tree.child("Data").child("Streams")
+
+    for head, body in paragraphs:
+        if head[0] == "FLOWSHEET":
+            for stmt in body:
+                name = stmt[1]
+                ins, outs, side = [], [], None
+                for tok in stmt[2:]:
+                    if tok.startswith("IN="):
+                        side, tok = ins, tok[3:]
+                    elif tok.startswith("OUT="):
+                        side, tok = outs, tok[4:]
+                    if tok:
+                        side.append(tok)
+                blk = blk_root.child(name)
+                for s in ins + outs:
+                    strm_root.Elements.Add(f"{s}!MATERIAL")
+                for s in ins:
+                    blk.child("Ports").child("F(IN)").child(s)
+                blk.outlets = outs
+
+        elif head[0] == "STREAM":
+            strm = strm_root.child(head[1])
+            for stmt in body:
+                kv = _pairs(stmt)
+                if stmt[0] == "SUBSTREAM":
+                    strm.set("Input", "TEMP", "MIXED", value=float(kv["TEMP"]))
+                    strm.set("Input", "PRES", "MIXED", value=float(kv["PRES"]))
+                elif stmt[0] == "MOLE-FLOW":
+                    for item in " ".join(stmt[1:]).split("/"):
+                        chemical, flow = item.split()
+                        strm.set("Input", "FLOW", "MIXED", chemical, value=float(flow))
+
+        elif head[0] == "BLOCK":
+            blk = blk_root.child(head[1])
+            blk.uo = DECK_BLOCKS[head[2]]
+            _block_inputs(blk, head[2], body)
+
+
+def _value(v):
+    try:
+        return float(v)
+    except ValueError:
+        return v
+
+
+def _pairs(stmt):
+    return dict(tok.split("=", 1) for tok in stmt if "=" in tok)
+
+
+def _block_inputs(blk, uo, body):
+    inp = lambda *p, value: blk.set("Input", *p, value=value)
+    outlets = getattr(blk, "outlets", [])
+    ports = {"FLASH2": ["V(OUT)", "L(OUT)"]}.get(uo, ["P(OUT)"]*len(outlets))
+    products = {}
+
+    for stmt in body:
+        kv = _pairs(stmt)
+        key = stmt[0]
+        if key == "PARAM":
+            for k, v in kv.items():
+                k = k.replace("-", "_")
+                inp(k, value=_value(v))
+            if uo == "HEATER":
+                inp("SPEC_OPT", value="PV" if "VFRAC" in kv else "TP")
+        elif key == "COOLANT":
+            inp("U", value=float(kv["U"]))
+            inp("CTEMP", value=float(kv["TEMP"]))
+        elif key == "T-SPEC":
+            inp("REAC_TEMP", value=float(stmt[2]))
+        elif key == "FRAC":
+            inp("FRAC", stmt[1], value=float(stmt[2]))
+        elif key == "COL-SPECS":
+            for k, name in (("MOLE-D", "BASIS_D"), ("MOLE-RR", "BASIS_RR"), ("MOLE-RDV", "BASIS_RDV")):
+                if k in kv:
+                    inp(name, value=float(kv[k]))
+        elif key == "P-SPEC":
+            inp("PRES1", value=float(stmt[2]))
+        elif key == "PROD-FLOW":
+            inp("PROD_FLOW", stmt[1], value=float(stmt[2]))
+        elif key == "PRODUCTS":
+            for item in " ".join(stmt[1:]).split("/"):
+                name, stage, phase = item.split()
+                products[name] = (int(stage), phase)
+
+    if uo == "RADFRAC":
+        nstage = int(blk.value("Input", "NSTAGE"))
+        ports = []
+        for s in outlets:
+            stage, phase = products[s]
+            if stage == 1:
+                ports.append("VD(OUT)" if phase == "V" else "LD(OUT)")
+            elif stage == nstage:
+                ports.append("B(OUT)")
+            else:
+                ports.append("SP(OUT)")
+    for s, port in zip(outlets, ports):
+        blk.child("Ports").child(port).child(s)
@@ -0,0 +1,164 @@
+import numpy as np
+
+
+# Solved stream states. A stream is read from the engine once per engine run into a
+# StreamState: temperature, pressure and the molar flows in COMPONENTS order, the
+# layout of the recorded snapshots [T, P, F_TOL, F_H2, F_CH4, F_BZN, F_total].
+
+COMPONENTS = ("TOL", "HYDROGEN", "METHANE", "BZN")
+INDEX = {c: i for i, c in enumerate(COMPONENTS)}
+T_, P_, TOL_, H2_, CH4_, BZN_, TOT_ = range(7)
+
+# Scales of temperature and pressure in the observation
+T_SCALE, P_SCALE = 900, 38
+
+
+class StreamState():
+    __slots__ = ("T", "P", "flows", "total")
+
+    def __init__(self, T, P, flows, total=None):
+        self.T = T
+        self.P = P
+        self.flows = np.asarray(flows, dtype=float)
+        self.total = float(self.flows.sum()) if total is None else total
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        return cls(snap[T_], snap[P_], snap[TOL_:TOT_], snap[TOT_])
+
+    @classmethod
+    def from_specs(cls, specs):
+        # Inlet specifications (T, P, {component: flow})
+        T, P, comp = specs
+        return cls(T, P, [comp[c] for c in COMPONENTS])
+
+    def snapshot(self):
+        return [self.T, self.P] + self.flows.tolist() + [self.total]
+
+    def outputs(self):
+        '''[T, P, F_TOL, F_H2, F_CH4, F_BZN] (Flowsheet.get_outputs)'''
+        return [self.T, self.P] + self.flows.tolist()
+
+    def flow(self, component):
+        return self.flows[INDEX[component]]
+
+    def fractions(self):
+        return self.flows/self.total
+
+    def fraction(self, component):
+        return self.flows[INDEX[component]]/self.total
+
+    def observation(self, iteration, max_iter):
+        '''Flowsheet state of a step with this outlet'''
+        obs = np.empty(7)
+        obs[0] = self.T/T_SCALE
+        obs[1] = self.P/P_SCALE
+        obs[2:6] = self.flows/self.total
+        obs[6] = iteration/max_iter
+        return obs
+
+    def __repr__(self):
+        flows = ", ".join(f"{c}={f:.4g}" for c, f in zip(COMPONENTS, self.flows))
+        return f"StreamState(T={self.T:.4g}, P={self.P:.4g}, {flows})"
+
+
+def stack(states):
+    '''(n, 7) snapshot matrix of stream states'''
+    out = np.empty((len(states), 7))
+    for i, s in enumerate(states):
+        out[i, T_], out[i, P_], out[i, TOL_:TOT_], out[i, TOT_] = s.T, s.P, s.flows, s.total
+    return out
+
+
+def fractions(snaps):
+    '''Component mole fractions of a (..., 7) snapshot array'''
+    snaps = np.asarray(snaps, dtype=float)
+    return snaps[..., TOL_:TOT_]/snaps[..., TOT_:]
+
+
+def observations(snaps, iterations, max_iter):
+    '''Flowsheet states of a batch of (..., 7) outlet snapshots'''
+    snaps = np.asarray(snaps, dtype=float)
+    it = np.broadcast_to(np.asarray(iterations, dtype=float)/max_iter, snaps.shape[:-1])
+    return np.concatenate([snaps[..., T_:T_ + 1]/T_SCALE, snaps[..., P_:P_ + 1]/P_SCALE,
+                           fractions(snaps), it[..., None]], axis=-1)
+
+
+class InfoTable():
+    '''Per-unit summaries of an episode (Flowsheet.info) in preallocated arrays.
+
+    Each of the `capacity` rows holds a unit name, up to MAX_PARAMS design
+    parameters and up to MAX_STREAMS outlet states ([T, P, F_TOL, F_H2, F_CH4,
+    F_BZN]). It reads like the former dict of nested lists: info["DC1"] gives
+    [params..., outputs...], or the bare outputs of a unit without parameters.
+    When full, the oldest row is reused.
+    '''
+    MAX_PARAMS = 3
+    MAX_STREAMS = 2
+    __slots__ = ("capacity", "names", "params", "streams", "n_params", "n_streams", "bare", "index", "next")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.names = [None]*capacity
+        self.params = np.zeros((capacity, self.MAX_PARAMS))
+        self.streams = np.zeros((capacity, self.MAX_STREAMS, 6))
+        self.n_params = np.zeros(capacity, dtype=np.int8)
+        self.n_streams = np.zeros(capacity, dtype=np.int8)
+        self.bare = np.zeros(capacity, dtype=bool)
+        self.index = {}
+        self.next = 0
+
+    def __setitem__(self, name, value):
+        row = self.index.get(name)
+        if row is None:
+            row = self.next
+            self.next = (row + 1) % self.capacity
+            if self.names[row] is not None:
+                del self.index[self.names[row]]
+            self.names[row] = name
+            self.index[name] = row
+
+        bare = all(np.ndim(v) == 0 for v in value)
+        params = [] if bare else [v for v in value if np.ndim(v) == 0]
+        streams = [value] if bare else [v for v in value if np.ndim(v) != 0]
+        if len(params) > self.MAX_PARAMS or len(streams) > self.MAX_STREAMS:
+            raise ValueError(f"Summary of {name} does not fit an info row")
+        self.params[row, :len(params)] = params
+        self.streams[row, :len(streams)] = streams
+        self.n_params[row], self.n_streams[row], self.bare[row] = len(params), len(streams), bare
+
+    def __getitem__(self, name):
+        row = self.index[name]
+        streams = [s.tolist() for s in self.streams[row, :self.n_streams[row]]]
+        if self.bare[row]:
+            return streams[0]
+        return self.params[row, :self.n_params[row]].tolist() + streams
+
+    def get(self, name, default=None):
+        return self[name] if name in self.index else default
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(list(self.index))
+
+    def keys(self):
+        return list(self.index)
+
+    def values(self):
+        return [self[name] for name in self.index]
+
+    def items(self):
+        return [(name, self[name]) for name in self.index]
+
+    def clear(self):
+        self.names = [None]*self.capacity
+        self.index.clear()
+        self.next = 0
+
+    def __repr__(self):
+        return repr(dict(self.items()))
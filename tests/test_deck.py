@@ -0,0 +1,63 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from Simulation import Simulation, Stream
+from env import Flowsheet
+from deck import compile_design, evaluate_design, read_header
+
+
+INLET_SPECS = (25.0, 38.0, {"TOL": 110.0, "HYDROGEN": 400.0, "METHANE": 0.0, "BZN": 0.0})
+
+# Setup section of an exported .inp; the stand-in only reads the flowsheet
+EXPORTED = """\
+TITLE 'BZN_prod'
+IN-UNITS METCBAR
+DEF-STREAMS CONVEN ALL
+COMPONENTS
+    TOL C7H8 /
+    BZN C6H6 /
+    HYDROGEN H2 /
+    METHANE CH4
+PROPERTIES PENG-ROB
+REACTIONS R-1 POWERLAW
+    STOIC 1 MIXED TOL -1 / HYDROGEN -1 / BZN 1 / METHANE 1
+FLOWSHEET
+    BLOCK B1 IN=1 OUT=2
+STREAM 1
+    SUBSTREAM MIXED TEMP=25. PRES=38.
+"""
+
+
+def test_read_header(tmp_path):
+    path = tmp_path / "BZN_prod.inp"
+    path.write_text(EXPORTED)
+    header = read_header(path)
+    assert header.startswith("IN-UNITS METCBAR")
+    assert "REACTIONS R-1 POWERLAW" in header
+    assert header.rstrip().endswith("BZN 1 / METHANE 1")
+    assert "TITLE" not in header
+
+
+def test_compiled_design_matches_episode(tmp_path, monkeypatch):
+    '''A recorded trajectory compiled into one deck solves to the streams of the
+    stepwise episode'''
+    # Simulation changes the working directory
+    monkeypatch.chdir(tmp_path)
+    sim = Simulation(tmp_path / "BZN_prod.bkp", tmp_path, backend="standin")
+    env = Flowsheet(sim, 0.9, 12, INLET_SPECS)
+    c_action = np.full(21, 0.5)
+
+    _, sin = env.reset()
+    for a in (0, 1, 4, 4, 3, 7, 8, 9):
+        _, _, _, _, sin = env.step({"discrete": a, "continuous": c_action}, sin)
+    assert all(step["converged"] for step in env.trajectory)
+    products = [step["sin_name"] for step in env.trajectory] + [sin.name]
+    expected = {s: [Stream.ref(s).get_molar_flow(c) for c in INLET_SPECS[2]] for s in products}
+
+    (tmp_path / "BZN_prod.inp").write_text(EXPORTED)
+    header = read_header(tmp_path / "BZN_prod.inp")
+    assert header in compile_design(env.trajectory, INLET_SPECS, header)
+    assert evaluate_design(sim, env.trajectory, INLET_SPECS, header)
+    for s, flows in expected.items():
+        assert [Stream.ref(s).get_molar_flow(c) for c in INLET_SPECS[2]] == pytest.approx(flows, rel=1e-4, abs=1e-6)
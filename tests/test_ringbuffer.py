@@ -0,0 +1,148 @@
+import threading
+import multiprocessing as mp
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from ringbuffer import TrajectoryRing, SharedWeights, RingClosed
+
+
+STATE_DIM, C_DIM, D_DIM = 3, 2, 4
+
+
+def episode(uid, n):
+    '''Transitions of episode `uid`: the reward holds the uid, the state the step'''
+    mask = np.ones(D_DIM, bool)
+    return [(np.full(STATE_DIM, i), 0, np.zeros(C_DIM), float(uid), np.zeros(STATE_DIM), 0.,
+             np.zeros(C_DIM), i == n - 1, False, mask) for i in range(n)]
+
+
+def _writer(name, lock, writer, episodes, max_len):
+    ring = TrajectoryRing.attach(name, lock)
+    rng = np.random.default_rng(writer)
+    try:
+        for k in range(episodes):
+            ring.write_episode(episode(1000*writer + k, int(rng.integers(1, max_len + 1))))
+    except RingClosed:
+        pass
+    finally:
+        ring.unlink()
+
+
+def _publisher(name, shapes, versions):
+    weights = SharedWeights.attach(name, shapes)
+    nets = {"net": torch.nn.Linear(64, 64)}
+    for v in range(1, versions + 1):
+        with torch.no_grad():
+            for p in nets["net"].parameters():
+                p.fill_(v)
+        weights.publish(nets)
+    weights.unlink()
+
+
+def episodes_of(batch):
+    '''(uid, length) of the whole episodes of a take()'''
+    r, s, done = batch[3].flatten().tolist(), batch[0][:, 0].tolist(), batch[7].flatten().tolist()
+    out, start = [], 0
+    for i, d in enumerate(done):
+        if d:
+            assert len(set(r[start:i + 1])) == 1 and s[start:i + 1] == list(range(i + 1 - start))
+            out.append((int(r[start]), i + 1 - start))
+            start = i + 1
+    assert start == len(r)
+    return out
+
+
+def test_skip_marker_at_wrap():
+    ring = TrajectoryRing(10, STATE_DIM, C_DIM, D_DIM)
+    try:
+        ring.write_episode(episode(1, 6))
+        assert episodes_of(ring.take(6)) == [(1, 6)]
+        ring.release()
+
+        # Rows 6..9 are skipped, the episode is written from row 0
+        ring.write_episode(episode(2, 6))
+        assert ring.cols["length"][6] == -4 and ring.cols["seq"][6] == 6
+        assert ring.cols["length"][0] == 6 and ring.cols["seq"][0] == 10
+        assert ring._get("reserved") == 16
+
+        assert episodes_of(ring.take(1)) == [(2, 6)]
+        ring.release()
+        assert ring._get("tail") == 16 and len(ring) == 0
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_take_fewer_rows_when_writer_waits():
+    ring = TrajectoryRing(10, STATE_DIM, C_DIM, D_DIM)
+    try:
+        ring.write_episode(episode(1, 6))
+        # Needs the rows of the first episode, which only the reader frees
+        writer = threading.Thread(target=ring.write_episode, args=(episode(2, 6),), daemon=True)
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+
+        assert episodes_of(ring.take(10, timeout=5.)) == [(1, 6)]
+        ring.release()
+        writer.join(5.)
+        assert not writer.is_alive()
+        assert episodes_of(ring.take(6, timeout=5.)) == [(2, 6)]
+        ring.release()
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_writer_processes_deliver_every_episode_once():
+    writers, per_writer, max_len = 3, 60, 12
+    ctx = mp.get_context("spawn")
+    ring = TrajectoryRing(16, STATE_DIM, C_DIM, D_DIM, lock=ctx.Lock())
+    procs = [ctx.Process(target=_writer, args=(ring.name, ring.lock, w, per_writer, max_len), daemon=True)
+             for w in range(writers)]
+    for p in procs:
+        p.start()
+    received = []
+    try:
+        while len(received) < writers*per_writer:
+            # Fewer rows than a full take are left once the writers are done
+            batch = ring.take(16, timeout=1.) or ring.take(1, timeout=30.)
+            assert batch is not None, "the writers stopped"
+            received.extend(episodes_of(batch))
+            ring.release()
+    finally:
+        ring.close()
+        for p in procs:
+            p.join(10)
+        ring.unlink()
+
+    uids = [uid for uid, _ in received]
+    assert sorted(uids) == sorted(1000*w + k for w in range(writers) for k in range(per_writer))
+    for w in range(writers):
+        # In the order each writer wrote them
+        mine = [uid for uid in uids if uid // 1000 == w]
+        assert mine == sorted(mine)
+    assert all(p.exitcode == 0 for p in procs)
+
+
+def test_weights_load_is_never_torn():
+    versions = 300
+    nets = {"net": torch.nn.Linear(64, 64)}
+    weights = SharedWeights.of(nets)
+    publisher = mp.get_context("spawn").Process(target=_publisher, args=(weights.name, weights.shapes, versions))
+    publisher.start()
+    loaded = []
+    try:
+        while publisher.is_alive() or weights.seen < 2*versions:
+            version = weights.load(nets)
+            if version is not None:
+                values = torch.cat([p.detach().flatten() for p in nets["net"].parameters()])
+                assert bool((values == values[0]).all())
+                loaded.append(version)
+        publisher.join()
+    finally:
+        weights.unlink()
+    assert loaded[-1] == 2*versions and loaded == sorted(loaded)
+    assert publisher.exitcode == 0
@@ -0,0 +1,105 @@
+import time
+import threading
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+
+from rollout import (LoopbackTransport, TCPTransport, RolloutLearner, TransportClosed, batch_columns,
+                     pack_arrays, HELLO, BATCH, WEIGHTS, JOIN, HEARTBEAT)
+from train import DEFAULTS, build_agent
+
+
+@pytest.fixture
+def ppo(tmp_path):
+    return build_agent(DEFAULTS, str(tmp_path))
+
+
+def episode(ppo, n, rng):
+    '''PPO.put_data transitions of a random episode'''
+    mask = np.ones(ppo.masks_dims, bool)
+    return [(rng.random(ppo.s_dim), int(rng.integers(ppo.masks_dims)), rng.random(ppo.acts_dims), float(rng.random()),
+             rng.random(ppo.s_dim), 0.1, rng.random(ppo.acts_dims), i == n - 1, False, mask) for i in range(n)]
+
+
+def batch(ppo, version, n, rng):
+    columns = batch_columns(episode(ppo, n, rng), ppo.s_dim, ppo.acts_dims, ppo.masks_dims)
+    return {"version": version, "episodes": 1, "returns": [0.], "lengths": [n], "columns": pack_arrays(columns)}
+
+
+def test_silent_collector_is_dropped(ppo):
+    rng = np.random.default_rng(0)
+    transport = LoopbackTransport()
+    learner = RolloutLearner(ppo, transport.listen(), timeout=0.5)
+    active, silent = transport.connect(), transport.connect()
+    silent.send(HELLO, {"name": "silent"})
+
+    for _ in range(4):
+        active.send(BATCH, batch(ppo, learner.version, 16, rng))
+        assert learner.collect(16, timeout=5.) == 16
+        learner.update()
+        # The active collector keeps its heartbeat
+        time.sleep(0.3)
+        active.send(HEARTBEAT, None)
+
+    assert learner.version == 4
+    assert silent.peer not in learner.collectors and active.peer in learner.collectors
+    assert learner.stats["dropped"] == 1
+    with pytest.raises(TransportClosed):
+        for _ in range(10):
+            silent.recv(timeout=1.)
+    learner.close()
+
+
+def test_stale_batch_is_discarded(ppo):
+    rng = np.random.default_rng(0)
+    transport = LoopbackTransport()
+    learner = RolloutLearner(ppo, transport.listen(), max_lag=2)
+    collector = transport.connect()
+    learner.version = 3
+
+    collector.send(BATCH, batch(ppo, 0, 8, rng))
+    collector.send(BATCH, batch(ppo, 1, 8, rng))
+    assert learner.collect(8, timeout=1.) == 8
+    assert learner.stats["stale"] == 1 and learner.stats["batches"] == 1
+    assert len(ppo.data) == 8
+    learner.close()
+
+
+def test_blocked_collector_sees_drop():
+    transport = LoopbackTransport(max_pending=1)
+    learner = transport.listen()
+    collector = transport.connect()
+    errors = []
+
+    def send():
+        try:
+            # The second message waits for the learner, which never reads
+            for _ in range(2):
+                collector.send(HEARTBEAT, None)
+        except TransportClosed as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=send, daemon=True)
+    thread.start()
+    thread.join(0.3)
+    assert thread.is_alive()
+    learner.drop(collector.peer)
+    thread.join(2.)
+    assert not thread.is_alive() and len(errors) == 1
+
+
+def test_tcp_round_trip():
+    learner = TCPTransport("tcp://127.0.0.1:0").listen()
+    collector = TCPTransport(learner.address).connect()
+    try:
+        peer, kind, _ = learner.recv(timeout=5.)
+        assert kind == JOIN
+        collector.send(HELLO, {"name": "node-1"})
+        assert learner.recv(timeout=5.) == (peer, HELLO, {"name": "node-1"})
+
+        assert learner.send(peer, WEIGHTS, {"version": 1, "weights": {"actor": [1.5, 2.5]}})
+        assert collector.recv(timeout=5.) == (WEIGHTS, {"version": 1, "weights": {"actor": [1.5, 2.5]}})
+    finally:
+        collector.close()
+        learner.close()
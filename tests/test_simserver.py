@@ -0,0 +1,64 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from Simulation import Simulation
+from env import Flowsheet
+from simserver import SimServer
+
+
+INLET_SPECS = (25.0, 38.0, {"TOL": 110.0, "HYDROGEN": 400.0, "METHANE": 0.0, "BZN": 0.0})
+DESIGN = (0, 1, 4, 4, 3, 7, 8, 9)
+C_ACTION = np.full(21, 0.5)
+
+
+def run(env, sin, actions):
+    rewards = []
+    for a in actions:
+        _, r, _, _, sin = env.step({"discrete": a, "continuous": C_ACTION}, sin)
+        rewards.append(r)
+        env.action_masks(sin)
+    return rewards, sin
+
+
+def episode(directory, backend):
+    '''Rewards of a design, of its tail again after restoring a mid-episode
+    snapshot, and of the whole design after an engine restart'''
+    sim = Simulation(directory / "BZN_prod.bkp", directory, backend=backend)
+    env = Flowsheet(sim, 0.9, 12, INLET_SPECS)
+
+    _, sin = env.reset()
+    env.action_masks(sin, inlet=True)
+    head, sin = run(env, sin, DESIGN[:3])
+    handle = env.snapshot(sin)
+    tail, _ = run(env, sin, DESIGN[3:])
+    _, sin = env.restore(handle)
+    env.action_masks(sin)
+    again, _ = run(env, sin, DESIGN[3:])
+    env.release(handle)
+
+    sim.Restart()
+    _, sin = env.reset()
+    env.action_masks(sin, inlet=True)
+    restarted, _ = run(env, sin, DESIGN)
+    return head + tail, again, restarted
+
+
+def test_remote_episode_matches_standin(tmp_path, monkeypatch):
+    # Simulation changes the working directory
+    monkeypatch.chdir(tmp_path)
+    expected = episode(tmp_path, "standin")
+
+    address = str(tmp_path / "s.sock")
+    server = SimServer(address, "standin", documents=2).start()
+    try:
+        monkeypatch.setenv("AUTOPROCRL_SIMSERVER", address)
+        monkeypatch.setenv("AUTOPROCRL_SIMSERVER_DOC", "1")
+        rewards = episode(tmp_path, "remote")
+    finally:
+        Simulation.AspenSimulation.client.close()
+        Simulation.AspenSimulation = Simulation.backend = None
+        server.shutdown()
+
+    assert rewards == expected
+    assert rewards[1] == rewards[0][3:] and rewards[2] == rewards[0]
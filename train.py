@@ -0,0 +1,499 @@
+import os
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import itertools
+import traceback
+import numpy as np
+import multiprocessing as mp
+
+
+# Headless training runner. A run builds Flowsheet and PPO from a JSON config,
+# trains, evaluates the deterministic policy and writes into its run directory:
+#   config.json        resolved config of the run
+#   metrics.jsonl      one line per step, episode, update and evaluation (see metrics.py)
+#   designs.jsonl      episode records of the best evaluated designs
+#   archive.jsonl      top designs per topology (see archive.py)
+#   checkpoints/       crash-safe training checkpoints (see checkpoint.py), resumed
+#   model/, best_model/  actor and critic weights of PPO.save / PPO.best_save
+#   policy.npz         best policy for the NumPy runtime (see policy.py)
+#
+# Several seeds ("seeds") and hyperparameter settings ("sweep": dotted key -> list
+# of values) run as parallel worker processes:
+#   python train.py config.json --workers 4
+#   python train.py config.json --set agent.lr=3e-4 --seeds 0 1 2
+
+DEFAULTS = {
+    # Simulation and Flowsheet
+    "aspen_file": "BZN_prod.bkp",
+    "directory": "./Aspen Plus",
+    "backend": None,
+    "pure": 0.9,
+    "max_iter": 12,
+    "inlet_specs": [25.0, 38.0, {"TOL": 110.0, "HYDROGEN": 400.0, "METHANE": 0.0, "BZN": 0.0}],
+    "fidelity": "rigorous",
+    "reward": {},           # RewardConfig arguments
+    "recovery": None,       # StepRecovery arguments, or None
+    "pruner": None,         # EpisodePruner arguments, or None
+    "scenarios": None,      # Feed distribution (scenarios.FeedDistribution), or None for inlet_specs only
+    "envs": 1,              # Scenario environments stepped in parallel worker processes
+
+    # PPO arguments (model_dir and best_dir are set per run)
+    "agent": {},
+
+    # Training
+    "episodes": 1000,
+    "update_every": 64,     # Transitions collected between PPO updates
+    "eval_every": 50,       # Episodes between evaluations of the deterministic policy
+    "eval_episodes": 1,
+    "save_every": 0,        # Episodes between PPO.save weight files (0: never)
+    "checkpoint_every": 50,
+    "keep": 3,
+    "archive_capacity": 100,
+    "sil_every": 0,         # Updates between self-imitation updates on the archive (0: never)
+    "sil_batch": 8,
+    "threads": None,        # torch threads per run (1 when runs share the machine)
+    "log_steps": True,      # Per-step metrics besides the per-episode ones
+    "metrics_flush": 1.0,   # Seconds between flushes of the metrics file
+
+    # Runs
+    "seeds": [0],
+    "sweep": {},
+    "out": "./runs",
+    "name": "run",
+}
+
+
+# ------------------------------------ Config ------------------------------------
+def load_config(path=None, overrides=()):
+    config = copy.deepcopy(DEFAULTS)
+    if path is not None:
+        with open(path) as f:
+            user = json.load(f)
+        unknown = set(user) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown config keys {sorted(unknown)}")
+        config.update(user)
+    for item in overrides:
+        key, _, value = item.partition("=")
+        set_key(config, key, _parse(value))
+    return config
+
+
+def set_key(config, key, value):
+    '''Set a dotted key ("agent.lr") of a nested config'''
+    *parents, last = key.split(".")
+    node = config
+    for p in parents:
+        if node.get(p) is None:
+            node[p] = {}
+        node = node[p]
+    node[last] = value
+
+
+def _parse(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def expand(config):
+    '''Configs of every run: the sweep settings times the seeds, named after them'''
+    keys = sorted(config["sweep"])
+    runs = []
+    for values in itertools.product(*(config["sweep"][k] for k in keys)):
+        setting = ",".join(f"{k}={v}" for k, v in zip(keys, values))
+        for seed in config["seeds"]:
+            run = copy.deepcopy(config)
+            for k, v in zip(keys, values):
+                set_key(run, k, v)
+            run["seed"] = seed
+            run["name"] = os.path.join(config["name"], setting, f"seed-{seed}") if setting else \
+                os.path.join(config["name"], f"seed-{seed}")
+            runs.append(run)
+    return runs
+
+
+
+# ------------------------------------ Run ------------------------------------
+def seed_everything(seed):
+    import torch
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def make_env(config, seed=None):
+    '''Flowsheet of a run, drawing its feed conditions from config["scenarios"] if set'''
+    from Simulation import Simulation
+    from env import Flowsheet
+    from reward import RewardConfig
+    from recovery import StepRecovery
+    from scenarios import FeedDistribution, ScenarioFlowsheet
+
+    recovery = StepRecovery(**config["recovery"]) if config["recovery"] is not None else None
+    sim = Simulation(config["aspen_file"], config["directory"], backend=config["backend"])
+    env = Flowsheet(sim, config["pure"], config["max_iter"], config["inlet_specs"],
+                    reward_config=RewardConfig.from_dict(config["reward"]), fidelity=config["fidelity"],
+                    recovery=recovery)
+    if config["scenarios"] is not None:
+        env = ScenarioFlowsheet(env, FeedDistribution(config["inlet_specs"], config["scenarios"]), seed)
+    return env
+
+
+def spaces(config):
+    '''(observation_space, action_space) of the environment of a run, without
+    starting a simulator'''
+    from env import Flowsheet
+    from scenarios import FeedDistribution, observation_space
+
+    space, actions = Flowsheet.spaces()
+    if config["scenarios"] is not None:
+        space = observation_space(space, FeedDistribution(config["inlet_specs"], config["scenarios"]))
+    return space, actions
+
+
+def build_agent(config, run_dir):
+    '''PPO of a run, for processes that train but never simulate'''
+    from agent import PPO
+
+    space, actions = spaces(config)
+    dirs = {"model_dir": os.path.join(run_dir, "model"), "best_dir": os.path.join(run_dir, "best_model")}
+    for d in dirs.values():
+        os.makedirs(d, exist_ok=True)
+    return PPO(True, space.shape[0], actions, **dirs, **config["agent"])
+
+
+def build(config, run_dir):
+    '''(env, ppo, pruner) of a run'''
+    from pruner import EpisodePruner
+
+    env = make_env(config, config.get("seed"))
+    ppo = build_agent(config, run_dir)
+
+    pruner = None
+    if config["pruner"] is not None:
+        pruner = EpisodePruner(env, ppo.critic, **dict({"gamma": ppo.gamma}, **config["pruner"]))
+    return env, ppo, pruner
+
+
+def run_episode(env, ppo, pruner=None, log=None):
+    '''One training episode; its transitions go into the PPO buffer. `log(**values)`
+    receives the metrics of every step.'''
+    s, sin = env.reset()
+    mask = env.action_masks(sin, inlet=True)
+    if pruner is not None:
+        pruner.reset()
+    ret, done, pruned = 0., False, None
+    while not done:
+        a, p_d, c, p_c = ppo.select_action(s, mask)
+        t = time.perf_counter()
+        s_prime, r, done, _, sin = env.step({"discrete": a, "continuous": c}, sin)
+        seconds = time.perf_counter() - t
+        ret += r
+        dw = done
+        next_mask = mask
+        if not done:
+            next_mask = env.action_masks(sin)
+        if pruner is not None:
+            prune, _ = pruner.check(s_prime, sin, r, done)
+            if prune:
+                # Bootstrapped from the critic, not a terminal state
+                done, dw, pruned = True, False, pruner.reason
+        if log is not None:
+            log(**step_metrics(env.trajectory[-1], r, seconds))
+        ppo.put_data((s, a, c, r, s_prime, p_d, p_c, done, dw, mask))
+        s, mask = s_prime, next_mask
+    return ret, pruned
+
+
+def vector_episodes(venv, ppo, log=None):
+    '''Training episodes of a VectorFlowsheet, yielded as (return, record) when they
+    end. The transitions of an episode go into the PPO buffer together, so that the
+    buffer holds whole episodes one after the other.'''
+    obs = venv.reset()
+    pending = [[] for _ in range(venv.n)]
+    returns = [0.]*venv.n
+    while True:
+        picks = [ppo.select_action(s, mask) for s, mask in obs]
+        t = time.perf_counter()
+        results = venv.step([{"discrete": a, "continuous": c} for a, _, c, _ in picks])
+        seconds = time.perf_counter() - t
+        for i, res in enumerate(results):
+            (s, mask), (a, p_d, c, p_c) = obs[i], picks[i]
+            r, done = res["reward"], res["done"]
+            returns[i] += r
+            if log is not None:
+                log(env=i, **step_metrics(res["step"], r, seconds))
+            pending[i].append((s, a, c, r, res["state"], p_d, p_c, done, done, mask))
+            obs[i] = res["reset"] if done else (res["state"], res["mask"])
+            if done:
+                for transition in pending[i]:
+                    ppo.put_data(transition)
+                ret, pending[i], returns[i] = returns[i], [], 0.
+                yield ret, res["record"]
+
+
+def step_metrics(step, reward, seconds):
+    return {"iter": step["iter"], "action": step["d_action"], "reward": reward, "seconds": seconds,
+            "converged": step["converged"], "fidelity": step["resolved"].get("fidelity"),
+            "terms": dict(step.get("terms", {}))}
+
+
+def evaluate(env, ppo, episodes=1, scenarios=None):
+    '''Returns and episode records of the deterministic policy, always solved with
+    the rigorous column models. A ScenarioFlowsheet runs episode i in the feed
+    conditions scenarios[i] when given.'''
+    env.final_evaluation = True
+    results = []
+    try:
+        for i in range(episodes):
+            s, sin = env.reset() if scenarios is None else env.reset(scenarios[i % len(scenarios)])
+            mask = env.action_masks(sin, inlet=True)
+            ret, done = 0., False
+            while not done:
+                a, c = ppo.evaluate(s, mask)
+                s, r, done, _, sin = env.step({"discrete": a, "continuous": c}, sin)
+                ret += r
+                if not done:
+                    mask = env.action_masks(sin)
+            results.append((ret, env.episode_record()))
+    finally:
+        env.final_evaluation = False
+    return results
+
+
+def reward_terms(steps):
+    from reward import TERMS
+    terms = dict.fromkeys(TERMS, 0.)
+    for step in steps:
+        for k, v in step.get("terms", {}).items():
+            terms[k] += v
+    return terms
+
+
+def engine_stats(env, pruner=None):
+    '''Cumulative column solves (and the share screened by the shortcut model),
+    engine recovery and pruning counters'''
+    solves = dict(env.column_solves)
+    total = sum(solves.values())
+    stats = {"column_solves": solves, "screened": solves["shortcut"]/total if total else 0.}
+    if env.recovery is not None:
+        stats["recovery"] = dict(env.recovery.stats)
+    if pruner is not None:
+        stats["pruner"] = pruner.stats()
+    return stats
+
+
+def _float(x):
+    return float(x.mean().item()) if hasattr(x, "mean") else float(x)
+
+
+def train(config, run_dir, resume=True):
+    '''Train one run. Returns its summary.'''
+    import torch
+    from checkpoint import Checkpointer
+    from archive import DesignArchive
+    from pretrain import parameter_masks
+    from metrics import MetricsWriter
+    from scenarios import VectorFlowsheet, variables
+    import gauge
+    from policy import export
+    from reward import write_trajectory
+
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    if config["threads"]:
+        torch.set_num_threads(config["threads"])
+    seed_everything(config["seed"])
+
+    env, ppo, pruner = build(config, run_dir)
+    venv, episodes, scenarios = None, None, None
+    if config["scenarios"] is not None:
+        # The same evaluation scenarios throughout the run
+        rng = np.random.default_rng(config.get("seed"))
+        scenarios = [env.feeds.sample(rng) for _ in range(config["eval_episodes"])]
+    if config["envs"] > 1:
+        if pruner is not None:
+            raise ValueError("The episode pruner needs a single environment (envs=1)")
+        # With the remote backend, the evaluation env keeps its server document and
+        # the workers step the next ones
+        doc = int(os.environ.get("AUTOPROCRL_SIMSERVER_DOC", 0))
+        venv = VectorFlowsheet(make_env, config, config["envs"], config.get("seed"), first_document=doc + 1)
+    archive = DesignArchive(config["archive_capacity"])
+    checkpointer = Checkpointer(os.path.join(run_dir, "checkpoints"), keep=config["keep"])
+
+    start, best, updates = 0, -np.inf, 0
+    resumed = checkpointer.resume(ppo) if resume else None
+    if resumed is not None:
+        start, extra = resumed
+        best, updates, archive = extra["best"], extra["updates"], extra["archive"]
+        if pruner is not None:
+            pruner.returns.extend(extra["pruner"]["returns"])
+            pruner.lengths.extend(extra["pruner"]["lengths"])
+        if extra.get("feeds") is not None:
+            env.rng.bit_generator.state = extra["feeds"]
+
+    def checkpoint(episode):
+        pruner_state = {"returns": list(pruner.returns), "lengths": list(pruner.lengths)} if pruner else None
+        # The feed draws of the scenario env. With envs > 1 the workers' feed draws
+        # and their episodes in flight are not saved: a resumed run starts them anew.
+        feeds = env.rng.bit_generator.state if scenarios is not None else None
+        checkpointer.save(ppo, episode, best=best, updates=updates, archive=archive, pruner=pruner_state,
+                          feeds=feeds)
+
+    metrics = MetricsWriter(os.path.join(run_dir, "metrics.jsonl"), config["metrics_flush"])
+    log = metrics.log
+
+    t0 = time.time()
+    try:
+        if venv is not None:
+            episodes = vector_episodes(venv, ppo, (lambda **values: log("step", **values)) if config["log_steps"] else None)
+        for episode in range(start, config["episodes"]):
+            t = time.time()
+            if venv is None:
+                log_step = (lambda **values: log("step", episode=episode, **values)) if config["log_steps"] else None
+                ret, pruned = run_episode(env, ppo, pruner, log_step)
+                record = env.episode_record()
+            else:
+                (ret, record), pruned = next(episodes), None
+            archive.add(record)
+            steps = record["steps"]
+            feed = {"feed": variables(record["inlet_specs"])} if scenarios is not None else {}
+            log("episode", episode=episode, ret=ret, length=len(steps), pruned=pruned,
+                seconds=time.time() - t, failures=sum(not s["converged"] for s in steps),
+                actions=[s["d_action"] for s in steps], terms=reward_terms(steps), **feed)
+
+            if len(ppo.data) >= config["update_every"]:
+                a_loss, c_loss, entropy = ppo.train()
+                updates += 1
+                log("update", episode=episode, update=updates, a_loss_d=_float(a_loss[0]),
+                    a_loss_c=_float(a_loss[1]), c_loss=_float(c_loss), entropy_d=_float(entropy[0]),
+                    entropy_c=_float(entropy[1]), entropy_coef=ppo.entropy_coef)
+
+                if config["sil_every"] and updates % config["sil_every"] == 0 and len(archive):
+                    s, masks, acts_d, acts_c, returns = archive.transitions(archive.sample(config["sil_batch"]), ppo.gamma)
+                    a_loss, c_loss = ppo.sil_update(s, masks, acts_d, acts_c, parameter_masks(acts_d), returns)
+                    log("sil", episode=episode, a_loss=_float(a_loss), c_loss=_float(c_loss))
+
+            done = episode + 1
+            if config["eval_every"] and (done % config["eval_every"] == 0 or done == config["episodes"]):
+                results = evaluate(env, ppo, config["eval_episodes"], scenarios)
+                ret = float(np.mean([r for r, _ in results]))
+                improved = ret > best
+                if improved:
+                    best = ret
+                    ppo.best_save()
+                    export(ppo.actor, os.path.join(run_dir, "policy.npz"), critic=ppo.critic)
+                    for r, record in results:
+                        write_trajectory(os.path.join(run_dir, "designs.jsonl"), dict(record, episode=done, ret=r))
+                log("eval", episode=done, ret=ret, best=best, improved=improved,
+                    actions=[s["d_action"] for s in results[0][1]["steps"]], **engine_stats(venv or env, pruner),
+                    memory=gauge.sample(objects=False))
+                print(f"[{config['name']}] episode {done}: eval {ret:.3f} (best {best:.3f}), "
+                      f"{time.time() - t0:.0f} s", flush=True)
+
+            if config["save_every"] and done % config["save_every"] == 0:
+                ppo.save(done)
+            if config["checkpoint_every"] and done % config["checkpoint_every"] == 0:
+                checkpoint(done)
+
+        archive.save(os.path.join(run_dir, "archive.jsonl"))
+        checkpoint(config["episodes"])
+    finally:
+        if venv is not None:
+            venv.close()
+        metrics.close()
+        checkpointer.close()
+
+    return {"name": config["name"], "status": "done", "best": best, "updates": updates,
+            "seconds": time.time() - t0}
+
+
+
+# ------------------------------------ Parallel runs ------------------------------------
+_documents = None
+
+def _worker_init(documents):
+    global _documents
+    _documents = documents
+
+def _worker_run(item):
+    config, run_dir, resume = item
+    # With the remote backend every worker is pointed at its own server document
+    if _documents is not None and "AUTOPROCRL_SIMSERVER_DOC" not in os.environ:
+        os.environ["AUTOPROCRL_SIMSERVER_DOC"] = str(_documents.get())
+    try:
+        return train(config, run_dir, resume)
+    except Exception:
+        return {"name": config["name"], "status": "failed", "error": traceback.format_exc()}
+
+
+def launch(config, workers=1, resume=True):
+    '''Run every seed and sweep setting of a config, `workers` at a time.
+    Returns the run summaries.'''
+    runs = expand(config)
+    out = os.path.abspath(config["out"])
+    config["directory"] = os.path.abspath(config["directory"])
+    items = []
+    for run in runs:
+        run["directory"] = config["directory"]
+        if workers > 1 and run["threads"] is None:
+            run["threads"] = 1
+        items.append((run, os.path.join(out, run["name"]), resume))
+
+    if workers > 1 and config["envs"] > 1:
+        raise ValueError("Runs with envs > 1 start their own environment processes, train them with --workers 1")
+    if workers <= 1:
+        summaries = [_worker_run(item) for item in items]
+    else:
+        ctx = mp.get_context("spawn")
+        documents = None
+        if (config["backend"] or os.environ.get("AUTOPROCRL_BACKEND")) == "remote":
+            documents = ctx.Queue()
+            for i in range(workers):
+                documents.put(i)
+        with ctx.Pool(min(workers, len(items)), initializer=_worker_init, initargs=(documents,),
+                      maxtasksperchild=1 if documents is None else None) as pool:
+            summaries = pool.map(_worker_run, items, chunksize=1)
+
+    os.makedirs(os.path.join(out, config["name"]), exist_ok=True)
+    with open(os.path.join(out, config["name"], "summary.json"), "w") as f:
+        json.dump(summaries, f, indent=2)
+    return summaries
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train PPO on the Flowsheet environment")
+    parser.add_argument("config", nargs="?", help="JSON config (see train.DEFAULTS)")
+    parser.add_argument("--set", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="override config entries, e.g. agent.lr=3e-4 episodes=500")
+    parser.add_argument("--seeds", nargs="*", type=int)
+    parser.add_argument("--workers", type=int, default=1, help="runs trained in parallel")
+    parser.add_argument("--out", help="output directory of the runs")
+    parser.add_argument("--fresh", action="store_true", help="do not resume from checkpoints")
+    parser.add_argument("--dump-config", action="store_true", help="print the resolved config and exit")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.set)
+    if args.seeds:
+        config["seeds"] = args.seeds
+    if args.out:
+        config["out"] = args.out
+    if args.dump_config:
+        print(json.dumps(config, indent=2))
+        sys.exit(0)
+
+    summaries = launch(config, args.workers, resume=not args.fresh)
+    for s in summaries:
+        if s["status"] == "done":
+            print(f"{s['name']}: best {s['best']:.3f}, {s['updates']} updates, {s['seconds']:.0f} s")
+        else:
+            print(f"{s['name']}: failed\n{s['error']}")
+    sys.exit(0 if all(s["status"] == "done" for s in summaries) else 1)
@@ -0,0 +1,105 @@
+import struct
+
+
+# Compact tagged binary encoding for the values exchanged with the simulator
+# (None, bool, int, float, str, bytes and nested lists/tuples/dicts).
+
+_INT = struct.Struct("!q")
+_FLOAT = struct.Struct("!d")
+_LEN = struct.Struct("!I")
+
+
+def encode(value):
+    out = bytearray()
+    _encode(value, out)
+    return bytes(out)
+
+
+def _encode(value, out):
+    if value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        out += b"i" + _INT.pack(value)
+    elif isinstance(value, float):
+        out += b"d" + _FLOAT.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += b"s" + _LEN.pack(len(data)) + data
+    elif isinstance(value, (bytes, bytearray)):
+        out += b"b" + _LEN.pack(len(value)) + value
+    elif isinstance(value, (list, tuple)):
+        out += b"l" + _LEN.pack(len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out += b"m" + _LEN.pack(len(value))
+        for k, v in value.items():
+            _encode(k, out)
+            _encode(v, out)
+    elif getattr(value, "ndim", 0) > 0 and hasattr(value, "tolist"):
+        # NumPy arrays
+        _encode(value.tolist(), out)
+    elif hasattr(value, "item"):
+        # NumPy scalars and 0-d arrays
+        _encode(value.item(), out)
+    else:
+        raise TypeError(f"Cannot encode value of type {type(value).__name__}")
+
+
+def decode(data):
+    value, pos = _decode(memoryview(data), 0)
+    if pos != len(data):
+        raise ValueError("Trailing bytes after encoded value")
+    return value
+
+
+def _decode(buf, pos):
+    tag = bytes(buf[pos:pos + 1])
+    pos += 1
+    if tag == b"N":
+        return None, pos
+    if tag == b"T":
+        return True, pos
+    if tag == b"F":
+        return False, pos
+    if tag == b"i":
+        return _INT.unpack_from(buf, pos)[0], pos + 8
+    if tag == b"d":
+        return _FLOAT.unpack_from(buf, pos)[0], pos + 8
+    if tag in (b"s", b"b"):
+        n = _LEN.unpack_from(buf, pos)[0]
+        pos += 4
+        data = bytes(buf[pos:pos + n])
+        return (data.decode("utf-8") if tag == b"s" else data), pos + n
+    if tag == b"l":
+        n = _LEN.unpack_from(buf, pos)[0]
+        pos += 4
+        items = []
+        for _ in range(n):
+            item, pos = _decode(buf, pos)
+            items.append(item)
+        return items, pos
+    if tag == b"m":
+        n = _LEN.unpack_from(buf, pos)[0]
+        pos += 4
+        items = {}
+        for _ in range(n):
+            k, pos = _decode(buf, pos)
+            v, pos = _decode(buf, pos)
+            items[k] = v
+        return items, pos
+    raise ValueError(f"Unknown tag {tag!r}")
+
+
+def recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        buf += chunk
+    return bytes(buf)